@@ -12,21 +12,89 @@ doctype_js = {
     "Sales Invoice": "public/js/sales_invoice.js",
     "Sales Order": "public/js/sales_order.js",
     "Quotation": "public/js/quotation.js",
-    "Customer Statement": "public/js/customer_statement.js"
+    "Customer Statement": "public/js/customer_statement.js",
+    "Delivery Note": "public/js/delivery_note.js"
 }
+doctype_list_js = {
+    "Customer Statement": "public/js/customer_statement_list.js"
+}
+
+boot_session = "surgishop_custom.logic.sales_person.boot_session"
+
+# Push buffered app_log events to Redis once per request / background job
+after_request = ["surgishop_custom.logic.app_log.flush_buffer"]
+after_job = ["surgishop_custom.logic.app_log.flush_buffer"]
 
 # 2. Connect Server Scripts (Python)
 doc_events = {
     "Sales Invoice": {
-        "before_submit": "surgishop_custom.logic.sales_invoice.auto_send_setup"
+        "validate": "surgishop_custom.logic.customer_lock.validate_customer",
+        "before_submit": "surgishop_custom.logic.sales_invoice.auto_send_setup",
+        "on_submit": [
+            "surgishop_custom.logic.customer_credit.mark_dirty",
+            "surgishop_custom.logic.shipment_lineage.record_shipment"
+        ],
+        "on_update": "surgishop_custom.logic.pdf_cache.invalidate",
+        "on_update_after_submit": "surgishop_custom.logic.pdf_cache.invalidate",
+        "on_cancel": [
+            "surgishop_custom.logic.pdf_cache.invalidate",
+            "surgishop_custom.logic.customer_credit.mark_dirty",
+            "surgishop_custom.logic.shipment_lineage.remove_shipment"
+        ],
+        "on_trash": "surgishop_custom.logic.pdf_cache.invalidate"
+    },
+    "Customer": {
+        "on_update": "surgishop_custom.logic.customer_lock.invalidate",
+        "after_rename": "surgishop_custom.logic.customer_lock.invalidate",
+        "on_trash": "surgishop_custom.logic.customer_lock.invalidate"
+    },
+    "User": {
+        "on_update": "surgishop_custom.logic.sales_person.invalidate",
+        "after_rename": "surgishop_custom.logic.sales_person.invalidate",
+        "on_trash": "surgishop_custom.logic.sales_person.invalidate"
+    },
+    "Employee": {
+        "on_update": "surgishop_custom.logic.sales_person.invalidate",
+        "after_rename": "surgishop_custom.logic.sales_person.invalidate",
+        "on_trash": "surgishop_custom.logic.sales_person.invalidate"
+    },
+    "Sales Person": {
+        "on_update": "surgishop_custom.logic.sales_person.invalidate",
+        "after_rename": "surgishop_custom.logic.sales_person.invalidate",
+        "on_trash": "surgishop_custom.logic.sales_person.invalidate"
+    },
+    "Payment Entry": {
+        "on_submit": "surgishop_custom.logic.customer_credit.mark_dirty",
+        "on_cancel": "surgishop_custom.logic.customer_credit.mark_dirty"
+    },
+    "GL Entry": {
+        "on_submit": "surgishop_custom.logic.customer_credit.mark_dirty"
     },
     "Delivery Note": {
+        "validate": "surgishop_custom.logic.customer_lock.validate_customer",
         "after_submit": [
-            "surgishop_custom.logic.delivery_note.to_packing_list",
-            "surgishop_custom.logic.delivery_note.to_sales_invoice"
-        ]
+            "surgishop_custom.logic.delivery_note.queue_post_submit",
+            "surgishop_custom.logic.shipment_lineage.record_shipment"
+        ],
+        "on_update": "surgishop_custom.logic.pdf_cache.invalidate",
+        "on_update_after_submit": "surgishop_custom.logic.pdf_cache.invalidate",
+        "on_cancel": [
+            "surgishop_custom.logic.pdf_cache.invalidate",
+            "surgishop_custom.logic.shipment_lineage.remove_shipment"
+        ],
+        "on_trash": "surgishop_custom.logic.pdf_cache.invalidate"
+    },
+    "Packing Slip": {
+        "on_update": "surgishop_custom.logic.pdf_cache.invalidate",
+        "on_update_after_submit": "surgishop_custom.logic.pdf_cache.invalidate",
+        "on_cancel": "surgishop_custom.logic.pdf_cache.invalidate",
+        "on_trash": "surgishop_custom.logic.pdf_cache.invalidate"
+    },
+    "Quotation": {
+        "validate": "surgishop_custom.logic.customer_lock.validate_customer"
     },
     "Sales Order": {
+        "validate": "surgishop_custom.logic.customer_lock.validate_customer",
         "after_submit": "surgishop_custom.logic.sales_order.create_delivery_note"
     },
     "Purchase Receipt": {
@@ -34,9 +102,71 @@ doc_events = {
     },
     "Email Queue": {
         "after_save": "surgishop_custom.logic.email_queue.bounce_notification"
+    },
+    "Batch": {
+        "after_insert": "surgishop_custom.logic.recall_watch.check_new_batch",
+        "on_update": [
+            "surgishop_custom.logic.udi_index.index_batch",
+            "surgishop_custom.logic.recall_fingerprint.batch_changed"
+        ],
+        "after_rename": [
+            "surgishop_custom.logic.udi_index.rename_batch",
+            "surgishop_custom.logic.recall_fingerprint.bump_inventory_version"
+        ],
+        "on_trash": "surgishop_custom.logic.udi_index.remove_batch"
+    },
+    "Item": {
+        "on_update": [
+            "surgishop_custom.logic.recall_fingerprint.item_changed",
+            "surgishop_custom.logic.fuzzy_index.index_item"
+        ],
+        "after_rename": [
+            "surgishop_custom.logic.recall_fingerprint.item_changed",
+            "surgishop_custom.logic.fuzzy_index.rename_item"
+        ],
+        "on_trash": [
+            "surgishop_custom.logic.recall_fingerprint.item_changed",
+            "surgishop_custom.logic.fuzzy_index.remove_item"
+        ]
+    },
+    "Item Manufacturer": {
+        "on_update": [
+            "surgishop_custom.logic.fuzzy_index.index_manufacturer_part",
+            "surgishop_custom.logic.recall_fingerprint.bump_inventory_version"
+        ],
+        "after_delete": [
+            "surgishop_custom.logic.fuzzy_index.index_manufacturer_part",
+            "surgishop_custom.logic.recall_fingerprint.bump_inventory_version"
+        ]
     }
 }
 
-# 3. Connect API Methods
+# 3. Scheduled Jobs
+scheduler_events = {
+    "cron": {
+        "* * * * *": [
+            "surgishop_custom.logic.email_queue.flush_bounce_alerts",
+            "surgishop_custom.logic.delivery_note.retry_post_submit",
+            "surgishop_custom.logic.print_queue.process_print_queue",
+            "surgishop_custom.logic.sales_order.process_bulk_pending",
+            "surgishop_custom.logic.sales_invoice.send_pending_invoices",
+            "surgishop_custom.logic.app_log.flush_events"
+        ],
+        "30 1 * * *": [
+            "surgishop_custom.logic.customer_credit.reconcile_all"
+        ],
+        "0 2 * * *": [
+            "surgishop_custom.logic.consolidated_invoicing.create_consolidated_invoices"
+        ]
+    }
+}
+
+# 4. Connect API Methods
 # This replaces your "API" type Server Scripts
 # Accessible via: /api/method/surgishop_custom.api.check_recall_inventory
+
+# 5. Override Standard API Methods
+# Manual PDF downloads of invoices, DNs and Packing Slips use the PDF cache
+override_whitelisted_methods = {
+    "frappe.utils.print_format.download_pdf": "surgishop_custom.logic.pdf_cache.download_pdf"
+}
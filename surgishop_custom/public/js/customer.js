@@ -58,28 +58,21 @@ function update_credit_limit(frm) {
 // Customer Credit Field
 function update_customer_credit(frm) {
     if (frm.is_new()) return;
-    
-    // The frappe.call is used to execute a Python function on the server side
+
+    // Read the server-side credit snapshot instead of aggregating the GL
     frappe.call({
-        // Function to call for calculating the customer/party balance on a given date
-        method: "erpnext.accounts.utils.get_balance_on",
+        method: "surgishop_custom.logic.customer_credit.get_customer_credit",
         args: {
-            // The balance must be calculated up to the current date (today)
-            date: frappe.datetime.nowdate(),
-            party_type: 'Customer',
-            // The name of the current Customer being viewed
-            party: frm.doc.name
+            customer: frm.doc.name
         },
         callback: function(r) {
             if (r.message) {
-                // r.message contains the calculated balance (e.g., -100.00 for a credit)
-                var balance = r.message;
-                
-                // Set the value of your custom field
-                frm.set_value('custom_customer_credit', balance);
-                
-                // Refresh the field to display the new value immediately
+                // Update the displayed values without dirtying the form
+                frm.doc.custom_customer_credit = r.message.balance;
+                frm.doc.custom_account_lock_days_overdue = r.message.oldest_overdue_days;
                 frm.refresh_field('custom_customer_credit');
+                frm.refresh_field('custom_account_lock_days_overdue');
+                update_lock_banner(frm);
             }
         }
     });
@@ -103,8 +96,6 @@ function update_lock_banner(frm) {
 
     const overdue_days = frm.doc[overdue_field] || 0;
 
-    console.log("Overdue days:", overdue_days);  // DEBUG: confirm value
-
     let banner_html = "";
 
     if (overdue_days >= 50) {
@@ -0,0 +1,51 @@
+// Bulk Customer Statement run
+frappe.listview_settings['Customer Statement'] = {
+    onload: function(listview) {
+        if (!frappe.user.has_role('Accounts Manager') && !frappe.user.has_role('System Manager')) return;
+
+        listview.page.add_inner_button(__('Bulk Statements'), function() {
+            let dialog = new frappe.ui.Dialog({
+                title: __('Bulk Customer Statements'),
+                fields: [
+                    { fieldname: 'statement_date', fieldtype: 'Date', label: __('Statement Date'), reqd: 1, default: frappe.datetime.get_today() },
+                    { fieldname: 'from_date', fieldtype: 'Date', label: __('Transactions From') },
+                    { fieldname: 'customer_group', fieldtype: 'Link', label: __('Customer Group'), options: 'Customer Group' },
+                    { fieldname: 'email', fieldtype: 'Check', label: __('Email each customer their statement') }
+                ],
+                primary_action_label: __('Start'),
+                primary_action: function(values) {
+                    dialog.hide();
+                    frappe.call({
+                        method: 'surgishop_custom.logic.customer_statement.start_statement_run',
+                        args: values,
+                        callback: function(r) {
+                            if (r.message) {
+                                frappe.show_alert({
+                                    message: __('Rendering statements for {0} customers', [r.message.customers]),
+                                    indicator: 'blue'
+                                }, 5);
+                            }
+                        }
+                    });
+                }
+            });
+            dialog.show();
+        });
+
+        // Progress and the finished ZIP arrive over realtime
+        frappe.realtime.on('statement_run_progress', function(progress) {
+            if (['Completed', 'Completed with Errors'].includes(progress.status) && progress.file_url) {
+                frappe.hide_progress();
+                frappe.msgprint({
+                    title: __('Statements Ready'),
+                    message: __('{0} statements rendered ({1} per minute). <a href="{2}">Download ZIP</a>',
+                        [progress.rendered, progress.documents_per_minute, progress.file_url]),
+                    indicator: progress.failed_customers || progress.status !== 'Completed' ? 'orange' : 'green'
+                });
+            } else {
+                frappe.show_progress(__('Customer Statements'), progress.rendered, progress.documents,
+                    __('{0} per minute', [progress.documents_per_minute]));
+            }
+        });
+    }
+};
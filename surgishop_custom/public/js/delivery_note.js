@@ -0,0 +1,57 @@
+// Post-Submit Automation Status (Packing Slip -> Print -> Sales Invoice)
+frappe.ui.form.on('Delivery Note', {
+    refresh: function(frm) {
+        if (frm.doc.docstatus !== 1) return;
+
+        frappe.call({
+            method: "surgishop_custom.logic.delivery_note.get_post_submit_status",
+            args: { delivery_note: frm.doc.name },
+            callback: function(r) {
+                show_post_submit_status(frm, r.message);
+            }
+        });
+    }
+});
+
+function show_post_submit_status(frm, state) {
+    if (!state) return;
+
+    const colors = {
+        'Queued': 'blue',
+        'Running': 'blue',
+        'Retrying': 'orange',
+        'Failed': 'red',
+        'Completed': 'green',
+        'Cancelled': 'gray'
+    };
+
+    let parts = [];
+    if (state.packing_slip) {
+        parts.push(__("Packing Slip {0}", [state.packing_slip]) + (state.printed ? " (" + __("printed") + ")" : ""));
+    }
+    if (state.sales_invoice) {
+        parts.push(__("Sales Invoice {0}", [state.sales_invoice]));
+    }
+
+    let message = __("Automation: {0}", [__(state.status)]);
+    if (parts.length) {
+        message += " — " + parts.join(", ");
+    }
+    if (state.last_error && state.status !== 'Completed') {
+        message += "<br><small>" + frappe.utils.escape_html(state.last_error) + "</small>";
+    }
+
+    frm.dashboard.set_headline_alert(message, colors[state.status] || 'gray');
+
+    if (state.status === 'Failed' || state.status === 'Retrying') {
+        frm.add_custom_button(__('Retry Automation'), function() {
+            frappe.call({
+                method: "surgishop_custom.logic.delivery_note.retry_post_submit_now",
+                args: { delivery_note: frm.doc.name },
+                callback: function(r) {
+                    show_post_submit_status(frm, r.message);
+                }
+            });
+        });
+    }
+}
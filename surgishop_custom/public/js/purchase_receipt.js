@@ -42,10 +42,23 @@ console.log('--- Purchase Receipt Totals Script Loaded ---');
 
         const totalReceived = totalAccepted + totalBlemish + totalRejected;
 
-        frm.set_value('total_qty', flt(totalAccepted));
-        frm.set_value('custom_total_blemish_quantity', flt(totalBlemish));
-        frm.set_value('custom_total_rejected_quantity', flt(totalRejected));
-        frm.set_value('custom_total_received', flt(totalReceived));
+        // Only touch fields whose total changed, so a keystroke does not
+        // dirty and re-render four fields on a receipt with thousands of rows
+        const totals = {
+            total_qty: flt(totalAccepted),
+            custom_total_blemish_quantity: flt(totalBlemish),
+            custom_total_rejected_quantity: flt(totalRejected),
+            custom_total_received: flt(totalReceived),
+        };
+        const changed = {};
+        Object.keys(totals).forEach((fieldname) => {
+            if (flt(frm.doc[fieldname]) !== totals[fieldname]) {
+                changed[fieldname] = totals[fieldname];
+            }
+        });
+        if (Object.keys(changed).length) {
+            frm.set_value(changed);
+        }
     };
 
     frappe.ui.form.on('Purchase Receipt Item', {
@@ -24,39 +24,18 @@ frappe.ui.form.on('Quotation', {
         if (frm.doc.customer) {
             check_customer_lock(frm);
         }
-    },
-    
-    validate: function(frm) {
-        // Block saving if locked
-        if (frm.doc.customer) {
-            frappe.call({
-                method: "frappe.client.get_value",
-                args: {
-                    doctype: "Customer",
-                    fieldname: "custom_account_locked",
-                    filters: { name: frm.doc.customer }
-                },
-                async: false,
-                callback: function (r) {
-                    if (r.message && r.message.custom_account_locked) {
-                        frappe.throw(__("This customer is locked and cannot be used for " + frm.doctype + "."));
-                    }
-                }
-            });
-        }
     }
+    // Saving for a locked customer is blocked by the server-side validate hook
 });
 
 function check_customer_lock(frm) {
     frappe.call({
-        method: "frappe.client.get_value",
+        method: "surgishop_custom.logic.customer_lock.get_customer_lock",
         args: {
-            doctype: "Customer",
-            fieldname: "custom_account_locked",
-            filters: { name: frm.doc.customer }
+            customer: frm.doc.customer
         },
         callback: function (r) {
-            if (r.message && r.message.custom_account_locked) {
+            if (r.message && r.message.locked) {
                 frappe.msgprint({
                     title: __("Customer Locked"),
                     message: __("This customer is locked and cannot be used for " + frm.doctype + "."),
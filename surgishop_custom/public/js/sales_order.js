@@ -4,58 +4,20 @@ frappe.ui.form.on('Sales Order', {
         // Only run this logic for a new Sales Order (draft status) and if Sales Team is empty
         if (frm.doc.docstatus === 0 && frm.doc.__islocal === 1 && frm.doc.sales_team.length === 0) {
             
-            // Call a safer method that handles the Sales Person lookup
+            // The default Sales Person comes with the boot payload
+            if (frappe.boot.default_sales_person !== undefined) {
+                if (frappe.boot.default_sales_person) {
+                    add_sales_person_to_team(frm, frappe.boot.default_sales_person);
+                }
+                return;
+            }
+
+            // Sessions booted before the app was updated resolve it in one call
             frappe.call({
-                method: "frappe.client.get",
-                args: {
-                    doctype: "User",
-                    name: frappe.session.user
-                },
+                method: "surgishop_custom.logic.sales_person.get_sales_person",
                 callback: function(r) {
                     if (r.message) {
-                        var sales_person_name = null;
-                        
-                        // Try to get sales_person field if it exists
-                        if (r.message.sales_person) {
-                            sales_person_name = r.message.sales_person;
-                        }
-                        // Alternative: Check if there's an employee link, then get sales person from employee
-                        else if (r.message.employee) {
-                            frappe.call({
-                                method: "frappe.client.get",
-                                args: {
-                                    doctype: "Employee",
-                                    name: r.message.employee
-                                },
-                                callback: function(emp_r) {
-                                    if (emp_r.message && emp_r.message.name) {
-                                        // Check if there's a Sales Person with the same name as Employee
-                                        frappe.call({
-                                            method: "frappe.client.get_list",
-                                            args: {
-                                                doctype: "Sales Person",
-                                                filters: {
-                                                    "employee": emp_r.message.name
-                                                },
-                                                fields: ["name"],
-                                                limit: 1
-                                            },
-                                            callback: function(sp_r) {
-                                                if (sp_r.message && sp_r.message.length > 0) {
-                                                    add_sales_person_to_team(frm, sp_r.message[0].name);
-                                                }
-                                            }
-                                        });
-                                    }
-                                }
-                            });
-                            return; // Exit here since we're doing async lookup
-                        }
-                        
-                        // If we found a sales person directly, add them
-                        if (sales_person_name) {
-                            add_sales_person_to_team(frm, sales_person_name);
-                        }
+                        add_sales_person_to_team(frm, r.message);
                     }
                 },
                 error: function(r) {
@@ -70,13 +32,12 @@ frappe.ui.form.on('Sales Order', {
         if (!frm.doc.customer) return;
 
         frappe.call({
-            method: "frappe.client.get",
+            method: "surgishop_custom.logic.customer_lock.get_customer_lock",
             args: {
-                doctype: "Customer",
-                name: frm.doc.customer
+                customer: frm.doc.customer
             },
             callback: function(r) {
-                if (r.message && r.message.custom_account_locked) {
+                if (r.message && r.message.locked) {
                     frappe.msgprint({
                         title: __("Customer Locked"),
                         message: __("This customer is locked and cannot be used for Sales Orders."),
@@ -1,86 +1,55 @@
 """
 API Endpoints for surgishop_custom
 """
+import time
+from collections import defaultdict
+
 import frappe
+from frappe.utils import cint, now
+
+from surgishop_custom.logic import app_log, fuzzy_index, gs1, recall_fingerprint, recall_watch, udi_index
+from surgishop_custom.logic.instrumentation import instrument
+
+MATCH_INSERT_CHUNK = 500
+RECALL_MATCH_FIELDS = (
+    'recall_number',
+    'fda_device_name',
+    'fda_product_code',
+    'match_type',
+    'erpnext_item_code',
+    'erpnext_item_name',
+    'erpnext_batch_number',
+    'recall_date',
+    'recall_status',
+    'fda_reason',
+    'notified',
+    'fda_recall_link',
+    'match_score',
+)
+RECALL_JOB_CHUNK = 500
+RECALL_JOB_TTL = 24 * 60 * 60
 
 
 @frappe.whitelist(allow_guest=False)
-def check_recall_inventory(recalls):
+@instrument
+def check_recall_inventory(recalls, force=0):
     """
     FDA Recall API
     Cross-reference FDA recalls against ERPNext inventory
     
     Args:
         recalls: List of recall dicts (already parsed by Frappe)
+        force: check every recall, even if unchanged since the last run
     
     Returns:
-        dict with matched_count and matches list
+        dict with matched_count, matches list and processed/skipped counts
     """
     # recalls should already be a list/dict, no parsing needed
     if not recalls:
         return {'success': False, 'matched_count': 0, 'matches': []}
     
-    matches = []
-    
-    for recall in recalls:
-        recall_number = recall.get('recall_number')
-        product_code = recall.get('product_code')
-        code_info = recall.get('code_info', '')
-        device_name = recall.get('device_name')
-        
-        # Extract UDI from code_info
-        udi_numbers = extract_udi_from_code_info(code_info)
-        
-        # Check 1: Match Product Code against Item Names
-        if product_code:
-            item_matches = frappe.get_all(
-                'Item',
-                filters={'item_name': product_code},
-                fields=['name', 'item_name']
-            )
-            
-            for item in item_matches:
-                # Check if already exists
-                if not frappe.db.exists('Recall Match', {
-                    'recall_number': recall_number,
-                    'erpnext_item_code': item.name,
-                    'match_type': 'Item Name Match'
-                }):
-                    match = create_recall_match(
-                        recall=recall,
-                        match_type='Item Name Match',
-                        item_code=item.name,
-                        item_name=item.item_name
-                    )
-                    matches.append(match)
-        
-        # Check 2: Match UDI against Batch Numbers
-        if udi_numbers:
-            for udi in udi_numbers:
-                batch_matches = frappe.db.sql("""
-                    SELECT name, item, batch_id
-                    FROM `tabBatch`
-                    WHERE batch_id LIKE %s
-                """, (f'%{udi}%',), as_dict=True)
-                
-                for batch in batch_matches:
-                    # Get item name
-                    item_name = frappe.db.get_value('Item', batch.item, 'item_name')
-                    
-                    # Check if already exists
-                    if not frappe.db.exists('Recall Match', {
-                        'recall_number': recall_number,
-                        'erpnext_batch_number': batch.name,
-                        'match_type': 'Batch UDI Match'
-                    }):
-                        match = create_recall_match(
-                            recall=recall,
-                            match_type='Batch UDI Match',
-                            item_code=batch.item,
-                            item_name=item_name,
-                            batch_number=batch.name
-                        )
-                        matches.append(match)
+    checked = check_recalls(recalls, force=cint(force))
+    matches = checked['matches']
     
     # Send email notification if matches found
     if matches:
@@ -91,47 +60,338 @@ def check_recall_inventory(recalls):
     return {
         'success': True,
         'matched_count': len(matches),
-        'matches': matches
+        'matches': matches,
+        'processed_count': checked['processed_count'],
+        'skipped_count': checked['skipped_count']
     }
 
 
-def extract_udi_from_code_info(code_info):
-    """Extract UDI numbers from code_info text using simple string operations"""
-    if not code_info:
-        return []
+@frappe.whitelist(allow_guest=False)
+@instrument
+def enqueue_recall_check(recalls, chunk_size=RECALL_JOB_CHUNK, force=0):
+    """
+    FDA Recall API (background)
+    Same as check_recall_inventory but runs as a background job
+    
+    Args:
+        recalls: List of recall dicts (already parsed by Frappe)
+        chunk_size: recalls matched and committed per step
+        force: check every recall, even if unchanged since the last run
+    
+    Returns:
+        dict with job_id to poll with get_recall_check_status
+    """
+    if not recalls:
+        return {'success': False, 'job_id': None}
+    
+    check_id = frappe.generate_hash(length=16)
+    _save_recall_job_progress(check_id, {
+        'status': 'Queued',
+        'owner': frappe.session.user,
+        'total': len(recalls),
+        'processed': 0,
+        'skipped_count': 0,
+        'matched_count': 0,
+        'queued_at': now()
+    })
+    
+    frappe.enqueue(
+        'surgishop_custom.api.run_recall_check_job',
+        queue='long',
+        timeout=4 * 60 * 60,
+        job_id=f'recall_check::{check_id}',
+        check_id=check_id,
+        recalls=recalls,
+        chunk_size=cint(chunk_size) or RECALL_JOB_CHUNK,
+        force=cint(force)
+    )
+    
+    return {'success': True, 'job_id': check_id}
+
+
+@frappe.whitelist(allow_guest=False)
+@instrument
+def get_recall_check_status(job_id):
+    """
+    Progress of a background recall check
+    Readable by the user who started the job and by System Managers
+    
+    Returns:
+        dict with status, processed/total, matched_count and eta_seconds;
+        'result' holds the check_recall_inventory response once Completed
+    """
+    progress = frappe.cache.get_value(_recall_job_key(job_id))
+    if not progress or not _can_read_recall_job(progress):
+        return {'job_id': job_id, 'status': 'Unknown'}
     
-    udi_numbers = []
-    text = str(code_info).upper()
+    return progress
+
+
+def _can_read_recall_job(progress):
+    return progress.get('owner') == frappe.session.user or 'System Manager' in frappe.get_roles()
+
+
+def run_recall_check_job(check_id, recalls, chunk_size=RECALL_JOB_CHUNK, force=0):
+    """Background job: match recalls chunk by chunk, committing after each chunk"""
+    started = time.monotonic()
+    progress = frappe.cache.get_value(_recall_job_key(check_id)) or {'total': len(recalls)}
+    progress.update({'status': 'Running', 'started_at': now()})
+    _save_recall_job_progress(check_id, progress)
     
-    # Split by newlines and process each line
-    for line in text.split('\n'):
-        if 'UDI' in line or 'GTIN' in line:
-            # Remove common separators and split
-            clean_line = line.replace(':', ' ').replace('(', ' ').replace(')', ' ').replace(',', ' ')
-            words = clean_line.split()
+    matches = []
+    skipped = 0
+    try:
+        for start in range(0, len(recalls), chunk_size):
+            chunk = recalls[start:start + chunk_size]
+            checked = check_recalls(chunk, force=force)
+            matches.extend(checked['matches'])
+            skipped += checked['skipped_count']
+            frappe.db.commit()
             
-            # Look for numeric strings that are 10+ digits (likely UDI/GTIN)
-            for word in words:
-                # Remove non-digit characters
-                digits = ''.join(c for c in word if c.isdigit())
-                if len(digits) >= 10:
-                    udi_numbers.append(digits)
+            processed = start + len(chunk)
+            elapsed = time.monotonic() - started
+            progress.update({
+                'processed': processed,
+                'skipped_count': skipped,
+                'matched_count': len(matches),
+                'elapsed_seconds': round(elapsed, 1),
+                'eta_seconds': round(elapsed / processed * (len(recalls) - processed), 1)
+            })
+            _save_recall_job_progress(check_id, progress)
+        
+        progress['status'] = 'Completed'
     
-    # Remove duplicates while preserving order
-    seen = set()
-    unique = []
-    for udi in udi_numbers:
-        if udi not in seen:
-            seen.add(udi)
-            unique.append(udi)
+    except Exception as e:
+        # The traceback goes to the log, the poller only sees the message
+        frappe.db.rollback()
+        progress.update({'status': 'Failed', 'error': str(e)})
+        app_log.error('recall_check_failed', ref=check_id, title='Recall check job failed')
+        raise
     
-    return unique
+    finally:
+        # Chunks committed before a failure still get their alert
+        if matches:
+            send_recall_notification(matches)
+            frappe.db.commit()
+        
+        progress['result'] = {
+            'success': progress['status'] == 'Completed',
+            'matched_count': len(matches),
+            'matches': matches,
+            'processed_count': progress.get('processed', 0) - skipped,
+            'skipped_count': skipped
+        }
+        progress['finished_at'] = now()
+        _save_recall_job_progress(check_id, progress)
 
 
-def create_recall_match(recall, match_type, item_code, item_name, batch_number=None):
-    """Create a Recall Match record"""
-    doc = frappe.get_doc({
-        'doctype': 'Recall Match',
+def _recall_job_key(check_id):
+    return f'surgishop_custom:recall_check:{check_id}'
+
+
+def _save_recall_job_progress(check_id, progress):
+    progress['job_id'] = check_id
+    frappe.cache.set_value(_recall_job_key(check_id), progress, expires_in_sec=RECALL_JOB_TTL)
+
+
+def check_recalls(recalls, force=False):
+    """
+    Match only the recalls that changed since they were last checked
+    
+    Returns:
+        dict with matches, processed_count and skipped_count
+    """
+    # Read the version before matching so inventory changed mid-run is seen next time
+    inventory_version = recall_fingerprint.get_inventory_version()
+    
+    if force:
+        changed, unchanged = recalls, []
+    else:
+        changed, unchanged = recall_fingerprint.split_unchanged(recalls, inventory_version)
+    
+    matches = match_recalls(changed) if changed else []
+    recall_fingerprint.record(changed, inventory_version)
+    recall_watch.index_recalls(changed)
+    
+    return {
+        'matches': matches,
+        'processed_count': len(changed),
+        'skipped_count': len(unchanged)
+    }
+
+
+def match_recalls(recalls):
+    """
+    Match recalls against Items and Batches and insert new Recall Match rows
+    
+    Works on the whole list at once: one query per lookup instead of one
+    per recall, UDI and candidate.
+    
+    Returns:
+        list of created match dicts, in recall order
+    """
+    parsed = gs1.parse_code_infos([recall.get('code_info', '') for recall in recalls])
+    
+    # Check 1 lookup: every Product Code against Item Names in one query
+    product_codes = {recall.get('product_code') for recall in recalls if recall.get('product_code')}
+    items_by_name = defaultdict(list)
+    if product_codes:
+        for item in frappe.get_all(
+            'Item',
+            filters={'item_name': ['in', list(product_codes)]},
+            fields=['name', 'item_name']
+        ):
+            items_by_name[_name_key(item.item_name)].append(item)
+    
+    # Check 2 lookup: every UDI against Batch Numbers in one index query
+    batches_by_udi = udi_index.find_batches([gtin for udi in parsed for gtin in udi['gtins']])
+    
+    # Check 3 lookup: lot numbers against Batch IDs of items carrying the GTIN
+    lot_batches = find_lot_batches(parsed)
+    
+    # Check 4 lookup: device names and product codes against the fuzzy Item index
+    fuzzy_items = {}
+    if fuzzy_index.is_built():
+        fuzzy_items = fuzzy_index.find_items({
+            i: [recall.get('device_name'), recall.get('product_code')] for i, recall in enumerate(recalls)
+        })
+    
+    batch_items = {batch.item for batches in batches_by_udi.values() for batch in batches if batch.item}
+    batch_items.update(batch.item for batch in lot_batches.values() if batch.item)
+    batch_items.update(candidate['item'] for candidates in fuzzy_items.values() for candidate in candidates)
+    item_names = {}
+    if batch_items:
+        item_names = dict(frappe.get_all(
+            'Item',
+            filters={'name': ['in', list(batch_items)]},
+            fields=['name', 'item_name'],
+            as_list=True
+        ))
+    
+    existing = get_existing_match_keys(recalls)
+    
+    rows = []
+    for i, (recall, udi) in enumerate(zip(recalls, parsed)):
+        recall_number = recall.get('recall_number')
+        product_code = recall.get('product_code')
+        
+        recall_batches = [batch for gtin in udi['gtins'] for batch in batches_by_udi[gtin]]
+        recall_batches.extend(
+            lot_batches[(gtin, lot)]
+            for gtin in udi['gtins']
+            for lot in udi['lots']
+            if (gtin, lot) in lot_batches
+        )
+        
+        name_matches = items_by_name.get(_name_key(product_code), []) if product_code else []
+        if product_code:
+            for item in name_matches:
+                key = (recall_number, 'Item Name Match', item.name)
+                if key in existing:
+                    continue
+                existing.add(key)
+                rows.append(build_recall_match(
+                    recall=recall,
+                    match_type='Item Name Match',
+                    item_code=item.name,
+                    item_name=item.item_name
+                ))
+        
+        for batch in recall_batches:
+            key = (recall_number, 'Batch UDI Match', batch.name)
+            if key in existing:
+                continue
+            existing.add(key)
+            rows.append(build_recall_match(
+                recall=recall,
+                match_type='Batch UDI Match',
+                item_code=batch.item,
+                item_name=item_names.get(batch.item),
+                batch_number=batch.name
+            ))
+        
+        exact_items = {item.name for item in name_matches}
+        for candidate in fuzzy_items.get(i, []):
+            key = (recall_number, 'Fuzzy Item Match', candidate['item'])
+            if candidate['item'] in exact_items or key in existing:
+                continue
+            existing.add(key)
+            rows.append(build_recall_match(
+                recall=recall,
+                match_type='Fuzzy Item Match',
+                item_code=candidate['item'],
+                item_name=item_names.get(candidate['item']),
+                score=candidate['score']
+            ))
+    
+    return insert_recall_matches(rows)
+
+
+def find_lot_batches(parsed):
+    """
+    Find Batches for (10) lot numbers in one query
+    
+    A lot number alone is too common to trust, so a batch only counts when
+    its item carries one of the recall's GTINs as a barcode.
+    
+    Returns:
+        dict mapping (gtin, lot) to the batch row
+    """
+    lots = {lot for udi in parsed if udi['gtins'] for lot in udi['lots']}
+    if not lots:
+        return {}
+    
+    rows = frappe.db.sql("""
+        SELECT b.name, b.item, b.batch_id, ib.barcode
+        FROM `tabBatch` b
+        INNER JOIN `tabItem Barcode` ib ON ib.parent = b.item AND ib.parenttype = 'Item'
+        WHERE b.batch_id IN %(lots)s
+    """, {'lots': tuple(lots)}, as_dict=True)
+    
+    lot_batches = {}
+    for row in rows:
+        gtin = gs1.normalize_gtin(row.barcode)
+        if gtin:
+            lot_batches[(gtin, row.batch_id.upper())] = frappe._dict(
+                name=row.name, item=row.item, batch_id=row.batch_id
+            )
+    
+    return lot_batches
+
+
+def _name_key(value):
+    """Compare names the way the database collation does (case and trailing space insensitive)"""
+    return str(value).rstrip().lower()
+
+
+def get_existing_match_keys(recalls):
+    """Load the keys of Recall Matches already recorded for these recalls in one query"""
+    recall_numbers = list({recall.get('recall_number') for recall in recalls if recall.get('recall_number')})
+    if not recall_numbers:
+        return set()
+    
+    existing = set()
+    for row in frappe.get_all(
+        'Recall Match',
+        filters={'recall_number': ['in', recall_numbers]},
+        fields=['recall_number', 'match_type', 'erpnext_item_code', 'erpnext_batch_number']
+    ):
+        if row.match_type == 'Batch UDI Match':
+            existing.add((row.recall_number, row.match_type, row.erpnext_batch_number))
+        else:
+            existing.add((row.recall_number, row.match_type, row.erpnext_item_code))
+    
+    return existing
+
+
+def extract_udi_from_code_info(code_info):
+    """Extract UDI device identifiers (GTIN-14) from code_info text"""
+    return gs1.parse_code_info(code_info)['gtins']
+
+
+def build_recall_match(recall, match_type, item_code, item_name, batch_number=None, score=None):
+    """Build the field values of a Recall Match record"""
+    return {
         'recall_number': recall.get('recall_number'),
         'fda_device_name': (recall.get('device_name', '') or '')[:140],
         'fda_product_code': (recall.get('product_code', '') or '')[:140],
@@ -143,19 +403,58 @@ def create_recall_match(recall, match_type, item_code, item_name, batch_number=N
         'recall_status': (recall.get('status', '') or '')[:140],
         'fda_reason': (recall.get('reason', '') or '')[:140],
         'notified': 0,
-        'fda_recall_link': f'http://192.168.1.176/recall/{recall.get("id", "")}'
-    })
+        'fda_recall_link': f'http://192.168.1.176/recall/{recall.get("id", "")}',
+        'match_score': score
+    }
+
+
+def create_recall_match(recall, match_type, item_code, item_name, batch_number=None):
+    """Create a Recall Match record"""
+    return insert_recall_matches([
+        build_recall_match(recall, match_type, item_code, item_name, batch_number)
+    ])[0]
+
+
+def insert_recall_matches(rows):
+    """
+    Insert Recall Match records in multi-row INSERTs
+    
+    Names come from the DocType's own naming rule. Rows whose name can only
+    be assigned by the database are inserted one at a time.
+    """
+    if not rows:
+        return []
     
-    doc.insert(ignore_permissions=True)
+    timestamp = now()
+    user = frappe.session.user
+    fields = ['name', 'owner', 'modified_by', 'creation', 'modified', 'docstatus', *RECALL_MATCH_FIELDS]
     
-    return {
-        'name': doc.name,
-        'recall_number': doc.recall_number,
-        'item_code': doc.erpnext_item_code,
-        'item_name': doc.erpnext_item_name,
-        'batch_number': doc.erpnext_batch_number,
-        'match_type': doc.match_type
-    }
+    values = []
+    matches = []
+    for row in rows:
+        doc = frappe.new_doc('Recall Match')
+        doc.update(row)
+        doc.set_new_name()
+        
+        if doc.name:
+            values.append([doc.name, user, user, timestamp, timestamp, 0, *(row[field] for field in RECALL_MATCH_FIELDS)])
+        else:
+            doc.db_insert()
+        
+        matches.append({
+            'name': doc.name,
+            'recall_number': doc.recall_number,
+            'item_code': doc.erpnext_item_code,
+            'item_name': doc.erpnext_item_name,
+            'batch_number': doc.erpnext_batch_number,
+            'match_type': doc.match_type,
+            'score': row.get('match_score')
+        })
+    
+    if values:
+        frappe.db.bulk_insert('Recall Match', fields, values, chunk_size=MATCH_INSERT_CHUNK)
+    
+    return matches
 
 
 def send_recall_notification(matches):
@@ -179,7 +478,7 @@ def send_recall_notification(matches):
         message += f"""
         <tr>
             <td>{match.get('recall_number', '')}</td>
-            <td>{match.get('match_type', '')}</td>
+            <td>{match.get('match_type', '')}{f" ({match['score']:.0%})" if match.get('score') else ''}</td>
             <td>{match.get('item_code', '')}</td>
             <td>{match.get('item_name', '')}</td>
             <td>{match.get('batch_number', 'N/A')}</td>
@@ -199,5 +498,9 @@ def send_recall_notification(matches):
     )
     
     # Mark as notified
-    for match in matches:
-        frappe.db.set_value('Recall Match', match['name'], 'notified', 1)
+    frappe.db.set_value(
+        'Recall Match',
+        {'name': ['in', [match['name'] for match in matches]]},
+        'notified',
+        1
+    )
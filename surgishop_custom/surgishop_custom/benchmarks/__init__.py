@@ -0,0 +1 @@
+# Benchmarks for surgishop_custom
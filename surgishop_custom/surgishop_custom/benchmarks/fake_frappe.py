@@ -0,0 +1,467 @@
+"""
+Minimal in-process stand-in for `frappe`
+
+Enough of the frappe API for the app's modules to import and for the pure
+hot paths (GS1 parsing, allow_blemish, print batching, invoice emails) to
+run without a site. Database calls are counted and answered from an
+in-memory document registry; anything that really needs a site raises.
+
+    from surgishop_custom.benchmarks import fake_frappe
+    fake = fake_frappe.install()
+"""
+import itertools
+import os
+import secrets
+import smtplib
+import sys
+import tempfile
+import types
+from datetime import date, datetime, timedelta
+from email.message import EmailMessage
+
+
+class _dict(dict):
+    """frappe._dict: attribute access on a dict"""
+
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            return None
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+    def __getstate__(self):
+        return self
+
+    def __setstate__(self, state):
+        self.update(state)
+
+    def copy(self):
+        return _dict(self)
+
+
+class ValidationError(Exception):
+    pass
+
+
+class NeedsSite(NotImplementedError):
+    pass
+
+
+def _flt(value, precision=None):
+    try:
+        number = float(value or 0)
+    except (TypeError, ValueError):
+        number = 0.0
+    return round(number, precision) if precision is not None else number
+
+
+def _cint(value):
+    try:
+        return int(float(value or 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _cstr(value):
+    return "" if value is None else str(value)
+
+
+def _now_datetime():
+    return datetime.now()
+
+
+def _add_to_date(value, days=0, hours=0, minutes=0, seconds=0):
+    return value + timedelta(days=days, hours=hours, minutes=minutes, seconds=seconds)
+
+
+def _getdate(value=None):
+    if isinstance(value, datetime):
+        return value.date()
+    return value if isinstance(value, date) else date.fromisoformat(str(value or date.today())[:10])
+
+
+class FakeDoc:
+    """A document: attribute access like frappe's Document (so `items` is a field)"""
+
+    def __init__(self, values=None, **kwargs):
+        self.__dict__.update(values or {}, **kwargs)
+        self.flags = _dict()
+
+    def __getattr__(self, key):
+        return None
+
+    def get(self, key, default=None):
+        value = self.__dict__.get(key)
+        return default if value is None else value
+
+    def set(self, key, value):
+        setattr(self, key, value)
+
+    def update(self, values):
+        self.__dict__.update(values)
+
+    def append(self, table, values):
+        row = FakeDoc(values)
+        rows = self.__dict__.setdefault(table, [])
+        rows.append(row)
+        return row
+
+    def add_comment(self, comment_type, text=None):
+        self.__dict__.setdefault("_comments", []).append((comment_type, text))
+
+    def get_doc_before_save(self):
+        return self.__dict__.get("_doc_before_save")
+
+
+class FakeDB:
+    """Counts every query; answers lookups from the registry"""
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.queries = 0
+        self.commits = 0
+
+    def sql(self, query, values=None, as_dict=False, **kwargs):
+        self.queries += 1
+        return []
+
+    def sql_list(self, query, values=None, **kwargs):
+        self.queries += 1
+        return []
+
+    def get_value(self, doctype, filters=None, fieldname="name", as_dict=False, **kwargs):
+        self.queries += 1
+        doc = self.registry.get((doctype, filters)) if isinstance(filters, str) else None
+        if not doc:
+            return None
+        if isinstance(fieldname, (list, tuple)):
+            values = _dict({field: doc.get(field) for field in fieldname})
+            return values if as_dict else tuple(values.values())
+        return doc.get(fieldname)
+
+    def set_value(self, *args, **kwargs):
+        self.queries += 1
+
+    def exists(self, doctype, name=None):
+        self.queries += 1
+        return name if (doctype, name) in self.registry else None
+
+    def get_default(self, key):
+        self.queries += 1
+        return None
+
+    def bulk_insert(self, *args, **kwargs):
+        self.queries += 1
+
+    def savepoint(self, name):
+        self.queries += 1
+
+    def rollback(self, save_point=None):
+        self.queries += 1
+
+    def commit(self):
+        self.commits += 1
+
+
+class FakeCache:
+    """
+    In-memory stand-in for frappe.cache (RedisWrapper)
+
+    Like the wrapper, its own methods prefix keys with make_key, while the
+    plain redis commands (get, set, incr and pipelines) use keys as given,
+    so a key prefixed twice misses here as it does on a site.
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def make_key(self, key):
+        return f"fake|{key}"
+
+    # --- RedisWrapper methods: keys are prefixed ---
+    def get_value(self, key, generator=None, **kwargs):
+        key = self.make_key(key)
+        if key not in self.data and generator:
+            self.data[key] = generator()
+        return self.data.get(key)
+
+    def set_value(self, key, value, **kwargs):
+        self.data[self.make_key(key)] = value
+
+    def delete_value(self, keys):
+        for key in [keys] if isinstance(keys, str) else keys:
+            self.data.pop(self.make_key(key), None)
+
+    def hget(self, name, key, **kwargs):
+        return self.data.get(self.make_key(name), {}).get(key)
+
+    def hset(self, name, key, value, **kwargs):
+        self.data.setdefault(self.make_key(name), {})[key] = value
+
+    def sadd(self, name, *values):
+        self.data.setdefault(self.make_key(name), set()).update(values)
+
+    def smembers(self, name):
+        return set(self.data.get(self.make_key(name), set()))
+
+    def srem(self, name, *values):
+        self.data.get(self.make_key(name), set()).difference_update(values)
+
+    def spop(self, name):
+        """One member, as RedisWrapper.spop takes no count"""
+        members = self.data.get(self.make_key(name))
+        return members.pop() if members else None
+
+    def lpush(self, key, value):
+        self.data.setdefault(self.make_key(key), []).insert(0, value)
+
+    def ltrim(self, key, start, end):
+        key = self.make_key(key)
+        self.data[key] = _ltrim(self.data.get(key, []), start, end)
+
+    def lrange(self, key, start, end):
+        return _lrange(self.data.get(self.make_key(key), []), start, end)
+
+    # --- Plain redis commands: keys are used as given ---
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, **kwargs):
+        self.data[key] = value
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key) or 0) + 1
+        return self.data[key]
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+def _lrange(items, start, end):
+    return items[start:] if end == -1 else items[start:end + 1]
+
+
+def _ltrim(items, start, end):
+    return _lrange(items, start, end)
+
+
+class FakePipeline:
+    """Raw redis commands on the fake cache, buffered until execute()"""
+
+    def __init__(self, cache):
+        self.data = cache.data
+        self.commands = []
+
+    def __getattr__(self, command):
+        return lambda *args: self.commands.append((command, args))
+
+    def execute(self):
+        results = []
+        for command, args in self.commands:
+            handler = getattr(type(self), f"_{command}", None)
+            if handler is None:
+                raise NeedsSite(f"redis {command} is not available in the fake pipeline")
+            results.append(handler(self, *args))
+        self.commands = []
+        return results
+
+    def _sadd(self, key, *values):
+        members = self.data.setdefault(key, set())
+        added = len(set(values) - members)
+        members.update(values)
+        return added
+
+    def _spop(self, key, count=None):
+        members = self.data.get(key) or set()
+        if count is None:
+            return members.pop() if members else None
+        return [members.pop() for _ in range(min(count, len(members)))]
+
+    def _rpush(self, key, *values):
+        self.data.setdefault(key, []).extend(values)
+        return len(self.data[key])
+
+    def _lpush(self, key, *values):
+        for value in values:
+            self.data.setdefault(key, []).insert(0, value)
+        return len(self.data[key])
+
+    def _lrange(self, key, start, end):
+        return _lrange(self.data.get(key, []), start, end)
+
+    def _ltrim(self, key, start, end):
+        self.data[key] = _ltrim(self.data.get(key, []), start, end)
+        return True
+
+
+class FakeFrappe(types.ModuleType):
+    """The `frappe` module as seen by the app"""
+
+    ValidationError = ValidationError
+    _dict = _dict
+
+    def __init__(self):
+        super().__init__("frappe")
+        self.registry = {}
+        self.db = FakeDB(self.registry)
+        self.cache = FakeCache()
+        self.conf = _dict()
+        self.flags = _dict()
+        self.local = _dict(response=_dict(), form_dict=_dict())
+        self.form_dict = self.local.form_dict
+        self.session = _dict(user="Administrator")
+        self.request = None
+        self.site_path = tempfile.mkdtemp(prefix="surgishop_bench_")
+        self.enqueued = []
+        self.sent_mail = []
+        self.errors = []
+        self.smtp = None
+        self._hashes = itertools.count()
+
+    # --- documents ---
+    def add_doc(self, doctype, name, **values):
+        doc = FakeDoc(doctype=doctype, name=name, **values)
+        self.registry[(doctype, name)] = doc
+        return doc
+
+    def get_doc(self, doctype, name=None):
+        if isinstance(doctype, dict):
+            return FakeDoc(doctype)
+        doc = self.registry.get((doctype, name))
+        if doc is None:
+            raise NeedsSite(f"{doctype} {name} is not in the fake registry")
+        return doc
+
+    def new_doc(self, doctype):
+        return FakeDoc(doctype=doctype)
+
+    # --- framework helpers ---
+    def whitelist(self, *args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+    def throw(self, message, exc=ValidationError, title=None):
+        raise exc(message)
+
+    def msgprint(self, *args, **kwargs):
+        pass
+
+    def log_error(self, title=None, message=None, **kwargs):
+        self.errors.append((title, message))
+
+    def logger(self, *args, **kwargs):
+        return types.SimpleNamespace(
+            info=lambda *a, **k: None, warning=lambda *a, **k: None, error=lambda *a, **k: None
+        )
+
+    def enqueue(self, method, **kwargs):
+        self.enqueued.append((method, kwargs))
+
+    def publish_realtime(self, *args, **kwargs):
+        pass
+
+    def generate_hash(self, txt=None, length=10):
+        return secrets.token_hex(length)[:length]
+
+    def parse_json(self, value):
+        import json
+        return json.loads(value)
+
+    def get_site_path(self, *parts):
+        return os.path.join(self.site_path, *parts)
+
+    def has_permission(self, *args, **kwargs):
+        return True
+
+    def only_for(self, *args, **kwargs):
+        pass
+
+    def get_traceback(self):
+        import traceback
+        return traceback.format_exc()
+
+    def get_print(self, doctype, name, print_format=None, doc=None, as_pdf=False, **kwargs):
+        # Roughly the size of a one-page invoice PDF
+        return b"%PDF-1.4\n" + os.urandom(48 * 1024)
+
+    def sendmail(self, recipients=None, sender=None, subject=None, message=None, attachments=None, **kwargs):
+        """Queue like frappe does; delivered straight away when an SMTP stub is set"""
+        self.sent_mail.append(subject)
+        if not self.smtp:
+            return
+
+        mail = EmailMessage()
+        mail["From"] = sender or "bench@example.com"
+        mail["To"] = ", ".join(recipients or [])
+        mail["Subject"] = subject or ""
+        mail.set_content(message or "")
+        for attachment in attachments or []:
+            mail.add_attachment(
+                attachment["fcontent"], maintype="application", subtype="pdf", filename=attachment["fname"]
+            )
+        self.smtp.send_message(mail)
+
+    def connect_smtp(self, host, port):
+        self.smtp = smtplib.SMTP(host, port)
+
+    def close_smtp(self):
+        if self.smtp:
+            self.smtp.quit()
+            self.smtp = None
+
+
+def _utils_module():
+    utils = types.ModuleType("frappe.utils")
+    utils.flt = _flt
+    utils.cint = _cint
+    utils.cstr = _cstr
+    utils.now_datetime = _now_datetime
+    utils.now = lambda: str(_now_datetime())
+    utils.today = lambda: str(date.today())
+    utils.nowdate = utils.today
+    utils.getdate = _getdate
+    utils.add_days = lambda value, days: _getdate(value) + timedelta(days=days)
+    utils.get_datetime = lambda value=None: value if isinstance(value, datetime) else (
+        datetime.fromisoformat(str(value)) if value else _now_datetime()
+    )
+    utils.get_first_day = lambda value: utils.getdate(value).replace(day=1)
+    utils.add_to_date = _add_to_date
+    utils.format_datetime = str
+    utils.fmt_money = lambda value, **kwargs: f"{_flt(value):,.2f}"
+    utils.escape_html = lambda text: (text or "").replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+    def _missing(name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        raise NeedsSite(f"frappe.utils.{name} is not available without a site")
+
+    utils.__getattr__ = lambda name: _missing(name)
+    return utils
+
+
+def _model_module():
+    model = types.ModuleType("frappe.model")
+    model.default_fields = (
+        "doctype", "name", "owner", "creation", "modified", "modified_by", "docstatus", "idx"
+    )
+    model.child_table_fields = ("parent", "parentfield", "parenttype")
+    return model
+
+
+def install():
+    """Register the fake as `frappe` (and `frappe.utils`, `frappe.model`) and return it"""
+    fake = FakeFrappe()
+    fake.utils = _utils_module()
+    fake.model = _model_module()
+    sys.modules["frappe"] = fake
+    sys.modules["frappe.utils"] = fake.utils
+    sys.modules["frappe.model"] = fake.model
+    return fake
+
+
+def is_installed():
+    return isinstance(sys.modules.get("frappe"), FakeFrappe)
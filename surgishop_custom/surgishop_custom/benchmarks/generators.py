@@ -0,0 +1,127 @@
+"""
+Synthetic data for the benchmark scenarios
+
+Every generator is seeded, so a scenario sees the same data on every run
+and timings stay comparable with the stored baselines.
+"""
+import gzip
+import json
+import random
+from datetime import date, timedelta
+
+from surgishop_custom.benchmarks.gs1 import _gtin, synthetic_code_info
+
+BENCH_PREFIX = "BENCH"
+RECALL_STATUSES = ("Open, Classified", "Ongoing", "Completed", "Terminated")
+
+
+def items(n, seed=42):
+    """Items with a GTIN each"""
+    rng = random.Random(seed)
+    return [
+        {
+            "item_code": f"{BENCH_PREFIX}-ITEM-{i:06d}",
+            "item_name": f"Bench Surgical Device {i}",
+            "gtin": _gtin(rng),
+        }
+        for i in range(n)
+    ]
+
+
+def batches(item_rows, m, seed=42):
+    """Batches spread over the items; most batch_ids carry the GS1 element string"""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(m):
+        item = rng.choice(item_rows)
+        lot = "".join(rng.choice("0123456789ABCDEFGH") for _ in range(rng.randint(5, 10)))
+        if rng.random() < 0.7:
+            batch_id = f"01{item['gtin']}17{rng.randint(25, 30)}1231 10{lot}"
+        else:
+            batch_id = lot
+        rows.append({
+            "name": f"{BENCH_PREFIX}-BATCH-{i:07d}",
+            "batch_id": batch_id,
+            "item": item["item_code"],
+            "lot": lot,
+        })
+    return rows
+
+
+def recalls(k, item_rows=None, batch_rows=None, hit_rate=0.05, seed=42):
+    """openFDA device recall records; hit_rate of them name a seeded GTIN or lot"""
+    rng = random.Random(seed)
+    start = date(2020, 1, 1)
+    item_gtins = {row["item_code"]: row["gtin"] for row in item_rows or []}
+    rows = []
+    for i in range(k):
+        code_info = synthetic_code_info(rng)
+        if batch_rows and rng.random() < hit_rate:
+            batch = rng.choice(batch_rows)
+            code_info = f"UDI-DI: {item_gtins.get(batch['item']) or _gtin(rng)}; Lot Numbers: {batch['lot']}"
+        rows.append({
+            "id": 100000 + i,
+            "recall_number": f"Z-{i:05d}-{2020 + i % 6}",
+            "product_code": rng.choice(("FRN", "GEI", "KGO", "LYZ", "DQY")),
+            "device_name": f"Synthetic device {i}",
+            "code_info": code_info,
+            "status": rng.choice(RECALL_STATUSES),
+            "reason": "Potential for device malfunction",
+            "recall_date": str(start + timedelta(days=rng.randint(0, 2000))),
+        })
+    return rows
+
+
+def write_recall_dump(path, recall_rows):
+    """Write recalls as a gzipped openFDA download ({"meta", "results"} with openFDA field names)"""
+    with gzip.open(path, "wt") as f:
+        f.write('{"meta": {"results": {"total": %d}}, "results": [' % len(recall_rows))
+        for i, recall in enumerate(recall_rows):
+            f.write(("," if i else "") + json.dumps({
+                "cfres_id": str(recall["id"]),
+                "product_res_number": recall["recall_number"],
+                "product_code": recall["product_code"],
+                "code_info": recall["code_info"],
+                "recall_status": recall["status"],
+                "reason_for_recall": recall["reason"],
+                "event_date_initiated": recall["recall_date"],
+                "openfda": {"device_name": recall["device_name"]},
+            }))
+        f.write("]}")
+
+
+def purchase_receipt_lines(n, item_rows, seed=42):
+    """Receiving lines: most accepted only, some with blemish and rejected quantities"""
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(n):
+        item = rng.choice(item_rows)
+        blemish = rng.randint(1, 5) if rng.random() < 0.2 else 0
+        rejected = rng.randint(1, 3) if rng.random() < 0.1 else 0
+        lines.append({
+            "item_code": item["item_code"],
+            "batch_no": None,
+            "accepted_qty": rng.randint(1, 200),
+            "blemish_qty": blemish,
+            "rejected_qty": rejected,
+            "warehouse": "Stores - BENCH",
+            "rejected_warehouse": "Rejected - BENCH" if rejected else None,
+        })
+    return lines
+
+
+def due_invoices(n, seed=42):
+    """Submitted invoices whose scheduled send time has passed"""
+    rng = random.Random(seed)
+    return [
+        {
+            "name": f"ACC-SINV-BENCH-{i:06d}",
+            "customer": f"{BENCH_PREFIX}-CUST-{rng.randint(0, max(n // 10, 1)):05d}",
+            "customer_name": f"Bench Customer {i}",
+            "contact_email": f"ap{i}@example.com",
+            "grand_total": round(rng.uniform(50, 20000), 2),
+            "custom_auto_send_status": "Scheduled",
+        }
+        for i in range(n)
+    ]
+
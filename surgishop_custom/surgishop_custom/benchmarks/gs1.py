@@ -0,0 +1,108 @@
+"""
+Benchmark: GS1 parser vs the old code_info digit scraper
+
+Measures parse throughput and how many identifiers each approach reports
+(every identifier costs a Batch lookup). Uses a real openFDA device recall
+export when given one, otherwise a synthetic corpus of the same size.
+
+    python -m surgishop_custom.benchmarks.gs1 [path/to/device-recall.json[.gz]]
+"""
+import gzip
+import json
+import random
+import sys
+import time
+
+from surgishop_custom.logic import gs1
+
+# openFDA had ~57k device recall records at the time of writing
+CORPUS_SIZE = 57000
+
+
+def legacy_extract(code_info):
+    """extract_udi_from_code_info as it was before the GS1 parser"""
+    if not code_info:
+        return []
+
+    udi_numbers = []
+    text = str(code_info).upper()
+    for line in text.split('\n'):
+        if 'UDI' in line or 'GTIN' in line:
+            clean_line = line.replace(':', ' ').replace('(', ' ').replace(')', ' ').replace(',', ' ')
+            for word in clean_line.split():
+                digits = ''.join(c for c in word if c.isdigit())
+                if len(digits) >= 10:
+                    udi_numbers.append(digits)
+
+    return list(dict.fromkeys(udi_numbers))
+
+
+def _gtin(rng):
+    body = "".join(rng.choice("0123456789") for _ in range(13))
+    for check in "0123456789":
+        if gs1.is_valid_gtin(body + check):
+            return body + check
+
+
+def synthetic_code_info(rng):
+    """One code_info blob in the shapes seen in openFDA device recalls"""
+    gtin = _gtin(rng)
+    lot = "".join(rng.choice("0123456789ABCDEFGH") for _ in range(rng.randint(4, 10)))
+    lots = ", ".join(str(rng.randint(100000, 999999)) for _ in range(rng.randint(1, 40)))
+    phone = f"1-800-{rng.randint(200, 999)}-{rng.randint(1000, 9999)}"
+    shapes = [
+        f"UDI-DI: {gtin}; Lot Numbers: {lots}",
+        f"Model No. {rng.randint(1000, 9999)}-{rng.randint(10, 99)}, Catalog No. {rng.randint(10**9, 10**10 - 1)}\n"
+        f"UDI (01){gtin}(17){rng.randint(24, 30)}1231(10){lot}",
+        f"GTIN 01{gtin}17{rng.randint(24, 30)}0630 10{lot}",
+        f"All lots distributed prior to recall. K{rng.randint(100000, 999999)}. Customer service {phone}",
+        f"UDI/DI {gtin}, Serial (21){lot}, contact {rng.randint(10**9, 10**10 - 1)} (phone)",
+        f"Lot {lot}; Exp. 2025-12-31; UDI Lot Numbers {lots}",
+    ]
+    return rng.choice(shapes)
+
+
+def load_corpus(path=None, size=CORPUS_SIZE, seed=42):
+    if not path:
+        rng = random.Random(seed)
+        return [synthetic_code_info(rng) for _ in range(size)]
+
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as handle:
+        data = json.load(handle)
+
+    return [record.get("code_info") or "" for record in data.get("results", [])]
+
+
+def _time(fn, corpus, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn(corpus)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, out
+
+
+def run(path=None, size=CORPUS_SIZE):
+    corpus = load_corpus(path, int(size))
+
+    legacy_seconds, legacy = _time(lambda blobs: [legacy_extract(blob) for blob in blobs], corpus)
+    parser_seconds, parsed = _time(gs1.parse_code_infos, corpus)
+
+    legacy_ids = sum(len(udis) for udis in legacy)
+    result = {
+        "records": len(corpus),
+        "legacy_records_per_second": round(len(corpus) / legacy_seconds),
+        "parser_records_per_second": round(len(corpus) / parser_seconds),
+        "legacy_identifiers": legacy_ids,
+        "parser_gtins": sum(len(udi["gtins"]) for udi in parsed),
+        "parser_lots": sum(len(udi["lots"]) for udi in parsed),
+        "parser_serials": sum(len(udi["serials"]) for udi in parsed),
+    }
+    print(json.dumps(result, indent=2))
+    return result
+
+
+if __name__ == "__main__":
+    run(*sys.argv[1:2])
@@ -0,0 +1,662 @@
+"""
+Benchmark harness for the app's hot paths
+
+Runs each scenario on seeded synthetic data and reports the median wall
+time of several runs, database queries and peak Python memory. Results
+are compared with the stored baseline for the mode and scale: any extra
+query is a regression, while time and memory must exceed the baseline by
+the tolerance and by an absolute floor, so the noise of runs of a few
+milliseconds is not reported.
+
+Offline, against the fake frappe stand-in (pure code paths, stub print
+webhook and SMTP server):
+
+    python -m surgishop_custom.benchmarks.harness [--scale small|medium|large] [--only a,b] [--save]
+
+Against a local test site (nothing is committed, every scenario rolls back):
+
+    bench --site <site> execute surgishop_custom.benchmarks.harness.run --kwargs "{'mode': 'site', 'scale': 'small'}"
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from surgishop_custom.benchmarks import generators, stubs
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+DEFAULT_TOLERANCE = 0.25
+WALL_FLOOR_SECONDS = 0.05
+MEMORY_FLOOR_KB = 256
+REPEAT = 5
+SCALES = {
+    "small": {"items": 500, "batches": 2000, "recalls": 2000, "receipt_lines": 500, "invoices": 50, "print_jobs": 200,
+              "fuzzy_items": 5000, "fuzzy_queries": 200, "bulk_orders": 2000,
+              "dirty_customers": 2000},
+    "medium": {"items": 5000, "batches": 20000, "recalls": 10000, "receipt_lines": 3000, "invoices": 200, "print_jobs": 1000,
+               "fuzzy_items": 25000, "fuzzy_queries": 500, "bulk_orders": 10000,
+               "dirty_customers": 10000},
+    "large": {"items": 20000, "batches": 100000, "recalls": 57000, "receipt_lines": 10000, "invoices": 1000, "print_jobs": 5000,
+              "fuzzy_items": 100000, "fuzzy_queries": 1000, "bulk_orders": 50000,
+              "dirty_customers": 50000},
+}
+
+
+class Scenario:
+    """setup() builds untimed state, run(state) is timed, teardown(state) cleans up"""
+
+    name = None
+    modes = ("fake", "site")
+
+    def __init__(self, scale):
+        self.scale = scale
+
+    def setup(self):
+        return None
+
+    def run(self, state):
+        raise NotImplementedError
+
+    def teardown(self, state):
+        pass
+
+    def extra(self, state):
+        """Scenario specific figures for the report"""
+        return {}
+
+
+# --- Query counting ---
+
+class QueryCounter:
+    def __init__(self, mode):
+        self.mode = mode
+        self.count = 0
+        self._original = None
+
+    def __enter__(self):
+        import frappe
+
+        if self.mode == "fake":
+            self._start = frappe.db.queries
+        else:
+            self._original = frappe.db.sql
+
+            def counted_sql(*args, **kwargs):
+                self.count += 1
+                return self._original(*args, **kwargs)
+
+            frappe.db.sql = counted_sql
+        return self
+
+    def __exit__(self, *exc):
+        import frappe
+
+        if self.mode == "fake":
+            self.count = frappe.db.queries - self._start
+        else:
+            frappe.db.sql = self._original
+
+
+class RolledBack:
+    """Site mode: turn commits into no-ops and roll everything back at the end"""
+
+    def __enter__(self):
+        import frappe
+
+        self._commit = frappe.db.commit
+        frappe.db.commit = lambda *args, **kwargs: None
+        return self
+
+    def __exit__(self, *exc):
+        import frappe
+
+        frappe.db.commit = self._commit
+        frappe.db.rollback()
+
+
+# --- Scenarios ---
+
+class Gs1Parse(Scenario):
+    name = "gs1_parse"
+
+    def setup(self):
+        return [recall["code_info"] for recall in generators.recalls(self.scale["recalls"])]
+
+    def run(self, code_infos):
+        from surgishop_custom.logic import gs1
+
+        return gs1.parse_code_infos(code_infos)
+
+    def extra(self, code_infos):
+        return {"records": len(code_infos)}
+
+
+class ExtractUdi(Scenario):
+    name = "extract_udi_from_code_info"
+
+    def setup(self):
+        return [recall["code_info"] for recall in generators.recalls(self.scale["recalls"])]
+
+    def run(self, code_infos):
+        from surgishop_custom import api
+
+        return [api.extract_udi_from_code_info(code_info) for code_info in code_infos]
+
+
+class AllowBlemish(Scenario):
+    """A large receipt validated three times; the quantities must not compound"""
+
+    name = "allow_blemish"
+
+    def setup(self):
+        import frappe
+
+        lines = generators.purchase_receipt_lines(
+            self.scale["receipt_lines"], generators.items(self.scale["items"])
+        )
+        doc = frappe.new_doc("Purchase Receipt")
+        for i, line in enumerate(lines):
+            doc.append("items", {
+                "name": f"bench-row-{i}",
+                "item_code": line["item_code"],
+                "qty": line["accepted_qty"],
+                "custom_blemish_quantity": line["blemish_qty"],
+                "rejected_qty": line["rejected_qty"],
+                "warehouse": line["warehouse"],
+            })
+        return doc
+
+    def run(self, doc):
+        from surgishop_custom.logic import purchase_receipt
+
+        for _ in range(3):
+            purchase_receipt.allow_blemish(doc)
+        return doc
+
+    def extra(self, doc):
+        expected = sum(
+            line["accepted_qty"] + line["blemish_qty"] + line["rejected_qty"]
+            for line in generators.purchase_receipt_lines(
+                self.scale["receipt_lines"], generators.items(self.scale["items"])
+            )
+        )
+        return {"lines": len(doc.items), "idempotent": round(doc.custom_total_received, 3) == round(expected, 3)}
+
+
+class PrintBatches(Scenario):
+    """Queued print jobs sent to the stub webhook in batches over one pooled session"""
+
+    name = "print_batches"
+    modes = ("fake",)
+
+    def setup(self):
+        import frappe
+
+        try:
+            import requests  # noqa: F401
+        except ImportError:
+            return None
+
+        webhook = stubs.PrintWebhookStub(failure_rate=0.01).start()
+        frappe.conf.print_webhook_url = webhook.url
+        jobs = [
+            frappe._dict(
+                id=i + 1, reference_doctype="Delivery Note", reference_name=f"MAT-DN-BENCH-{i:06d}",
+                print_format=None, attempts=0
+            )
+            for i in range(self.scale["print_jobs"])
+        ]
+        return {"webhook": webhook, "jobs": jobs}
+
+    def run(self, state):
+        if not state:
+            return
+        from surgishop_custom.logic import print_queue
+
+        jobs = state["jobs"]
+        for start in range(0, len(jobs), print_queue.BATCH_SIZE):
+            print_queue._print_batch(print_queue.DEFAULT_PRINTER, jobs[start:start + print_queue.BATCH_SIZE])
+
+    def teardown(self, state):
+        if state:
+            state["webhook"].stop()
+
+    def extra(self, state):
+        if not state:
+            return {"skipped": "requests is not installed"}
+        return state["webhook"].stats()
+
+
+class InvoiceEmails(Scenario):
+    """Due invoices rendered (PDF cache) and mailed to the stub SMTP server"""
+
+    name = "invoice_emails"
+    modes = ("fake",)
+
+    def setup(self):
+        import frappe
+
+        smtp = stubs.SMTPStub().start()
+        frappe.connect_smtp("127.0.0.1", smtp.port)
+        names = []
+        for invoice in generators.due_invoices(self.scale["invoices"]):
+            frappe.add_doc("Sales Invoice", invoice["name"], modified="2026-01-01 00:00:00", **{
+                key: value for key, value in invoice.items() if key != "name"
+            })
+            names.append(invoice["name"])
+        return {"smtp": smtp, "names": names}
+
+    def run(self, state):
+        from surgishop_custom.logic import sales_invoice
+
+        for name in state["names"]:
+            sales_invoice.send_invoice_email(name)
+
+    def teardown(self, state):
+        import frappe
+
+        frappe.close_smtp()
+        state["smtp"].stop()
+
+    def extra(self, state):
+        return state["smtp"].stats()
+
+
+class BulkOrderDrain(Scenario):
+    """Sales Orders collected during a bulk submit are all popped and handed to create_delivery_notes"""
+
+    name = "bulk_order_drain"
+    modes = ("fake",)
+
+    def setup(self):
+        import frappe
+
+        from surgishop_custom.logic import sales_order
+
+        orders = [f"SAL-ORD-BENCH-{i:06d}" for i in range(self.scale["bulk_orders"])]
+        frappe.cache.sadd(sales_order.BULK_PENDING_KEY, *orders)
+
+        # The Delivery Notes need ERPNext; only the hand-off is measured here
+        handed = []
+        original = sales_order.create_delivery_notes
+        sales_order.create_delivery_notes = lambda names, combine=0: handed.extend(names)
+        return {"orders": orders, "handed": handed, "original": original}
+
+    def run(self, state):
+        from surgishop_custom.logic import sales_order
+
+        sales_order.process_bulk_pending()
+
+    def teardown(self, state):
+        import frappe
+
+        from surgishop_custom.logic import sales_order
+
+        sales_order.create_delivery_notes = state["original"]
+        frappe.cache.delete_value(sales_order.BULK_PENDING_KEY)
+
+    def extra(self, state):
+        return {"orders": len(state["orders"]), "drained": sorted(state["handed"]) == state["orders"]}
+
+
+class CreditSnapshotDrain(Scenario):
+    """Customers marked dirty by GL postings are all popped and refreshed"""
+
+    name = "credit_snapshot_drain"
+    modes = ("fake",)
+
+    def setup(self):
+        import frappe
+
+        from surgishop_custom.logic import customer_credit
+
+        customers = [f"CUST-BENCH-{i:06d}" for i in range(self.scale["dirty_customers"])]
+        frappe.cache.sadd(customer_credit.DIRTY_KEY, *customers)
+
+        # The snapshot aggregation needs a site; only the hand-off is measured here
+        refreshed = []
+        original = customer_credit.refresh
+        customer_credit.refresh = refreshed.extend
+        return {"customers": customers, "refreshed": refreshed, "original": original}
+
+    def run(self, state):
+        from surgishop_custom.logic import customer_credit
+
+        customer_credit.refresh_dirty()
+
+    def teardown(self, state):
+        import frappe
+
+        from surgishop_custom.logic import customer_credit
+
+        customer_credit.refresh = state["original"]
+        frappe.cache.delete_value(customer_credit.DIRTY_KEY)
+
+    def extra(self, state):
+        return {"customers": len(state["customers"]), "drained": sorted(state["refreshed"]) == state["customers"]}
+
+
+class RecallCheck(Scenario):
+    """check_recalls against seeded Items and Batches on a real site"""
+
+    name = "check_recalls"
+    modes = ("site",)
+
+    def setup(self):
+        import frappe
+
+        from surgishop_custom.logic import udi_index
+
+        item_rows = generators.items(self.scale["items"])
+        batch_rows = generators.batches(item_rows, self.scale["batches"])
+        timestamp = frappe.utils.now()
+        user = frappe.session.user
+
+        frappe.db.bulk_insert(
+            "Item",
+            ["name", "item_code", "item_name", "item_group", "stock_uom", "has_batch_no",
+             "creation", "modified", "owner", "modified_by"],
+            [[row["item_code"], row["item_code"], row["item_name"], "All Item Groups", "Nos", 1,
+              timestamp, timestamp, user, user] for row in item_rows]
+        )
+        frappe.db.bulk_insert(
+            "Item Barcode",
+            ["name", "parent", "parenttype", "parentfield", "barcode", "barcode_type",
+             "creation", "modified", "owner", "modified_by"],
+            [[f"{row['item_code']}-gtin", row["item_code"], "Item", "barcodes", row["gtin"], "GTIN",
+              timestamp, timestamp, user, user] for row in item_rows]
+        )
+        frappe.db.bulk_insert(
+            "Batch",
+            ["name", "batch_id", "item", "creation", "modified", "owner", "modified_by"],
+            [[row["name"], row["batch_id"], row["item"], timestamp, timestamp, user, user] for row in batch_rows]
+        )
+        if udi_index.is_built():
+            for row in batch_rows:
+                udi_index._index(row["name"], row["batch_id"])
+
+        return generators.recalls(self.scale["recalls"], item_rows, batch_rows)
+
+    def run(self, recalls):
+        from surgishop_custom import api
+
+        return api.check_recalls(recalls, force=True)
+
+    def extra(self, recalls):
+        return {"recalls": len(recalls)}
+
+
+class FuzzyItemLookup(Scenario):
+    """find_items for misspelt device names against a seeded Item catalog on a real site"""
+
+    name = "fuzzy_item_lookup"
+    modes = ("site",)
+
+    def setup(self):
+        import random
+
+        import frappe
+
+        from surgishop_custom.logic import fuzzy_index
+
+        # The index tables need their patch; creating them here would commit
+        if not fuzzy_index.is_built():
+            return None
+
+        item_rows = generators.items(self.scale["fuzzy_items"])
+        timestamp = frappe.utils.now()
+        user = frappe.session.user
+        frappe.db.bulk_insert(
+            "Item",
+            ["name", "item_code", "item_name", "item_group", "stock_uom",
+             "creation", "modified", "owner", "modified_by"],
+            [[row["item_code"], row["item_code"], row["item_name"], "All Item Groups", "Nos",
+              timestamp, timestamp, user, user] for row in item_rows]
+        )
+        for start in range(0, len(item_rows), fuzzy_index.REBUILD_PAGE):
+            codes = [row["item_code"] for row in item_rows[start:start + fuzzy_index.REBUILD_PAGE]]
+            fuzzy_index._insert_terms(fuzzy_index._item_terms(codes))
+
+        # Device names as recalls spell them: a dropped letter and different case
+        rng = random.Random(42)
+        texts = {}
+        for i, row in enumerate(rng.sample(item_rows, min(self.scale["fuzzy_queries"], len(item_rows)))):
+            name = row["item_name"]
+            cut = rng.randint(1, len(name) - 2)
+            texts[i] = [(name[:cut] + name[cut + 1:]).upper()]
+        return {"texts": texts, "found": 0}
+
+    def run(self, state):
+        if not state:
+            return
+        from surgishop_custom.logic import fuzzy_index
+
+        found = fuzzy_index.find_items(state["texts"])
+        state["found"] = sum(1 for candidates in found.values() if candidates)
+
+    def extra(self, state):
+        if not state:
+            return {"skipped": "the fuzzy Item index is not built"}
+        return {"items": self.scale["fuzzy_items"], "queries": len(state["texts"]), "found": state["found"]}
+
+
+class RecallDumpParse(Scenario):
+    """Stream a gzipped openFDA dump through the incremental parser; peak memory must not grow with it"""
+
+    name = "recall_dump_parse"
+    modes = ("fake",)
+
+    def setup(self):
+        path = os.path.join(tempfile.mkdtemp(prefix="surgishop_bench_"), "device-recall.json.gz")
+        generators.write_recall_dump(path, generators.recalls(self.scale["recalls"]))
+        return {"path": path, "records": 0}
+
+    def run(self, state):
+        from surgishop_custom.logic import recall_ingest
+
+        with recall_ingest.open_dump(state["path"]) as stream:
+            state["records"] = sum(
+                1 for record in recall_ingest.iter_records(stream) if recall_ingest.normalize_recall(record)
+            )
+
+    def teardown(self, state):
+        shutil.rmtree(os.path.dirname(state["path"]), ignore_errors=True)
+
+    def extra(self, state):
+        return {"records": state["records"]}
+
+
+class SendPendingInvoices(Scenario):
+    """send_pending_invoices on real invoices, mail delivered to the stub SMTP server"""
+
+    name = "send_pending_invoices"
+    modes = ("site",)
+
+    def setup(self):
+        import frappe
+
+        from surgishop_custom.logic import sales_invoice
+
+        names = frappe.get_all(
+            "Sales Invoice",
+            filters={"docstatus": 1, "is_return": 0},
+            order_by="posting_date desc",
+            limit=self.scale["invoices"],
+            pluck="name"
+        )
+        frappe.db.set_value(
+            "Sales Invoice",
+            {"name": ["in", names]},
+            {"custom_auto_send_status": "Scheduled", "custom_scheduled_send_time": "2000-01-01 00:00:00"},
+            update_modified=False
+        )
+        frappe.cache.delete_value(sales_invoice.NEXT_DUE_KEY)
+        frappe.conf.invoice_send_parallelism = 1
+        return {"smtp": stubs.SMTPStub().start(), "names": names}
+
+    def run(self, state):
+        import frappe
+        from frappe.email.smtp import SMTPServer
+
+        from surgishop_custom.logic import sales_invoice
+
+        sales_invoice.send_pending_invoices()
+
+        server = SMTPServer(server="127.0.0.1", port=state["smtp"].port, use_tls=0, use_ssl=0)
+        for queue_name in frappe.get_all(
+            "Email Queue",
+            filters={"reference_doctype": "Sales Invoice", "reference_name": ["in", state["names"]], "status": "Not Sent"},
+            pluck="name"
+        ):
+            frappe.get_doc("Email Queue", queue_name).send(smtp_server_instance=server)
+
+    def teardown(self, state):
+        import frappe
+
+        frappe.conf.pop("invoice_send_parallelism", None)
+        state["smtp"].stop()
+
+    def extra(self, state):
+        return {"invoices": len(state["names"]), **state["smtp"].stats()}
+
+
+SCENARIOS = (
+    Gs1Parse, ExtractUdi, AllowBlemish, PrintBatches, InvoiceEmails, BulkOrderDrain, CreditSnapshotDrain,
+    RecallCheck, FuzzyItemLookup, RecallDumpParse, SendPendingInvoices
+)
+
+
+# --- Running and reporting ---
+
+def measure(scenario, mode, repeat=REPEAT):
+    """Median wall time over `repeat` runs, queries of one run, peak memory of one run"""
+    timings = []
+    queries = None
+    for _ in range(repeat):
+        with (RolledBack() if mode == "site" else _Nothing()):
+            state = scenario.setup()
+            try:
+                with QueryCounter(mode) as counter:
+                    start = time.perf_counter()
+                    scenario.run(state)
+                    seconds = time.perf_counter() - start
+                extra = scenario.extra(state)
+            finally:
+                scenario.teardown(state)
+        timings.append(seconds)
+        queries = counter.count
+
+    with (RolledBack() if mode == "site" else _Nothing()):
+        state = scenario.setup()
+        try:
+            tracemalloc.start()
+            scenario.run(state)
+            _current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        finally:
+            scenario.teardown(state)
+
+    return {
+        "wall_seconds": round(statistics.median(timings), 4),
+        "queries": queries,
+        "peak_kb": round(peak / 1024),
+        **extra,
+    }
+
+
+class _Nothing:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def _baseline_path(mode, scale_name):
+    return os.path.join(BASELINE_DIR, f"{mode}-{scale_name}.json")
+
+
+def _exceeds(value, base, tolerance, floor):
+    return value > base * (1 + tolerance) and value - base > floor
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Regressions of results against a baseline, one message per finding"""
+    regressions = []
+    for name, result in results.items():
+        if result.get("idempotent") is False:
+            regressions.append(f"{name}: repeated validation changed the quantities")
+        if result.get("drained") is False:
+            regressions.append(f"{name}: queued work was left behind")
+        base = baseline.get(name)
+        if not base or "skipped" in result:
+            continue
+        if _exceeds(result["wall_seconds"], base["wall_seconds"], tolerance, WALL_FLOOR_SECONDS):
+            regressions.append(f"{name}: wall {base['wall_seconds']}s -> {result['wall_seconds']}s")
+        if base.get("queries") is not None and result["queries"] > base["queries"]:
+            regressions.append(f"{name}: queries {base['queries']} -> {result['queries']}")
+        if _exceeds(result["peak_kb"], base["peak_kb"], tolerance, MEMORY_FLOOR_KB):
+            regressions.append(f"{name}: peak memory {base['peak_kb']}KB -> {result['peak_kb']}KB")
+    return regressions
+
+
+def run(mode="site", scale="small", only=None, save=0, tolerance=DEFAULT_TOLERANCE, repeat=REPEAT):
+    """
+    Run the scenarios of a mode and compare them with the stored baseline
+
+    Returns:
+        dict with results, regressions and whether the baseline was saved
+    """
+    params = SCALES[scale]
+    only = set(only.split(",")) if isinstance(only, str) else set(only or [])
+
+    results = {}
+    for scenario_class in SCENARIOS:
+        if mode not in scenario_class.modes or (only and scenario_class.name not in only):
+            continue
+        results[scenario_class.name] = measure(scenario_class(params), mode, int(repeat))
+        print(f"{scenario_class.name}: {json.dumps(results[scenario_class.name])}")
+
+    path = _baseline_path(mode, scale)
+    baseline = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            baseline = json.load(f)
+
+    regressions = compare(results, baseline, float(tolerance))
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+
+    if int(save):
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(path, "w") as f:
+            measured = {name: result for name, result in results.items() if "skipped" not in result}
+            json.dump({**baseline, **measured}, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    return {"results": results, "regressions": regressions, "saved": bool(int(save))}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--only", help="comma separated scenario names")
+    parser.add_argument("--save", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    args = parser.parse_args(argv)
+
+    from surgishop_custom.benchmarks import fake_frappe
+    fake_frappe.install()
+
+    outcome = run("fake", args.scale, args.only, args.save, args.tolerance, args.repeat)
+    return 1 if outcome["regressions"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
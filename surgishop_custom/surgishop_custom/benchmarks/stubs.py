@@ -0,0 +1,168 @@
+"""
+Local stub servers for the print webhook and SMTP
+
+Both run in a background thread on 127.0.0.1 and only count what they
+receive, so scenarios measure the app's side of the conversation.
+
+PrintWebhookStub speaks the print_queue batch protocol: a POST of
+{"printer", "jobs": [{id, doctype, name, print_format}]} answered with
+{"failed": [{"id", "error"}]} for a configurable share of the jobs.
+"""
+import json
+import random
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _StubServer:
+    server_class = None
+    handler_class = None
+
+    def __init__(self):
+        self.server = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.server = self.server_class(("127.0.0.1", 0), self.handler_class)
+        self.server.stub = self
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _PrintHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        stub = self.server.stub
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        jobs = body.get("jobs") or []
+
+        if stub.latency:
+            time.sleep(stub.latency)
+
+        with stub.lock:
+            stub.requests += 1
+            stub.jobs += len(jobs)
+            stub.connections.add(self.client_address)
+            failed = [
+                {"id": job.get("id"), "error": "Paper jam"}
+                for job in jobs
+                if stub.rng.random() < stub.failure_rate
+            ]
+
+        payload = json.dumps({"failed": failed}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class PrintWebhookStub(_StubServer):
+    """Batch print endpoint; `url` goes into site config print_webhook_url"""
+
+    server_class = ThreadingHTTPServer
+    handler_class = _PrintHandler
+
+    def __init__(self, failure_rate=0.0, latency=0.0, seed=42):
+        super().__init__()
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.jobs = 0
+        self.connections = set()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}/print"
+
+    def stats(self):
+        return {"requests": self.requests, "jobs": self.jobs, "connections": len(self.connections)}
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept mail from smtplib and frappe's SMTPServer"""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+    def handle(self):
+        stub = self.server.stub
+        self.reply("220 stub ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command[:4].upper()
+
+            if verb in ("HELO", "EHLO"):
+                if verb == "EHLO":
+                    self.reply("250-stub")
+                    self.reply("250-8BITMIME")
+                    self.reply("250 SIZE 52428800")
+                else:
+                    self.reply("250 stub")
+            elif verb in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data in (b".\r\n", b".\n"):
+                        break
+                    size += len(data)
+                with stub.lock:
+                    stub.messages += 1
+                    stub.bytes += size
+                self.reply("250 OK queued")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+
+
+class SMTPStub(_StubServer):
+    """Accepts and counts mail; point the outgoing Email Account (or the fake) at `port`"""
+
+    server_class = _ThreadingTCPServer
+    handler_class = _SMTPHandler
+
+    def __init__(self):
+        super().__init__()
+        self.messages = 0
+        self.bytes = 0
+
+    def stats(self):
+        return {"messages": self.messages, "kilobytes": round(self.bytes / 1024)}
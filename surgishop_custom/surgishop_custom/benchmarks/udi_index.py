@@ -0,0 +1,72 @@
+"""
+Benchmark: UDI index vs LIKE scan
+
+Runs against the site's real tabBatch data and checks that both lookups
+return the same batches for every sampled UDI.
+
+    bench --site <site> execute surgishop_custom.benchmarks.udi_index.run --kwargs "{'sample': 500}"
+"""
+import random
+import time
+
+import frappe
+
+from surgishop_custom.logic import gs1, udi_index
+
+
+def sample_udis(sample=200, seed=42):
+    """Pick UDIs that hit real batches plus a share that miss"""
+    rng = random.Random(seed)
+
+    batch_ids = frappe.db.sql_list("""
+        SELECT batch_id
+        FROM `tabBatch`
+        WHERE batch_id REGEXP '[0-9]{10}'
+        ORDER BY RAND(%s)
+        LIMIT %s
+    """, (seed, sample))
+
+    udis = []
+    for batch_id in batch_ids:
+        runs = udi_index.DIGIT_RUN.findall(batch_id)
+        run = rng.choice(runs)
+        length = rng.randint(udi_index.GRAM_SIZE, len(run))
+        start = rng.randint(0, len(run) - length)
+        udis.append(run[start:start + length])
+
+    while len(udis) < sample:
+        udis.append("".join(rng.choice("0123456789") for _ in range(14)))
+
+    return udis
+
+
+def run(sample=200, seed=42):
+    if not udi_index.is_built():
+        print("UDI index is not built, run surgishop_custom.logic.udi_index.rebuild first")
+        return
+
+    udis = sample_udis(int(sample), int(seed))
+
+    start = time.perf_counter()
+    scanned = {udi: udi_index._like_scan(gs1.unpadded_gtin(udi)) for udi in udis}
+    like_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed = udi_index.find_batches(udis)
+    index_seconds = time.perf_counter() - start
+
+    mismatches = [
+        udi for udi in udis
+        if {row.name for row in scanned[udi]} != {row.name for row in indexed[udi]}
+    ]
+
+    result = {
+        "udis": len(udis),
+        "batches": frappe.db.count("Batch"),
+        "like_seconds": round(like_seconds, 4),
+        "index_seconds": round(index_seconds, 4),
+        "speedup": round(like_seconds / index_seconds, 1) if index_seconds else None,
+        "mismatches": mismatches,
+    }
+    print(result)
+    return result
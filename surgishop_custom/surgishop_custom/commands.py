@@ -0,0 +1,56 @@
+"""
+bench commands for surgishop_custom
+"""
+import click
+from frappe.commands import get_site, pass_context
+
+
+@click.command("ingest-recalls")
+@click.argument("path")
+@click.option("--force", is_flag=True, default=False, help="Check every recall, even if unchanged since the last run")
+@click.option("--chunk-size", type=int, default=500, help="Recalls matched and committed per step")
+@pass_context
+def ingest_recalls(context, path, force=False, chunk_size=500):
+    """Match an openFDA device recall dump (JSON/NDJSON, optionally gzip or zip) against inventory"""
+    import frappe
+
+    from surgishop_custom.logic import recall_ingest
+
+    def report(stats):
+        click.echo(
+            f"{stats['records']} recalls, {stats['processed_count']} checked, "
+            f"{stats['matched_count']} matches, {stats['records_per_second']} recalls/s"
+        )
+
+    frappe.init(site=get_site(context))
+    frappe.connect()
+    try:
+        result = recall_ingest.ingest_path(path, force=force, chunk_size=chunk_size, on_progress=report)
+        click.echo(
+            f"Done: {result['records']} recalls ({result['invalid_count']} without a recall number), "
+            f"{result['skipped_count']} unchanged, {result['matched_count']} new matches "
+            f"in {result.get('elapsed_seconds', 0)}s"
+        )
+    finally:
+        frappe.destroy()
+
+
+@click.command("backfill-shipment-lineage")
+@click.option("--from-date", default=None, help="Only vouchers posted on or after this date")
+@pass_context
+def backfill_shipment_lineage(context, from_date=None):
+    """Record the batch shipments of every submitted Delivery Note and stock-updating Sales Invoice"""
+    import frappe
+
+    from surgishop_custom.logic import shipment_lineage
+
+    frappe.init(site=get_site(context))
+    frappe.connect()
+    try:
+        result = shipment_lineage.backfill(from_date=from_date)
+        click.echo(f"Recorded {result['vouchers']} vouchers")
+    finally:
+        frappe.destroy()
+
+
+commands = [ingest_recalls, backfill_shipment_lineage]
@@ -0,0 +1,197 @@
+"""
+Structured event logging for the app
+
+Events carry a level, an event name, a correlation reference (the DN, SI
+or SO they concern) and a trace id shared by everything logged in the same
+request or job. They are buffered in memory and pushed to a Redis list in
+one round trip when the request or job ends, so nothing is written inside
+the business transaction. flush_events drains the list every minute: all
+events go to the surgishop_custom.events log file, and errors are promoted
+to Error Log once per signature, with a count of repeats.
+
+Site config:
+    app_log_debug_sample_rate: share of debug events kept, default 0.01
+"""
+import hashlib
+import json
+import random
+import re
+import time
+
+import frappe
+
+EVENTS_KEY = "surgishop_custom:app_log_events"
+ERROR_SIGNATURES_KEY = "surgishop_custom:app_log_error_signatures"
+DEFAULT_DEBUG_SAMPLE_RATE = 0.01
+BUFFER_MAX = 200
+FLUSH_BATCH = 5000
+
+
+def _buffer():
+    if getattr(frappe.local, "app_log_buffer", None) is None:
+        frappe.local.app_log_buffer = []
+        frappe.local.app_log_trace_id = frappe.generate_hash(length=12)
+    return frappe.local.app_log_buffer
+
+
+def log(level, event, ref=None, exc=False, **fields):
+    """
+    Buffer one event
+
+    Args:
+        level: debug, info, warning or error
+        event: short snake_case event name
+        ref: name of the document the event is about
+        exc: attach the traceback of the exception being handled
+    """
+    if level == "debug":
+        sample_rate = frappe.conf.get("app_log_debug_sample_rate")
+        if random.random() >= (DEFAULT_DEBUG_SAMPLE_RATE if sample_rate is None else float(sample_rate)):
+            return
+
+    buffer = _buffer()
+    entry = {
+        "ts": round(time.time(), 3),
+        "level": level,
+        "event": event,
+        "ref": ref,
+        "trace_id": frappe.local.app_log_trace_id,
+        "site": getattr(frappe.local, "site", None),
+        **fields,
+    }
+    if exc:
+        entry["traceback"] = frappe.get_traceback()
+    buffer.append(entry)
+
+    if len(buffer) >= BUFFER_MAX:
+        flush_buffer()
+
+
+def debug(event, ref=None, **fields):
+    log("debug", event, ref, **fields)
+
+
+def info(event, ref=None, **fields):
+    log("info", event, ref, **fields)
+
+
+def warning(event, ref=None, **fields):
+    log("warning", event, ref, **fields)
+
+
+def error(event, ref=None, exc=True, **fields):
+    log("error", event, ref, exc=exc, **fields)
+
+
+def flush_buffer(*args, **kwargs):
+    """
+    Push this request's or job's events to Redis
+    Hook: after_request / after_job
+    """
+    buffer = getattr(frappe.local, "app_log_buffer", None)
+    if not buffer:
+        return
+
+    frappe.local.app_log_buffer = []
+    try:
+        pipeline = frappe.cache.pipeline()
+        pipeline.rpush(frappe.cache.make_key(EVENTS_KEY), *(json.dumps(entry, default=str) for entry in buffer))
+        pipeline.execute()
+    except Exception:
+        # Logging must never break the request it describes
+        pass
+
+
+def _drain():
+    key = frappe.cache.make_key(EVENTS_KEY)
+    pipeline = frappe.cache.pipeline()
+    pipeline.lrange(key, 0, FLUSH_BATCH - 1)
+    pipeline.ltrim(key, FLUSH_BATCH, -1)
+    raw_events = pipeline.execute()[0]
+    return [json.loads(raw) for raw in raw_events]
+
+
+def error_signature(error):
+    """Group errors that differ only in addresses, ids and numbers"""
+    lines = [line.strip() for line in (error or "").strip().splitlines() if line.strip()]
+    last_line = lines[-1] if lines else "No error details provided"
+    signature = re.sub(r"\S+@\S+", "<email>", last_line)
+    signature = re.sub(r"\d+", "<n>", signature)
+    return signature[:200]
+
+
+def signature(entry):
+    """Events with the same name and normalised error count as one"""
+    details = entry.get("traceback") or entry.get("error") or ""
+    return hashlib.md5(f"{entry['event']}|{error_signature(details)}".encode()).hexdigest()[:16]
+
+
+def flush_events():
+    """
+    Scheduler Event: every minute
+
+    Writes the buffered events to the log file and promotes errors to
+    Error Log, one document per signature.
+    """
+    events = _drain()
+    if not events:
+        return
+
+    logger = frappe.logger("surgishop_custom.events")
+    errors = {}
+    for entry in events:
+        getattr(logger, entry["level"], logger.info)(json.dumps(entry, default=str))
+        if entry["level"] == "error":
+            errors.setdefault(signature(entry), []).append(entry)
+
+    for key, entries in errors.items():
+        _promote(key, entries)
+    frappe.db.commit()
+
+
+def _promote(key, entries):
+    """Create the Error Log for a new signature, or bump the count on the existing one"""
+    known = frappe.cache.hget(ERROR_SIGNATURES_KEY, key)
+    if known and frappe.db.exists("Error Log", known["error_log"]):
+        count = known["count"] + len(entries)
+        refs = list(dict.fromkeys(known["refs"] + [entry["ref"] for entry in entries if entry.get("ref")]))[-20:]
+        frappe.db.set_value("Error Log", known["error_log"], {
+            "method": _title(entries[-1], count),
+            "error": _details(entries[-1], count, refs),
+            "seen": 0,
+        })
+    else:
+        count = len(entries)
+        refs = list(dict.fromkeys(entry["ref"] for entry in entries if entry.get("ref")))[-20:]
+        error_log = frappe.get_doc({
+            "doctype": "Error Log",
+            "method": _title(entries[-1], count),
+            "error": _details(entries[-1], count, refs),
+        }).insert(ignore_permissions=True)
+        known = {"error_log": error_log.name}
+
+    frappe.cache.hset(ERROR_SIGNATURES_KEY, key, {"error_log": known["error_log"], "count": count, "refs": refs})
+
+
+def _title(entry, count):
+    title = entry.get("title") or entry["event"]
+    if entry.get("ref"):
+        title = f"{title} ({entry['ref']})"
+    if count > 1:
+        title = f"{title} x{count}"
+    return title[:140]
+
+
+def _details(entry, count, refs):
+    fields = {
+        key: value for key, value in entry.items()
+        if key not in ("traceback", "ts", "level")
+    }
+    return "\n".join([
+        f"Occurrences: {count}",
+        f"References: {', '.join(refs) or '-'}",
+        "Last event:",
+        json.dumps(fields, indent=1, default=str),
+        "",
+        entry.get("traceback") or "",
+    ])
@@ -0,0 +1,253 @@
+"""
+Consolidated periodic invoicing
+
+Customers set to Daily, Weekly or Monthly consolidation are not invoiced
+per Delivery Note by the post-submit pipeline. Their submitted DNs stay
+"To Bill" and the nightly run builds one Sales Invoice from every DN of a
+closed period that shares the invoice header: company, currency,
+addresses, price list and rate based taxes. Items and Actual charges of
+all the DNs are merged into the first DN's invoice.
+
+The period comes from the Customer's custom_invoice_consolidation, or,
+when that is empty, from the site config mapping of facility types:
+
+    "invoice_consolidation_by_facility_type": {"Hospital": "Weekly"}
+"""
+from collections import defaultdict
+
+import frappe
+from frappe.model import child_table_fields, default_fields
+from frappe.utils import add_days, cint, flt, get_first_day, getdate, nowdate
+
+from surgishop_custom.logic import app_log
+from surgishop_custom.logic.instrumentation import instrument
+from surgishop_custom.logic.tables import table_exists
+
+PERIODS = ("Daily", "Weekly", "Monthly")
+CONSOLIDATION_FIELD = "custom_invoice_consolidation"
+FACILITY_TYPE_FIELD = "custom_facility_type"
+COMMIT_EVERY = 20
+ROW_FIELDS = set(default_fields) | set(child_table_fields)
+
+
+def _customer_fields():
+    meta = frappe.get_meta("Customer")
+    return [field for field in (CONSOLIDATION_FIELD, FACILITY_TYPE_FIELD) if meta.has_field(field)]
+
+
+def _period(values):
+    period = values.get(CONSOLIDATION_FIELD)
+    if not period and values.get(FACILITY_TYPE_FIELD):
+        by_facility_type = frappe.conf.get("invoice_consolidation_by_facility_type") or {}
+        period = by_facility_type.get(values[FACILITY_TYPE_FIELD])
+    return period if period in PERIODS else None
+
+
+def get_period(customer):
+    """Consolidation period of a customer, or None when invoiced per Delivery Note"""
+    fields = _customer_fields()
+    if not customer or not fields:
+        return None
+
+    values = frappe.db.get_value("Customer", customer, fields, as_dict=True)
+    return _period(values) if values else None
+
+
+def period_start(period, day=None):
+    """First day of the period containing `day`; DNs before it belong to closed periods"""
+    day = getdate(day or nowdate())
+    if period == "Monthly":
+        return get_first_day(day)
+    if period == "Weekly":
+        return add_days(day, -day.weekday())
+    return day
+
+
+def _consolidated_customers(customer=None):
+    """{customer: period} for every customer that is invoiced periodically"""
+    fields = _customer_fields()
+    if not fields:
+        return {}
+
+    filters = {"disabled": 0}
+    if customer:
+        filters["name"] = customer
+    by_facility_type = frappe.conf.get("invoice_consolidation_by_facility_type") or {}
+    or_filters = [[CONSOLIDATION_FIELD, "in", PERIODS]] if CONSOLIDATION_FIELD in fields else []
+    if FACILITY_TYPE_FIELD in fields and by_facility_type:
+        or_filters.append([FACILITY_TYPE_FIELD, "in", list(by_facility_type)])
+    if not or_filters:
+        return {}
+
+    customers = {}
+    for row in frappe.get_all("Customer", filters=filters, or_filters=or_filters, fields=["name", *fields]):
+        period = _period(row)
+        if period:
+            customers[row.name] = period
+    return customers
+
+
+def _tax_signatures(delivery_notes):
+    """Rate based tax rows of each Delivery Note; only DNs taxed alike can share an invoice"""
+    signatures = defaultdict(list)
+    for row in frappe.db.sql("""
+        SELECT parent, charge_type, account_head, rate, included_in_print_rate
+        FROM `tabSales Taxes and Charges`
+        WHERE parenttype = 'Delivery Note'
+        AND parent IN %(names)s
+        AND charge_type != 'Actual'
+        ORDER BY parent, idx
+    """, {"names": tuple(delivery_notes)}, as_dict=True):
+        signatures[row.parent].append(
+            (row.charge_type, row.account_head, flt(row.rate), cint(row.included_in_print_rate))
+        )
+    return {name: tuple(rows) for name, rows in signatures.items()}
+
+
+def _unbilled_delivery_notes(customers, before, customer=None):
+    """
+    Unbilled DNs of consolidated customers, plus every DN whose per-DN
+    invoice was skipped at submit (a pipeline row completed without an
+    invoice), whatever the customer's setting is now
+    """
+    from surgishop_custom.logic.delivery_note import PIPELINE_TABLE
+
+    deferred_join = ""
+    deferred_condition = ""
+    if table_exists(PIPELINE_TABLE):
+        deferred_join = f"""
+            LEFT JOIN `{PIPELINE_TABLE}` ps ON ps.delivery_note = dn.name
+            AND ps.status = 'Completed' AND ps.sales_invoice IS NULL"""
+        deferred_condition = "OR ps.delivery_note IS NOT NULL"
+
+    return frappe.db.sql(f"""
+        SELECT dn.name, dn.customer, dn.company, dn.currency, dn.posting_date,
+            dn.customer_address, dn.shipping_address_name, dn.selling_price_list, dn.taxes_and_charges
+        FROM `tabDelivery Note` dn
+        {deferred_join}
+        WHERE dn.docstatus = 1
+        AND dn.is_return = 0
+        AND dn.status NOT IN ('Closed', 'Completed')
+        AND dn.per_billed < 100
+        AND dn.posting_date < %(before)s
+        AND (dn.customer IN %(customers)s {deferred_condition})
+        {"AND dn.customer = %(customer)s" if customer else ""}
+        ORDER BY dn.posting_date, dn.name
+    """, {"customers": tuple(customers) or ("",), "customer": customer, "before": before}, as_dict=True)
+
+
+def _merge_delivery_notes(group):
+    """
+    One Sales Invoice for a group of Delivery Notes
+
+    The header and rate based taxes come from the first DN (the group
+    shares them); every DN is mapped on its own and its items and Actual
+    charges are added, so nothing from an earlier DN is overwritten.
+    """
+    from erpnext.stock.doctype.delivery_note.delivery_note import make_sales_invoice
+
+    si = None
+    for delivery_note in group:
+        mapped = make_sales_invoice(delivery_note)
+        if not mapped or not mapped.get("items"):
+            continue
+        if si is None:
+            si = mapped
+            continue
+
+        for item in mapped.get("items"):
+            si.append("items", _copy_row(item))
+        for tax in mapped.get("taxes"):
+            if tax.charge_type == "Actual":
+                _add_actual_charge(si, tax)
+
+    if si:
+        si.run_method("set_po_nos")
+        si.run_method("calculate_taxes_and_totals")
+    return si
+
+
+def _copy_row(row):
+    return {key: value for key, value in row.as_dict().items() if key not in ROW_FIELDS}
+
+
+def _add_actual_charge(si, tax):
+    for row in si.get("taxes"):
+        if row.charge_type == "Actual" and row.account_head == tax.account_head and row.description == tax.description:
+            row.tax_amount = flt(row.tax_amount) + flt(tax.tax_amount)
+            return
+    si.append("taxes", _copy_row(tax))
+
+
+def create_consolidated_invoices(customer=None, day=None):
+    """
+    Scheduler Event: daily
+
+    Invoice every unbilled Delivery Note of a closed period, one Sales
+    Invoice per customer and header (company, currency, addresses, price
+    list, taxes). Each group is submitted under its own savepoint, so a
+    failing customer does not hold back the others; its DNs are simply
+    picked up again by the next run. DNs held back for a customer who is
+    no longer consolidated are invoiced on the next run.
+
+    Returns:
+        dict with created and failed lists
+    """
+    summary = {"created": [], "failed": []}
+    customers = _consolidated_customers(customer)
+    cutoffs = {period: period_start(period, day) for period in PERIODS}
+
+    delivery_notes = [
+        dn for dn in _unbilled_delivery_notes(customers, max(cutoffs.values()), customer)
+        if getdate(dn.posting_date) < cutoffs[customers.get(dn.customer) or "Daily"]
+    ]
+    if not delivery_notes:
+        return summary
+
+    tax_signatures = _tax_signatures([dn.name for dn in delivery_notes])
+    groups = defaultdict(list)
+    for dn in delivery_notes:
+        groups[(
+            dn.customer, dn.company, dn.currency, dn.customer_address, dn.shipping_address_name,
+            dn.selling_price_list, dn.taxes_and_charges, tax_signatures.get(dn.name, ())
+        )].append(dn.name)
+
+    for count, (key, group) in enumerate(groups.items(), start=1):
+        customer_name = key[0]
+        frappe.db.savepoint("consolidated_invoice")
+        try:
+            si = _merge_delivery_notes(group)
+            if not si:
+                continue
+
+            si.insert(ignore_permissions=True)
+            si.submit()
+            summary["created"].append({"sales_invoice": si.name, "customer": customer_name, "delivery_notes": group})
+
+        except Exception as e:
+            frappe.db.rollback(save_point="consolidated_invoice")
+            summary["failed"].append({"customer": customer_name, "delivery_notes": group, "error": str(e)})
+            app_log.error(
+                "consolidated_invoice_failed", ref=customer_name, title="Consolidated invoice failed",
+                error=str(e), delivery_notes=group
+            )
+
+        if count % COMMIT_EVERY == 0:
+            frappe.db.commit()
+
+    frappe.db.commit()
+    app_log.info(
+        "consolidated_invoicing_run",
+        invoices=len(summary["created"]),
+        delivery_notes=sum(len(created["delivery_notes"]) for created in summary["created"]),
+        failed=len(summary["failed"])
+    )
+    return summary
+
+
+@frappe.whitelist()
+@instrument
+def run_consolidated_invoicing(customer=None):
+    """Invoice the closed periods now (all consolidated customers, or one)"""
+    frappe.only_for(["Accounts Manager", "System Manager"])
+    return create_consolidated_invoices(customer=customer)
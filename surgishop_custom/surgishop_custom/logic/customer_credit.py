@@ -0,0 +1,257 @@
+"""
+Customer credit snapshot
+
+Per-customer ledger balance, oldest overdue invoice age and lock state are
+kept in __customer_credit so opening a Customer (or checking a lock) is a
+primary key read instead of a GL aggregation.
+
+Ledger postings only mark the customer dirty; once the transaction commits
+the customers go to a Redis set and a deduplicated background job pops and
+recomputes them. Overdue days grow without any posting, so every customer
+is reconciled nightly.
+
+The balance and overdue days are mirrored into the Customer's
+custom_customer_credit and custom_account_lock_days_overdue fields, which
+is what list views and reports show.
+"""
+import frappe
+from frappe.utils import cint, flt, now, today
+
+from surgishop_custom.logic import customer_lock
+from surgishop_custom.logic.instrumentation import instrument
+
+CREDIT_TABLE = "__customer_credit"
+DIRTY_KEY = "surgishop_custom:customer_credit_dirty"
+SOFT_LOCK_DAYS = 40
+HARD_LOCK_DAYS = 50
+REFRESH_CHUNK = 1000
+
+
+def ensure_credit_table():
+    """Create the credit snapshot table if it does not exist yet"""
+    frappe.db.sql_ddl(f"""
+        CREATE TABLE IF NOT EXISTS `{CREDIT_TABLE}` (
+            `customer` VARCHAR(140) NOT NULL,
+            `balance` DECIMAL(21,9) NOT NULL DEFAULT 0,
+            `oldest_overdue_days` INT NOT NULL DEFAULT 0,
+            `lock_status` VARCHAR(20) NOT NULL DEFAULT '',
+            `modified` DATETIME(6) NOT NULL,
+            PRIMARY KEY (`customer`),
+            KEY `lock_status` (`lock_status`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+
+def get_lock_status(overdue_days):
+    if overdue_days >= HARD_LOCK_DAYS:
+        return "Hard Lock"
+    if overdue_days >= SOFT_LOCK_DAYS:
+        return "Soft Lock"
+    return ""
+
+
+@instrument
+def mark_dirty(doc, method=None):
+    """
+    Queue the party of a posting for a snapshot refresh
+    DocType Event: GL Entry On Submit, Sales Invoice / Payment Entry On Submit / On Cancel
+    """
+    if doc.doctype == "Sales Invoice":
+        customer = doc.customer
+    elif doc.get("party_type") == "Customer":
+        customer = doc.party
+    else:
+        return
+
+    if not customer:
+        return
+
+    # One callback and one job per transaction, however many GL rows the voucher posts
+    if frappe.flags.customer_credit_dirty is None:
+        frappe.flags.customer_credit_dirty = set()
+        frappe.db.after_commit.add(_queue_refresh)
+        frappe.db.after_rollback.add(_forget_dirty)
+    frappe.flags.customer_credit_dirty.add(customer)
+
+
+def _queue_refresh():
+    dirty = frappe.flags.pop("customer_credit_dirty", None)
+    if not dirty:
+        return
+
+    frappe.cache.sadd(DIRTY_KEY, *dirty)
+    frappe.enqueue(
+        "surgishop_custom.logic.customer_credit.refresh_dirty",
+        queue="short",
+        job_id="customer_credit_refresh",
+        deduplicate=True
+    )
+
+
+def _forget_dirty():
+    frappe.flags.pop("customer_credit_dirty", None)
+
+
+def refresh_dirty():
+    """
+    Background job: recompute the snapshot of every customer marked dirty
+
+    Customers are popped before they are recomputed, so one dirtied again
+    during the refresh stays in the set for the next pass.
+    """
+    while True:
+        dirty = _pop_dirty()
+        if not dirty:
+            return
+
+        try:
+            refresh(dirty)
+            frappe.db.commit()
+        except Exception:
+            frappe.db.rollback()
+            frappe.cache.sadd(DIRTY_KEY, *dirty)
+            raise
+
+
+def _pop_dirty():
+    # RedisWrapper.spop prefixes the key itself and pops a single member,
+    # so pop REFRESH_CHUNK at once with the plain command on the prefixed key
+    pipeline = frappe.cache.pipeline()
+    pipeline.spop(frappe.cache.make_key(DIRTY_KEY), REFRESH_CHUNK)
+    return [name.decode() if isinstance(name, bytes) else name for name in pipeline.execute()[0] or []]
+
+
+def refresh(customers):
+    """
+    Recompute the snapshot for the given customers with one aggregation
+    per source table, and mirror changed values onto the Customer
+
+    Returns:
+        dict of customer -> snapshot row
+    """
+    customers = list(dict.fromkeys(customers or []))
+    if not customers:
+        return {}
+
+    balances = dict(frappe.db.sql("""
+        SELECT party, SUM(debit - credit)
+        FROM `tabGL Entry`
+        WHERE party_type = 'Customer'
+        AND party IN %(customers)s
+        AND is_cancelled = 0
+        GROUP BY party
+    """, {"customers": tuple(customers)}))
+
+    overdue = dict(frappe.db.sql("""
+        SELECT customer, DATEDIFF(%(today)s, MIN(due_date))
+        FROM `tabSales Invoice`
+        WHERE customer IN %(customers)s
+        AND docstatus = 1
+        AND is_return = 0
+        AND outstanding_amount > 0
+        AND due_date < %(today)s
+        GROUP BY customer
+    """, {"customers": tuple(customers), "today": today()}))
+
+    existing = {
+        row.customer: row
+        for row in frappe.db.sql(f"""
+            SELECT customer, balance, oldest_overdue_days, lock_status
+            FROM `{CREDIT_TABLE}`
+            WHERE customer IN %(customers)s
+        """, {"customers": tuple(customers)}, as_dict=True)
+    }
+
+    timestamp = now()
+    snapshots = {}
+    for customer in customers:
+        overdue_days = cint(overdue.get(customer))
+        snapshots[customer] = frappe._dict(
+            customer=customer,
+            balance=flt(balances.get(customer), 2),
+            oldest_overdue_days=overdue_days,
+            lock_status=get_lock_status(overdue_days),
+            modified=timestamp
+        )
+
+    values = []
+    for snapshot in snapshots.values():
+        values.extend([
+            snapshot.customer, snapshot.balance, snapshot.oldest_overdue_days,
+            snapshot.lock_status, snapshot.modified
+        ])
+    frappe.db.sql(f"""
+        INSERT INTO `{CREDIT_TABLE}` (`customer`, `balance`, `oldest_overdue_days`, `lock_status`, `modified`)
+        VALUES {", ".join(["(%s, %s, %s, %s, %s)"] * len(snapshots))}
+        ON DUPLICATE KEY UPDATE
+            `balance` = VALUES(`balance`),
+            `oldest_overdue_days` = VALUES(`oldest_overdue_days`),
+            `lock_status` = VALUES(`lock_status`),
+            `modified` = VALUES(`modified`)
+    """, values)
+
+    lock_changed = False
+    for customer, snapshot in snapshots.items():
+        previous = existing.get(customer)
+        if (previous.lock_status if previous else "") != snapshot.lock_status:
+            lock_changed = True
+        if (
+            previous
+            and flt(previous.balance, 2) == snapshot.balance
+            and previous.oldest_overdue_days == snapshot.oldest_overdue_days
+        ):
+            continue
+        frappe.db.set_value(
+            "Customer",
+            customer,
+            {
+                "custom_customer_credit": snapshot.balance,
+                "custom_account_lock_days_overdue": snapshot.oldest_overdue_days,
+            },
+            update_modified=False
+        )
+
+    if lock_changed:
+        customer_lock.invalidate()
+
+    return snapshots
+
+
+def reconcile_all():
+    """
+    Scheduler Event: nightly
+    Rebuild the snapshot of every customer and drop rows of deleted ones
+    """
+    customers = frappe.get_all("Customer", pluck="name", order_by="name")
+    for start in range(0, len(customers), REFRESH_CHUNK):
+        refresh(customers[start:start + REFRESH_CHUNK])
+        frappe.db.commit()
+
+    frappe.db.sql(f"""
+        DELETE FROM `{CREDIT_TABLE}`
+        WHERE customer NOT IN (SELECT name FROM `tabCustomer`)
+    """)
+    frappe.db.commit()
+
+
+def get_snapshot(customer):
+    """Snapshot row of one customer, computed on the spot if it is missing"""
+    snapshot = frappe.db.sql(f"""
+        SELECT customer, balance, oldest_overdue_days, lock_status, modified
+        FROM `{CREDIT_TABLE}`
+        WHERE customer = %s
+    """, (customer,), as_dict=True)
+    if snapshot:
+        return snapshot[0]
+
+    if not frappe.db.exists("Customer", customer):
+        return None
+    return refresh([customer]).get(customer)
+
+
+@frappe.whitelist()
+@instrument
+def get_customer_credit(customer):
+    """Balance, oldest overdue days and lock state for the Customer form"""
+    frappe.has_permission("Customer", "read", customer, throw=True)
+    return get_snapshot(customer)
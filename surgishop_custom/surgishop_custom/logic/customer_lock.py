@@ -0,0 +1,77 @@
+"""
+Customer lock enforcement
+
+A customer is locked when custom_account_locked is set by hand or when the
+credit snapshot has them hard locked for overdue invoices. The set of
+locked customers is cached per site and dropped whenever a Customer or a
+snapshot lock state changes, so the validate hooks do a set lookup
+instead of a query.
+"""
+import frappe
+
+from surgishop_custom.logic.instrumentation import instrument
+
+LOCKED_CUSTOMERS_KEY = "surgishop_custom:locked_customers"
+
+
+def _load_locked_customers():
+    from surgishop_custom.logic.customer_credit import CREDIT_TABLE
+
+    return set(frappe.db.sql_list(f"""
+        SELECT name FROM `tabCustomer` WHERE custom_account_locked = 1
+        UNION
+        SELECT customer FROM `{CREDIT_TABLE}` WHERE lock_status = 'Hard Lock'
+    """))
+
+
+def get_locked_customers():
+    return frappe.cache.get_value(LOCKED_CUSTOMERS_KEY, generator=_load_locked_customers)
+
+
+def is_locked(customer):
+    return bool(customer) and customer in get_locked_customers()
+
+
+@instrument
+def invalidate(doc=None, method=None, *args):
+    """
+    Drop the cached set of locked customers
+    DocType Event: Customer On Update / After Rename / On Trash
+    """
+    frappe.cache.delete_value(LOCKED_CUSTOMERS_KEY)
+
+
+@instrument
+def validate_customer(doc, method=None):
+    """
+    Block transactions for locked customers
+    DocType Event: Quotation / Sales Order / Delivery Note / Sales Invoice Validate
+    """
+    if doc.doctype == "Quotation":
+        if doc.quotation_to != "Customer":
+            return
+        customer = doc.party_name
+    else:
+        customer = doc.customer
+
+    # Returns are always allowed
+    if doc.get("is_return"):
+        return
+
+    # Goods that already shipped still have to be billed
+    if doc.doctype == "Sales Invoice" and any(item.get("delivery_note") for item in doc.items):
+        return
+
+    if is_locked(customer):
+        frappe.throw(
+            f"Customer {customer} is locked and cannot be used for {doc.doctype}.",
+            title="Customer Locked"
+        )
+
+
+@frappe.whitelist()
+@instrument
+def get_customer_lock(customer):
+    """Lock hint for the transaction forms"""
+    frappe.has_permission("Customer", "read", customer, throw=True)
+    return {"locked": is_locked(customer)}
@@ -0,0 +1,463 @@
+"""
+Bulk Customer Statement runs
+
+A run selects the customers with ledger activity or open items as of the
+statement date using one GL aggregation and one open-invoice aggregation,
+which also give the summary sheet and the balance quoted in the emails.
+The customers are fanned out to parallel workers. Each worker reads the
+period's ledger entries and open invoices of STATEMENT_CHUNK customers at a
+time, one query each, and renders the statement print formats with those
+rows on the statement: doc.statement_totals, doc.ledger_entries (with a
+running balance) and doc.open_items, so the formats need no queries of
+their own. Customers without a Customer Statement are rendered from an
+unsaved one; a run creates no documents but its ZIP.
+
+Every PDF goes straight into the worker's part ZIP on disk; the last part
+to finish, even if it failed, merges the parts into one ZIP, entry by
+entry, and attaches it as a private File.
+
+Progress counters live in the cache, so any worker (or the form polling
+get_statement_run) sees the same totals and throughput. A run whose part
+jobs died without finishing is reported as Failed once the job timeout
+has passed.
+"""
+import csv
+import os
+import shutil
+import time
+import zipfile
+from collections import defaultdict
+
+import frappe
+from frappe.utils import cint, escape_html, flt, fmt_money, get_first_day, getdate, now
+
+from surgishop_custom.logic import app_log
+from surgishop_custom.logic.instrumentation import instrument
+
+STATEMENT_DOCTYPE = "Customer Statement"
+STATEMENT_FORMATS = (
+    "Surgi Customer Statement",
+    "Surgi Transaction Statement",
+    "Surgi Open Items Statement",
+)
+STATEMENT_LETTERHEAD = "Your Letter Head"
+STATEMENT_PARALLELISM = 4
+STATEMENT_FOLDER = "statement_runs"
+STATEMENT_RUN_TTL = 7 * 24 * 60 * 60
+STATEMENT_PART_TIMEOUT = 4 * 60 * 60
+STATEMENT_CHUNK = 100
+RUN_COUNTERS = ("rendered", "emailed", "failed", "parts_done", "parts_failed")
+DATE_FIELDS = ("statement_date", "to_date", "date", "posting_date")
+
+
+def _run_key(run_id, counter=None):
+    key = f"surgishop_custom:statement_run:{run_id}"
+    return frappe.cache.make_key(f"{key}:{counter}") if counter else key
+
+
+def _run_dir(run_id):
+    path = frappe.get_site_path("private", "files", STATEMENT_FOLDER, run_id)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _counter(run_id, counter):
+    return cint(frappe.cache.get(_run_key(run_id, counter)))
+
+
+def _statement_fields():
+    """Customer link and date field of the Customer Statement DocType"""
+    meta = frappe.get_meta(STATEMENT_DOCTYPE)
+    customer_field = next(
+        (df.fieldname for df in meta.fields if df.fieldtype == "Link" and df.options == "Customer"), None
+    )
+    if not customer_field:
+        frappe.throw(f"{STATEMENT_DOCTYPE} has no Customer link field.")
+    date_field = next((fieldname for fieldname in DATE_FIELDS if meta.has_field(fieldname)), None)
+    return customer_field, date_field
+
+
+def get_statement_totals(statement_date, from_date, customers=None, customer_group=None):
+    """
+    Opening balance, period debit/credit, closing balance and open invoices
+    of every customer with activity, in two aggregate queries
+
+    Returns:
+        dict of customer -> totals, ordered by customer
+    """
+    conditions = ""
+    values = {"statement_date": statement_date, "from_date": from_date}
+    if customers:
+        conditions += " AND c.name IN %(customers)s"
+        values["customers"] = tuple(customers)
+    if customer_group:
+        conditions += " AND c.customer_group = %(customer_group)s"
+        values["customer_group"] = customer_group
+
+    ledger = frappe.db.sql(f"""
+        SELECT
+            gle.party AS customer,
+            SUM(IF(gle.posting_date < %(from_date)s, gle.debit - gle.credit, 0)) AS opening_balance,
+            SUM(IF(gle.posting_date >= %(from_date)s, gle.debit, 0)) AS period_debit,
+            SUM(IF(gle.posting_date >= %(from_date)s, gle.credit, 0)) AS period_credit,
+            SUM(gle.debit - gle.credit) AS closing_balance
+        FROM `tabGL Entry` gle
+        INNER JOIN `tabCustomer` c ON c.name = gle.party
+        WHERE gle.party_type = 'Customer'
+        AND gle.is_cancelled = 0
+        AND gle.posting_date <= %(statement_date)s
+        AND c.disabled = 0
+        {conditions}
+        GROUP BY gle.party
+    """, values, as_dict=True)
+
+    open_items = frappe.db.sql(f"""
+        SELECT
+            si.customer,
+            COUNT(*) AS open_invoices,
+            SUM(si.outstanding_amount) AS open_amount
+        FROM `tabSales Invoice` si
+        INNER JOIN `tabCustomer` c ON c.name = si.customer
+        WHERE si.docstatus = 1
+        AND si.outstanding_amount != 0
+        AND si.posting_date <= %(statement_date)s
+        AND c.disabled = 0
+        {conditions}
+        GROUP BY si.customer
+    """, values, as_dict=True)
+
+    totals = {}
+    for row in ledger:
+        if flt(row.closing_balance, 2) or flt(row.period_debit, 2) or flt(row.period_credit, 2):
+            totals[row.customer] = frappe._dict(row, open_invoices=0, open_amount=0)
+    for row in open_items:
+        entry = totals.setdefault(row.customer, frappe._dict(
+            customer=row.customer, opening_balance=0, period_debit=0, period_credit=0, closing_balance=0
+        ))
+        entry.open_invoices = row.open_invoices
+        entry.open_amount = row.open_amount
+
+    return dict(sorted(totals.items()))
+
+
+def get_statement_rows(customers, statement_date, from_date):
+    """
+    Period ledger entries and open invoices of many customers, one query each
+
+    Returns:
+        (dict of customer -> GL rows, dict of customer -> open invoice rows)
+    """
+    values = {"customers": tuple(customers), "statement_date": statement_date, "from_date": from_date}
+
+    ledger = defaultdict(list)
+    for row in frappe.db.sql("""
+        SELECT party AS customer, posting_date, voucher_type, voucher_no, debit, credit, remarks
+        FROM `tabGL Entry`
+        WHERE party_type = 'Customer'
+        AND party IN %(customers)s
+        AND is_cancelled = 0
+        AND posting_date BETWEEN %(from_date)s AND %(statement_date)s
+        ORDER BY party, posting_date, creation
+    """, values, as_dict=True):
+        ledger[row.customer].append(row)
+
+    open_items = defaultdict(list)
+    for row in frappe.db.sql("""
+        SELECT customer, name, posting_date, due_date, grand_total, outstanding_amount
+        FROM `tabSales Invoice`
+        WHERE customer IN %(customers)s
+        AND docstatus = 1
+        AND outstanding_amount != 0
+        AND posting_date <= %(statement_date)s
+        ORDER BY customer, posting_date, name
+    """, values, as_dict=True):
+        open_items[row.customer].append(row)
+
+    return ledger, open_items
+
+
+@frappe.whitelist()
+@instrument
+def start_statement_run(statement_date, from_date=None, customers=None, customer_group=None, formats=None, email=0):
+    """
+    Render statements for every customer with activity as of statement_date
+
+    Args:
+        from_date: start of the transaction period, default the first of the month
+        customers: optional list of customers to limit the run to
+        formats: optional subset of STATEMENT_FORMATS
+        email: also email each customer their statements
+
+    Returns:
+        dict with run_id and the number of customers
+    """
+    frappe.only_for(["Accounts Manager", "System Manager"])
+
+    statement_date = getdate(statement_date)
+    from_date = getdate(from_date) if from_date else get_first_day(statement_date)
+    if isinstance(customers, str):
+        customers = frappe.parse_json(customers)
+    if isinstance(formats, str):
+        formats = frappe.parse_json(formats)
+    formats = [print_format for print_format in (formats or STATEMENT_FORMATS) if print_format in STATEMENT_FORMATS]
+
+    _statement_fields()
+    totals = get_statement_totals(statement_date, from_date, customers, customer_group)
+    names = list(totals)
+
+    run_id = frappe.generate_hash(length=10)
+    parallelism = max(min(cint(frappe.conf.get("statement_parallelism")) or STATEMENT_PARALLELISM, len(names)), 1)
+    run = {
+        "run_id": run_id,
+        "status": "Running" if names else "Completed",
+        "statement_date": str(statement_date),
+        "from_date": str(from_date),
+        "formats": formats,
+        "email": cint(email),
+        "customers": len(names),
+        "documents": len(names) * len(formats),
+        "parts": parallelism,
+        "started_at": now(),
+        "started": time.time(),
+        "owner": frappe.session.user,
+    }
+    frappe.cache.set_value(_run_key(run_id), run, expires_in_sec=STATEMENT_RUN_TTL)
+    for counter in RUN_COUNTERS:
+        frappe.cache.set(_run_key(run_id, counter), 0, ex=STATEMENT_RUN_TTL)
+
+    # Totals go into the ZIP as a summary sheet
+    with open(os.path.join(_run_dir(run_id), "summary.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Customer", "Opening Balance", "Debit", "Credit", "Closing Balance", "Open Invoices", "Open Amount"])
+        for row in totals.values():
+            writer.writerow([
+                row.customer, flt(row.opening_balance, 2), flt(row.period_debit, 2), flt(row.period_credit, 2),
+                flt(row.closing_balance, 2), row.open_invoices, flt(row.open_amount, 2)
+            ])
+
+    for part in range(parallelism if names else 0):
+        frappe.enqueue(
+            "surgishop_custom.logic.customer_statement.render_statement_part",
+            queue="long",
+            timeout=STATEMENT_PART_TIMEOUT,
+            run_id=run_id,
+            part=part,
+            customers=names[part::parallelism],
+            totals={name: totals[name] for name in names[part::parallelism]}
+        )
+
+    return {"run_id": run_id, "customers": len(names)}
+
+
+def render_statement_part(run_id, part, customers, totals):
+    """
+    Background job: render one share of a statement run into its own part ZIP
+
+    A part that fails (or hits the job timeout) still counts as done, so
+    the run is merged with whatever the other parts rendered.
+    """
+    run = frappe.cache.get_value(_run_key(run_id))
+    if not run:
+        return
+
+    try:
+        _render_part(run_id, run, part, customers, totals)
+    except BaseException as e:
+        frappe.db.rollback()
+        frappe.cache.incr(_run_key(run_id, "parts_failed"))
+        frappe.cache.set(_run_key(run_id, f"part_error:{part}"), str(e) or type(e).__name__, ex=STATEMENT_RUN_TTL)
+        app_log.error("statement_part_failed", ref=run_id, title="Statement run part failed", error=str(e), part=part)
+        raise
+    finally:
+        _publish_progress(run_id)
+
+        # The last part to finish merges the run
+        if frappe.cache.incr(_run_key(run_id, "parts_done")) >= run["parts"]:
+            merge_statement_run(run_id)
+
+
+def _render_part(run_id, run, part, customers, totals):
+    customer_field, date_field = _statement_fields()
+    emails = dict(frappe.get_all(
+        "Customer",
+        filters={"name": ["in", customers]},
+        fields=["name", "email_id"],
+        as_list=True
+    )) if run["email"] else {}
+
+    part_path = os.path.join(_run_dir(run_id), f"part-{part}.zip")
+    with zipfile.ZipFile(part_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for start in range(0, len(customers), STATEMENT_CHUNK):
+            chunk = customers[start:start + STATEMENT_CHUNK]
+            ledger, open_items = get_statement_rows(chunk, run["statement_date"], run["from_date"])
+            existing = dict(frappe.get_all(
+                STATEMENT_DOCTYPE,
+                filters={customer_field: ["in", chunk]},
+                fields=[customer_field, "name"],
+                as_list=True
+            ))
+
+            for customer in chunk:
+                try:
+                    statement = _get_statement(
+                        customer, existing.get(customer), customer_field, date_field, run["statement_date"]
+                    )
+                    _set_statement_rows(statement, totals[customer], ledger[customer], open_items[customer])
+
+                    attachments = []
+                    for print_format in run["formats"]:
+                        pdf = frappe.get_print(
+                            STATEMENT_DOCTYPE,
+                            statement.name,
+                            print_format=print_format,
+                            doc=statement,
+                            as_pdf=True,
+                            letterhead=STATEMENT_LETTERHEAD
+                        )
+                        filename = f"{_safe(customer)}/{_safe(print_format)}.pdf"
+                        zf.writestr(filename, pdf)
+                        if emails.get(customer):
+                            attachments.append({"fname": f"{_safe(print_format)}.pdf", "fcontent": pdf})
+                        frappe.cache.incr(_run_key(run_id, "rendered"))
+
+                    if attachments:
+                        _email_statement(emails[customer], customer, totals[customer].closing_balance, run, attachments)
+                        frappe.cache.incr(_run_key(run_id, "emailed"))
+                    frappe.db.commit()
+
+                except Exception as e:
+                    frappe.db.rollback()
+                    frappe.cache.incr(_run_key(run_id, "failed"))
+                    app_log.error("statement_customer_failed", ref=customer, title="Statement run failed for customer", error=str(e), run_id=run_id)
+
+
+def _get_statement(customer, name, customer_field, date_field, statement_date):
+    """The customer's Customer Statement dated for this run; an unsaved one if there is none"""
+    if name:
+        statement = frappe.get_doc(STATEMENT_DOCTYPE, name)
+    else:
+        statement = frappe.new_doc(STATEMENT_DOCTYPE)
+        statement.set(customer_field, customer)
+        statement.name = customer
+
+    # Render as of the run date without saving the statement
+    if date_field:
+        statement.set(date_field, statement_date)
+    return statement
+
+
+def _set_statement_rows(statement, totals, ledger_entries, open_items):
+    """Hand the run's figures to the print formats; they are not saved"""
+    balance = flt(totals.opening_balance)
+    for row in ledger_entries:
+        balance += flt(row.debit) - flt(row.credit)
+        row.balance = balance
+
+    statement.set("statement_totals", totals, as_value=True)
+    statement.set("ledger_entries", ledger_entries, as_value=True)
+    statement.set("open_items", open_items, as_value=True)
+
+
+def _safe(value):
+    return "".join(char if char.isalnum() or char in " -_." else "-" for char in value).strip()
+
+
+def _email_statement(recipient, customer, closing, run, attachments):
+    frappe.sendmail(
+        recipients=[recipient],
+        subject=f"Statement as of {run['statement_date']}",
+        message=f"""
+            <p>Dear {escape_html(customer)},</p>
+
+            <p>Please find attached your statement as of {run['statement_date']}.
+            The balance on your account is <b>{fmt_money(flt(closing))}</b>.</p>
+
+            <p>Thank you for your business.</p>
+            """,
+        attachments=attachments,
+        reference_doctype="Customer",
+        reference_name=customer
+    )
+
+
+def merge_statement_run(run_id):
+    """Combine the part ZIPs of a run into one private File"""
+    run = frappe.cache.get_value(_run_key(run_id))
+    run_dir = _run_dir(run_id)
+    filename = f"statements-{run['statement_date']}-{run_id}.zip"
+    zip_path = os.path.join(run_dir, filename)
+
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as merged:
+        merged.write(os.path.join(run_dir, "summary.csv"), "summary.csv")
+        for part in range(run["parts"]):
+            part_path = os.path.join(run_dir, f"part-{part}.zip")
+            if not os.path.exists(part_path):
+                continue
+            with zipfile.ZipFile(part_path) as zf:
+                for entry in zf.infolist():
+                    with zf.open(entry) as source, merged.open(entry.filename, "w") as target:
+                        shutil.copyfileobj(source, target)
+            os.remove(part_path)
+    os.remove(os.path.join(run_dir, "summary.csv"))
+
+    file_doc = frappe.get_doc({
+        "doctype": "File",
+        "file_name": filename,
+        "file_url": f"/private/files/{STATEMENT_FOLDER}/{run_id}/{filename}",
+        "is_private": 1,
+    })
+    file_doc.insert(ignore_permissions=True)
+    frappe.db.commit()
+
+    parts_failed = _counter(run_id, "parts_failed")
+    run.update({
+        "status": "Completed with Errors" if parts_failed else "Completed",
+        "file_url": file_doc.file_url,
+        "finished_at": now(),
+    })
+    frappe.cache.set_value(_run_key(run_id), run, expires_in_sec=STATEMENT_RUN_TTL)
+    _publish_progress(run_id)
+
+
+def _progress(run_id):
+    run = frappe.cache.get_value(_run_key(run_id))
+    if not run:
+        return None
+
+    rendered = _counter(run_id, "rendered")
+    elapsed = time.time() - run["started"]
+    if run["status"] == "Running" and elapsed > STATEMENT_PART_TIMEOUT + 15 * 60:
+        # Watchdog: a part was killed without reaching its finally block
+        run.update({"status": "Failed", "error": "Statement parts did not finish before the job timeout"})
+        frappe.cache.set_value(_run_key(run_id), run, expires_in_sec=STATEMENT_RUN_TTL)
+
+    part_errors = {}
+    for part in range(run["parts"]):
+        error = frappe.cache.get(_run_key(run_id, f"part_error:{part}"))
+        if error:
+            part_errors[part] = error.decode() if isinstance(error, bytes) else error
+
+    return {
+        **run,
+        "rendered": rendered,
+        "emailed": _counter(run_id, "emailed"),
+        "failed_customers": _counter(run_id, "failed"),
+        "parts_done": _counter(run_id, "parts_done"),
+        "part_errors": part_errors,
+        "elapsed_seconds": round(elapsed, 1),
+        "documents_per_minute": round(rendered / elapsed * 60, 1) if elapsed else None,
+    }
+
+
+def _publish_progress(run_id):
+    progress = _progress(run_id)
+    if progress:
+        frappe.publish_realtime("statement_run_progress", progress, user=progress["owner"], after_commit=False)
+
+
+@frappe.whitelist()
+@instrument
+def get_statement_run(run_id):
+    """Progress, throughput and (when done) the ZIP of a statement run"""
+    frappe.only_for(["Accounts Manager", "System Manager"])
+    return _progress(run_id) or {"run_id": run_id, "status": "Unknown"}
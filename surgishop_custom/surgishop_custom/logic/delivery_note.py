@@ -1,193 +1,355 @@
 """
 Delivery Note Server Scripts
+
+Post-submit automation (packing slip -> print -> sales invoice) runs in a
+background job after the Delivery Note submit has committed. Progress is
+tracked per Delivery Note in __dn_post_submit, every step checks whether
+its work already exists, and failed runs are retried with backoff.
 """
 import frappe
+from frappe.utils import add_to_date, now, now_datetime
+
+from surgishop_custom.logic import app_log, consolidated_invoicing, print_queue
+from surgishop_custom.logic.instrumentation import instrument
+from surgishop_custom.logic.tables import table_exists
+
+# --- Configuration ---
+PACKING_SLIP_DOCTYPE = "Packing Slip"
+PRINT_FORMAT = "Surgi Packing Slip"
+
+PIPELINE_TABLE = "__dn_post_submit"
+MAX_ATTEMPTS = 6
+RETRY_BASE_MINUTES = 2
+# Longer than the default queue's job timeout: a Queued or Running row this
+# old lost its job (killed worker, flushed Redis)
+STALE_MINUTES = 10
+
+
+def ensure_pipeline_table():
+    """Create the post-submit tracking table if it does not exist yet"""
+    frappe.db.sql_ddl(f"""
+        CREATE TABLE IF NOT EXISTS `{PIPELINE_TABLE}` (
+            `delivery_note` VARCHAR(140) NOT NULL,
+            `status` VARCHAR(20) NOT NULL,
+            `packing_slip` VARCHAR(140) NULL,
+            `printed` TINYINT(1) NOT NULL DEFAULT 0,
+            `sales_invoice` VARCHAR(140) NULL,
+            `attempts` INT NOT NULL DEFAULT 0,
+            `next_attempt_at` DATETIME(6) NULL,
+            `last_error` TEXT NULL,
+            `modified` DATETIME(6) NOT NULL,
+            PRIMARY KEY (`delivery_note`),
+            KEY `status_next_attempt` (`status`, `next_attempt_at`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
 
 
-def to_packing_list(doc, method=None):
+@instrument
+def queue_post_submit(doc, method=None):
     """
-    This function MUST be linked as a Custom Script or Server Script
-    to run on the 'after_submit' event of the 'Delivery Note' DocType.
+    Queue packing slip, print and invoice creation for a submitted Delivery Note
+    DocType Event: After Submit
     """
-    # --- Configuration ---
-    PRINTER_NAME = "Brother_HL-L3210CW_series"
-    PACKING_SLIP_DOCTYPE = "Packing Slip"
-    PRINT_FORMAT = "Surgi Packing Slip"
-
     if doc.doctype != "Delivery Note" or doc.docstatus != 1:
-        # Only show this if the hook is somehow misconfigured
         return
 
-    dn = doc
-
-    try:
-        # Reload DN silently to ensure latest state
-        dn = frappe.get_doc("Delivery Note", doc.name)
-        frappe.log_error(message=f"Reloaded DN: {dn.name}", title="Debug: DN Reload Success")
-    except Exception as reload_err:
-        frappe.msgprint(f"✗ Failed to reload Delivery Note {doc.name}. Error: {str(reload_err)}", alert=True, indicator="red")
-        frappe.log_error(message=str(reload_err), title=f"DN Reload Error for {doc.name}")
+    if not table_exists(PIPELINE_TABLE):
+        # The tracking table's patch has not run yet
+        run_post_submit_inline(doc)
         return
 
-    # Check if the Packing Slip DocType exists (critical check)
-    if not frappe.db.exists("DocType", PACKING_SLIP_DOCTYPE):
-        frappe.msgprint("✗ Packing Slip DocType not found! Check configuration.", alert=True, indicator="red")
+    frappe.db.sql(f"""
+        INSERT INTO `{PIPELINE_TABLE}` (`delivery_note`, `status`, `modified`)
+        VALUES (%s, 'Queued', %s)
+        ON DUPLICATE KEY UPDATE `status` = 'Queued', `attempts` = 0, `next_attempt_at` = NULL
+    """, (doc.name, now()))
+
+    _enqueue(doc.name)
+
+    frappe.msgprint(
+        "Packing Slip, print and Sales Invoice are being created in the background.",
+        alert=True, indicator="blue"
+    )
+
+
+def _enqueue(delivery_note):
+    frappe.enqueue(
+        "surgishop_custom.logic.delivery_note.run_post_submit",
+        queue="default",
+        enqueue_after_commit=True,
+        job_id=f"dn_post_submit::{delivery_note}",
+        deduplicate=True,
+        delivery_note=delivery_note
+    )
+
+
+def _get_state(delivery_note):
+    if not table_exists(PIPELINE_TABLE):
+        return None
+
+    state = frappe.db.sql(f"""
+        SELECT * FROM `{PIPELINE_TABLE}` WHERE delivery_note = %s
+    """, (delivery_note,), as_dict=True)
+    return state[0] if state else None
+
+
+def _update_state(delivery_note, **values):
+    values["modified"] = now()
+    assignments = ", ".join(f"`{field}` = %({field})s" for field in values)
+    frappe.db.sql(f"""
+        UPDATE `{PIPELINE_TABLE}` SET {assignments} WHERE delivery_note = %(delivery_note)s
+    """, {**values, "delivery_note": delivery_note})
+
+
+def run_post_submit(delivery_note):
+    """
+    Background job: run the outstanding post-submit steps for one Delivery Note
+
+    Each step commits on success. A failing step is recorded and the
+    remaining independent steps still run; the run is retried later.
+    """
+    state = _get_state(delivery_note)
+    if not state or state.status == "Completed":
         return
 
-    try:
-        packing_slip = frappe.new_doc(PACKING_SLIP_DOCTYPE)
+    _update_state(delivery_note, status="Running")
+    frappe.db.commit()
 
-        # Set REQUIRED fields (General)
-        packing_slip.from_case_no = 1
-        packing_slip.to_case_no = 1
+    dn = frappe.get_doc("Delivery Note", delivery_note)
+    if dn.docstatus != 1:
+        _update_state(delivery_note, status="Cancelled")
+        frappe.db.commit()
+        return
 
-        # --- MANDATORY HEADER MAPPING ---
-        packing_slip.delivery_note = dn.name
-        packing_slip.customer = dn.customer
+    errors = []
 
+    # 1. Packing Slip
+    packing_slip = state.packing_slip or get_existing_packing_slip(dn.name)
+    if not packing_slip:
         try:
-            packing_slip.customer_name = dn.customer_name
-        except Exception:
-            packing_slip.customer_name = dn.customer
-
-        packing_slip.naming_series = "MAT-PAC-.YYYY.-"
-        packing_slip.company = dn.company
-        packing_slip.delivery_date = dn.delivery_date
-        packing_slip.shipping_address_name = dn.shipping_address_name
-        packing_slip.billing_address_name = dn.billing_address_name
-        packing_slip.contact_person = dn.contact_person
-
-        # Map items
-        mapped_item_count = 0
-        for dn_item in dn.items:
-            dn_item_reference_name = dn_item.name
-
-            if not dn_item_reference_name:
-                error_msg = f"CRITICAL: Failed to retrieve unique name for item {dn_item.item_code} (idx: {dn_item.idx}). Cannot link to Packing Slip."
-                frappe.msgprint(error_msg, alert=True, indicator="red")
-                continue
-
-            ps_item = packing_slip.append("items", {})
-            try:
-                ps_item.dn_detail = dn_item_reference_name
-                mapped_item_count += 1
-            except Exception:
-                frappe.msgprint(f"CRITICAL: Item {dn_item.item_code} failed to link. Field 'dn_detail' not found.", alert=True, indicator="red")
-                frappe.log_error(f"Missing mandatory reference field 'dn_detail' on PS Item for {dn_item.item_code}", "PS Item Link Failure")
-                packing_slip.items.pop()
-                continue
-
-            ps_item.item_code = dn_item.item_code
-            ps_item.item_name = dn_item.item_name
-            ps_item.qty = dn_item.qty
-
-            try:
-                ps_item.description = dn_item.description
-            except Exception:
-                ps_item.description = ""
-
-            try:
-                ps_item.stock_uom = dn_item.stock_uom
-            except Exception:
-                ps_item.stock_uom = None
-
-            try:
-                ps_item.uom = dn_item.uom
-            except Exception:
-                ps_item.uom = None
-
-            try:
-                ps_item.warehouse = dn_item.warehouse
-            except Exception:
-                ps_item.warehouse = None
-
-        if mapped_item_count == 0:
-            frappe.msgprint("✗ No items could be successfully mapped to the Packing Slip.", alert=True, indicator="red")
-            return
-
-        packing_slip.insert(ignore_permissions=True)
-
-        # Submit the Packing Slip
-        try:
-            packing_slip.submit()
-            
-        except Exception as submit_err:
-            error_details = str(submit_err)
-            frappe.msgprint(f"✗ Packing Slip submission failed. Details: {error_details}", alert=True, indicator="red")
-            frappe.log_error(message=error_details, title=f"PS Submit Error for {packing_slip.name}")
-            return
-            
-        # --- Print the Submitted Packing Slip ---
-        print_failed = False
+            packing_slip = make_packing_slip(dn)
+            app_log.debug("dn_packing_slip_created", ref=delivery_note, packing_slip=packing_slip)
+        except Exception as ps_err:
+            frappe.db.rollback()
+            errors.append(f"Packing Slip: {ps_err}")
+    if packing_slip and packing_slip != state.packing_slip:
+        _update_state(delivery_note, packing_slip=packing_slip)
+        frappe.db.commit()
+
+    # 2. Queue the submitted Packing Slip for printing
+    if packing_slip and not state.printed:
         try:
-            # Call the custom app function to print the Packing Slip
-            frappe.call(
-                "surgi_print_dn.api.print_packing_slip_via_webhook",
-                doc_name=packing_slip.name,
-                printer_name=PRINTER_NAME,
-                print_format=PRINT_FORMAT  # Pass the custom print format defined in the config
-            )
+            print_packing_slip(packing_slip)
+            _update_state(delivery_note, printed=1)
+            frappe.db.commit()
         except Exception as print_err:
-            error_details = str(print_err)
-            print_failed = True
-            # Log failure but do not return
-            frappe.log_error(message=error_details, title=f"PS Print Error for {packing_slip.name}")
-
-        # --- FINAL SINGLE MESSAGE ---
-        if print_failed:
-            frappe.msgprint(
-                f"✓ Packing Slip {packing_slip.name} created and submitted. ✗ WARNING: Print failed. Check Error Log for details.", 
-                alert=True, indicator="orange"
-            )
-        else:
-            frappe.msgprint(
-                f"✓ Packing Slip {packing_slip.name} created, submitted, and sent to printer.", 
-                alert=True, indicator="green"
-            )
+            frappe.db.rollback()
+            errors.append(f"Print: {print_err}")
+
+    # 3. Sales Invoice, unless the customer is invoiced per period (returns are always credited)
+    sales_invoice = state.sales_invoice or get_existing_sales_invoice(dn.name)
+    if not sales_invoice and (dn.is_return or not consolidated_invoicing.get_period(dn.customer)):
+        try:
+            sales_invoice = make_sales_invoice(dn)
+            app_log.debug("dn_sales_invoice_created", ref=delivery_note, sales_invoice=sales_invoice)
+        except Exception as si_err:
+            frappe.db.rollback()
+            errors.append(f"Sales Invoice: {si_err}")
+    if sales_invoice and sales_invoice != state.sales_invoice:
+        _update_state(delivery_note, sales_invoice=sales_invoice)
+        frappe.db.commit()
 
-    except Exception as ps_err:
-        frappe.msgprint(f"✗ Packing Slip creation failed. Error: {str(ps_err)}", alert=True, indicator="red")
-        frappe.log_error(message=str(ps_err), title="Packing Slip Creation Error")
+    if not errors:
+        _update_state(delivery_note, status="Completed", last_error=None, next_attempt_at=None)
+        frappe.db.commit()
         return
 
+    attempts = state.attempts + 1
+    error_details = "\n".join(errors)
+    if attempts >= MAX_ATTEMPTS:
+        _update_state(delivery_note, status="Failed", attempts=attempts, last_error=error_details, next_attempt_at=None)
+    else:
+        _update_state(
+            delivery_note,
+            status="Retrying",
+            attempts=attempts,
+            last_error=error_details,
+            next_attempt_at=add_to_date(now_datetime(), minutes=RETRY_BASE_MINUTES * 2 ** (attempts - 1))
+        )
+    app_log.error(
+        "dn_post_submit_failed", ref=delivery_note, exc=False, title="DN Post-Submit Error",
+        error=error_details, attempts=attempts
+    )
+    frappe.db.commit()
 
-def to_sales_invoice(doc, method=None):
+
+def run_post_submit_inline(dn):
     """
-    This script MUST be attached as a Server Script
-    to run on the 'after_submit' event of the 'Delivery Note' DocType.
-    It creates and submits the Sales Invoice only after the Delivery Note is finalized.
+    The post-submit steps inside the submit request, without tracking
+
+    Only used until the pipeline table exists. Each step runs under its own
+    savepoint, so a failing step is logged and does not fail the submit.
     """
-    # Ensure the document is a submitted Delivery Note
-    if doc.doctype != "Delivery Note" or doc.docstatus != 1:
-        return
+    errors = []
+    packing_slip = _inline_step(
+        "Packing Slip", errors, lambda: get_existing_packing_slip(dn.name) or make_packing_slip(dn)
+    )
+    if packing_slip:
+        _inline_step("Print", errors, lambda: print_packing_slip(packing_slip))
+    if dn.is_return or not consolidated_invoicing.get_period(dn.customer):
+        _inline_step("Sales Invoice", errors, lambda: get_existing_sales_invoice(dn.name) or make_sales_invoice(dn))
+
+    if errors:
+        error_details = "\n".join(errors)
+        app_log.error(
+            "dn_post_submit_failed", ref=dn.name, exc=False, title="DN Post-Submit Error",
+            error=error_details, attempts=1
+        )
+        frappe.msgprint(f"Post-submit automation failed: {error_details}", alert=True, indicator="red")
 
-    dn = doc
 
-    # --- Create and Submit Sales Invoice ---
+def _inline_step(step, errors, run):
+    frappe.db.savepoint("dn_post_submit")
     try:
-        # 1. Call the standard mapper to create the Sales Invoice dict from the Delivery Note
-        # We pass BOTH the name (source_name) and the document object (source_doc) for maximum reliability.
-        from erpnext.stock.doctype.delivery_note.delivery_note import make_sales_invoice
-        si_doc_dict = make_sales_invoice(dn.name)
-
-        if si_doc_dict and si_doc_dict.get('doctype') == 'Sales Invoice':
-            # 2. Convert dict to DocType object, insert, and submit
-            si = frappe.get_doc(si_doc_dict)
-            si.insert(ignore_permissions=True)
-            si.submit()
-
-            # 3. Final success message
-            frappe.msgprint(
-                f"✓ Sales Invoice {si.name} automatically created and submitted.",
-                alert=True,
-                indicator="green"
+        return run()
+    except Exception as e:
+        frappe.db.rollback(save_point="dn_post_submit")
+        errors.append(f"{step}: {e}")
+
+
+def retry_post_submit():
+    """
+    Scheduler Event: every minute
+    Re-queue Delivery Notes whose retry time has come, and those whose job was lost
+    """
+    if not table_exists(PIPELINE_TABLE):
+        return
+
+    due = frappe.db.sql_list(f"""
+        SELECT delivery_note
+        FROM `{PIPELINE_TABLE}`
+        WHERE (status = 'Retrying' AND next_attempt_at <= %(now)s)
+        OR (status IN ('Queued', 'Running') AND modified < %(stale_before)s)
+    """, {"now": now(), "stale_before": add_to_date(now_datetime(), minutes=-STALE_MINUTES)})
+
+    for delivery_note in due:
+        _update_state(delivery_note, status="Queued")
+        _enqueue(delivery_note)
+    frappe.db.commit()
+
+
+@frappe.whitelist()
+@instrument
+def get_post_submit_status(delivery_note):
+    """Post-submit automation status for the Delivery Note form"""
+    frappe.has_permission("Delivery Note", "read", delivery_note, throw=True)
+    return _get_state(delivery_note)
+
+
+@frappe.whitelist()
+@instrument
+def retry_post_submit_now(delivery_note):
+    """Re-run the outstanding post-submit steps from the Delivery Note form"""
+    frappe.has_permission("Delivery Note", "submit", delivery_note, throw=True)
+
+    state = _get_state(delivery_note)
+    if not state or state.status == "Completed":
+        return state
+
+    _update_state(delivery_note, status="Queued", attempts=0, next_attempt_at=None)
+    _enqueue(delivery_note)
+    return _get_state(delivery_note)
+
+
+def get_existing_packing_slip(delivery_note):
+    return frappe.db.get_value(
+        PACKING_SLIP_DOCTYPE, {"delivery_note": delivery_note, "docstatus": 1}, "name"
+    )
+
+
+def get_existing_sales_invoice(delivery_note):
+    return frappe.db.get_value(
+        "Sales Invoice Item", {"delivery_note": delivery_note, "docstatus": 1}, "parent"
+    )
+
+
+def make_packing_slip(dn):
+    """
+    Create and submit the Packing Slip for a submitted Delivery Note
+
+    Returns:
+        the Packing Slip name
+    """
+    # Check if the Packing Slip DocType exists (critical check)
+    if not frappe.db.exists("DocType", PACKING_SLIP_DOCTYPE):
+        raise Exception("Packing Slip DocType not found! Check configuration.")
+
+    packing_slip = frappe.new_doc(PACKING_SLIP_DOCTYPE)
+
+    # Set REQUIRED fields (General)
+    packing_slip.from_case_no = 1
+    packing_slip.to_case_no = 1
+
+    # --- MANDATORY HEADER MAPPING ---
+    packing_slip.delivery_note = dn.name
+    packing_slip.customer = dn.customer
+    packing_slip.customer_name = dn.get("customer_name") or dn.customer
+    packing_slip.naming_series = "MAT-PAC-.YYYY.-"
+    packing_slip.company = dn.company
+    packing_slip.delivery_date = dn.get("delivery_date")
+    packing_slip.shipping_address_name = dn.shipping_address_name
+    packing_slip.billing_address_name = dn.get("billing_address_name")
+    packing_slip.contact_person = dn.contact_person
+
+    # Map items
+    for dn_item in dn.items:
+        if not dn_item.name:
+            raise Exception(
+                f"Failed to retrieve unique name for item {dn_item.item_code} (idx: {dn_item.idx}). Cannot link to Packing Slip."
             )
-        else:
-            # Handle cases where the mapper returns something unexpected (e.g., already invoiced)
-            frappe.msgprint("✗ Sales Invoice creation skipped (DN likely already invoiced).", alert=True, indicator="orange")
-
-    except Exception as si_err:
-        error_details = str(si_err)
-        # Log failure
-        frappe.msgprint(f"✗ Sales Invoice automation failed. Check Error Log. Details: {error_details}", alert=True, indicator="red")
-        frappe.log_error(message=error_details, title=f"SI Auto Creation Error for DN {dn.name}")
+
+        packing_slip.append("items", {
+            "dn_detail": dn_item.name,
+            "item_code": dn_item.item_code,
+            "item_name": dn_item.item_name,
+            "qty": dn_item.qty,
+            "description": dn_item.get("description") or "",
+            "stock_uom": dn_item.get("stock_uom"),
+            "uom": dn_item.get("uom"),
+            "warehouse": dn_item.get("warehouse"),
+        })
+
+    if not packing_slip.items:
+        raise Exception("No items could be successfully mapped to the Packing Slip.")
+
+    packing_slip.insert(ignore_permissions=True)
+    packing_slip.submit()
+
+    return packing_slip.name
+
+
+def print_packing_slip(packing_slip_name):
+    """Queue the submitted Packing Slip for the warehouse printer"""
+    print_queue.queue_print(PACKING_SLIP_DOCTYPE, packing_slip_name, print_format=PRINT_FORMAT)
+
+
+def make_sales_invoice(dn):
+    """
+    Create and submit the Sales Invoice for a submitted Delivery Note
+
+    Returns:
+        the Sales Invoice name, or None when the DN has nothing left to bill
+    """
+    # Call the standard mapper to create the Sales Invoice from the Delivery Note
+    from erpnext.stock.doctype.delivery_note.delivery_note import make_sales_invoice as map_sales_invoice
+    si = map_sales_invoice(dn.name)
+
+    if not si or si.get("doctype") != "Sales Invoice" or not si.get("items"):
+        # Mapper returns nothing billable when the DN is already invoiced
+        return None
+
+    si = frappe.get_doc(si) if isinstance(si, dict) else si
+    si.insert(ignore_permissions=True)
+    si.submit()
+
+    return si.name
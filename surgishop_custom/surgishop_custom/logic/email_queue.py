@@ -1,61 +1,132 @@
 """
 Email Queue Server Scripts
 """
+from collections import defaultdict
+
 import frappe
-from frappe.utils import escape_html
+from frappe.utils import escape_html, now
+
+from surgishop_custom.logic.app_log import error_signature
+from surgishop_custom.logic.instrumentation import instrument
+
+BOUNCE_BUFFER_KEY = "surgishop_custom:bounce_alert_buffer"
+ALERT_RECIPIENTS = ["accounting@surgishop.com"]
 
 
+@instrument
 def bounce_notification(doc, method=None):
     """
     Alert Accounting AND log on Sales Invoice timeline
     Prevents duplicate alerts
     ERPNext v16 compatible
+
+    Only buffers the failed queue row; flush_bounce_alerts sends one
+    digest per run instead of one email per failure.
     """
     if (
         doc.reference_doctype == "Sales Invoice"
         and doc.status in ("Error", "Not Sent")
         and not doc.get("custom_alert_sent")
     ):
+        frappe.cache.sadd(BOUNCE_BUFFER_KEY, doc.name)
+
 
-        invoice_name = doc.reference_name
-        error_msg = doc.error or "No error details provided"
+def flush_bounce_alerts():
+    """
+    Scheduler Event: every minute
 
+    Writes the timeline comments for buffered failures directly, without
+    loading the Sales Invoices, and sends accounting one digest grouped by
+    error signature. custom_alert_sent is still what prevents duplicates.
+    """
+    buffered = [
+        name.decode() if isinstance(name, bytes) else name
+        for name in frappe.cache.smembers(BOUNCE_BUFFER_KEY)
+    ]
+    if not buffered:
+        return
+
+    failures = frappe.db.sql("""
+        SELECT name, reference_name, error
+        FROM `tabEmail Queue`
+        WHERE name IN %(names)s
+        AND reference_doctype = 'Sales Invoice'
+        AND IFNULL(custom_alert_sent, 0) = 0
+    """, {"names": tuple(buffered)}, as_dict=True)
+
+    if failures:
         # 1️⃣ Log to Sales Invoice timeline
-        try:
-            frappe.get_doc("Sales Invoice", invoice_name).add_comment(
-                "Info",
-                f"""
-                <b>Email Delivery Failure</b><br>
-                The invoice email failed or bounced.<br><br>
-                <b>Error:</b><br>
-                <pre>{escape_html(error_msg)}</pre>
-                """
-            )
-        except Exception as e:
-            frappe.log_error(
-                f"Failed to log email error to Sales Invoice {invoice_name}: {e}"
-            )
-
-        # 2️⃣ Email Accounting
-        frappe.sendmail(
-            recipients=["accounting@surgishop.com"],
-            subject=f"[ALERT] Sales Invoice Email Failed – {invoice_name}",
-            message=f"""
-            <p><b>Sales Invoice Email Failure</b></p>
+        timestamp = now()
+        user = frappe.session.user
+        frappe.db.bulk_insert(
+            "Comment",
+            ["name", "creation", "modified", "owner", "modified_by", "comment_type",
+             "reference_doctype", "reference_name", "comment_email", "content"],
+            [
+                [
+                    frappe.generate_hash(length=10), timestamp, timestamp, user, user, "Info",
+                    "Sales Invoice", failure.reference_name, user,
+                    f"""
+                    <b>Email Delivery Failure</b><br>
+                    The invoice email failed or bounced.<br><br>
+                    <b>Error:</b><br>
+                    <pre>{escape_html(failure.error or "No error details provided")}</pre>
+                    """
+                ]
+                for failure in failures
+            ]
+        )
+
+        # 2️⃣ Email Accounting one digest
+        send_bounce_digest(failures)
+
+        # 3️⃣ Mark alerts as sent (prevents duplicates)
+        frappe.db.set_value(
+            "Email Queue",
+            {"name": ["in", [failure.name for failure in failures]]},
+            "custom_alert_sent",
+            1,
+            update_modified=False
+        )
+
+    frappe.db.commit()
+    frappe.cache.srem(BOUNCE_BUFFER_KEY, *buffered)
+
+
+def send_bounce_digest(failures):
+    groups = defaultdict(list)
+    for failure in failures:
+        groups[error_signature(failure.error)].append(failure)
+
+    sections = ""
+    for signature, group in sorted(groups.items(), key=lambda item: -len(item[1])):
+        invoices = ", ".join(
+            f"<b>{escape_html(name)}</b>"
+            for name in dict.fromkeys(failure.reference_name for failure in group)
+        )
+        sections += f"""
+            <p><b>{len(group)} failure(s):</b> <code>{escape_html(signature)}</code></p>
+            <p>{invoices}</p>
+            <pre>{escape_html(group[0].error or "No error details provided")}</pre>
+            """
+
+    invoice_count = len({failure.reference_name for failure in failures})
+    frappe.sendmail(
+        recipients=ALERT_RECIPIENTS,
+        subject=f"[ALERT] Sales Invoice Emails Failed – {invoice_count} invoice(s)",
+        message=f"""
+            <p><b>Sales Invoice Email Failures</b></p>
 
             <p>
-            The email for Sales Invoice <b>{invoice_name}</b> failed to send or bounced.
+            The emails for {invoice_count} Sales Invoice(s) failed to send or bounced,
+            grouped by error below.
             </p>
 
-            <p><b>Error Details:</b></p>
-            <pre>{escape_html(error_msg)}</pre>
+            {sections}
 
             <p>
-            Please verify the customer email address and resend the invoice.
+            Please verify the customer email addresses and resend the invoices.
             </p>
             """,
-            delayed=False
-        )
-
-        # 3️⃣ Mark alert as sent (prevents duplicates)
-        doc.db_set("custom_alert_sent", 1, update_modified=False)
+        delayed=False
+    )
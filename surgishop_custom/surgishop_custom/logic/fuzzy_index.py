@@ -0,0 +1,379 @@
+"""
+Fuzzy Item lookup index for recall matching
+
+Every Item contributes a few terms: item_name, item_code, its barcodes and
+its manufacturer part numbers. Terms are normalised (lower case,
+alphanumeric words) and split into padded trigrams, which are stored per
+term together with a per-trigram document frequency.
+
+A lookup only reads the postings of the query's rarest trigrams (common
+ones such as "ter" or "ion" would pull in half the catalog), then scores
+the candidate terms exactly with the Dice coefficient of the two trigram
+sets. The result is a handful of ranked Items per query text, found with
+three indexed queries per batch of recalls whatever the catalog size.
+
+Site config:
+    recall_fuzzy_min_score: lowest Dice score reported, default 0.6
+    recall_fuzzy_max_matches: Items reported per recall, default 3
+    recall_fuzzy_max_gram_df: trigrams in more terms than this are not used
+        to find candidates, default 500
+
+Rebuild from the console with:
+    bench --site <site> execute surgishop_custom.logic.fuzzy_index.rebuild
+"""
+import re
+from collections import Counter, defaultdict
+
+import frappe
+
+from surgishop_custom.logic import recall_fingerprint
+from surgishop_custom.logic.instrumentation import instrument
+from surgishop_custom.logic.tables import table_exists
+
+TERM_TABLE = "__item_fuzzy_term"
+GRAM_TABLE = "__item_fuzzy_gram"
+DF_TABLE = "__item_fuzzy_gram_df"
+BUILT_FLAG = "item_fuzzy_index_built"
+INSERT_CHUNK = 1000
+REBUILD_PAGE = 2000
+TERM_LENGTH = 255
+
+DEFAULT_MIN_SCORE = 0.6
+DEFAULT_MAX_MATCHES = 3
+DEFAULT_MAX_GRAM_DF = 500
+CANDIDATE_GRAMS = 6
+MIN_QUERY_GRAMS = 3
+
+WORD = re.compile(r"[^\W_]+")
+
+
+def ensure_index_tables():
+    """Create the index tables if they do not exist yet"""
+    frappe.db.sql_ddl(f"""
+        CREATE TABLE IF NOT EXISTS `{TERM_TABLE}` (
+            `item` VARCHAR(140) NOT NULL,
+            `term_no` SMALLINT UNSIGNED NOT NULL,
+            `source` VARCHAR(20) NOT NULL,
+            `term` VARCHAR({TERM_LENGTH}) NOT NULL,
+            PRIMARY KEY (`item`, `term_no`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    frappe.db.sql_ddl(f"""
+        CREATE TABLE IF NOT EXISTS `{GRAM_TABLE}` (
+            `gram` VARCHAR(3) NOT NULL,
+            `item` VARCHAR(140) NOT NULL,
+            `term_no` SMALLINT UNSIGNED NOT NULL,
+            PRIMARY KEY (`gram`, `item`, `term_no`),
+            KEY `item` (`item`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin
+    """)
+    frappe.db.sql_ddl(f"""
+        CREATE TABLE IF NOT EXISTS `{DF_TABLE}` (
+            `gram` VARCHAR(3) NOT NULL,
+            `df` INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (`gram`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin
+    """)
+
+
+def normalize(text):
+    """Lower-case alphanumeric words joined by single spaces"""
+    return " ".join(WORD.findall(str(text or "").lower()))[:TERM_LENGTH]
+
+
+def get_grams(text):
+    """
+    Padded trigrams of every word ('$' marks word edges, so short words
+    and word starts still produce grams and spaces never reach the index)
+    """
+    grams = set()
+    for word in normalize(text).split():
+        padded = f"$${word}$"
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+def similarity(query_grams, term_grams):
+    """Dice coefficient of two trigram sets"""
+    if not query_grams or not term_grams:
+        return 0.0
+    return 2 * len(query_grams & term_grams) / (len(query_grams) + len(term_grams))
+
+
+def is_built():
+    return bool(frappe.db.get_default(BUILT_FLAG))
+
+
+def _table_exists():
+    return table_exists(TERM_TABLE)
+
+
+# --- Maintenance ---
+
+def _item_terms(items):
+    """(item, source, term) for every indexed text of the given Items"""
+    if not items:
+        return []
+
+    terms = set()
+    for item in frappe.get_all(
+        "Item", filters={"name": ["in", items]}, fields=["name", "item_name"]
+    ):
+        terms.add((item.name, "item_code", normalize(item.name)))
+        terms.add((item.name, "item_name", normalize(item.item_name)))
+
+    for row in frappe.db.sql("""
+        SELECT parent AS item, barcode AS term
+        FROM `tabItem Barcode`
+        WHERE parenttype = 'Item' AND parent IN %(items)s
+    """, {"items": tuple(items)}, as_dict=True):
+        terms.add((row.item, "barcode", normalize(row.term)))
+
+    for row in frappe.db.sql("""
+        SELECT item_code AS item, manufacturer_part_no AS term
+        FROM `tabItem Manufacturer`
+        WHERE item_code IN %(items)s AND IFNULL(manufacturer_part_no, '') != ''
+    """, {"items": tuple(items)}, as_dict=True):
+        terms.add((row.item, "part_no", normalize(row.term)))
+
+    return sorted(term for term in terms if term[2])
+
+
+def _insert_rows(table, columns, rows):
+    for i in range(0, len(rows), INSERT_CHUNK):
+        chunk = rows[i:i + INSERT_CHUNK]
+        placeholders = ", ".join([f"({', '.join(['%s'] * len(columns))})"] * len(chunk))
+        frappe.db.sql(
+            f"INSERT IGNORE INTO `{table}` ({', '.join(f'`{column}`' for column in columns)}) VALUES {placeholders}",
+            [value for row in chunk for value in row]
+        )
+
+
+def _adjust_df(counts):
+    """Add (or with negative counts, remove) document frequencies"""
+    rows = [(gram, count) for gram, count in counts.items() if count]
+    for i in range(0, len(rows), INSERT_CHUNK):
+        chunk = rows[i:i + INSERT_CHUNK]
+        placeholders = ", ".join(["(%s, %s)"] * len(chunk))
+        frappe.db.sql(f"""
+            INSERT INTO `{DF_TABLE}` (`gram`, `df`) VALUES {placeholders}
+            ON DUPLICATE KEY UPDATE `df` = `df` + VALUES(`df`)
+        """, [value for row in chunk for value in row])
+
+
+def _insert_terms(terms, update_df=True):
+    """Insert terms (numbered per Item) and their trigrams in multi-row statements"""
+    term_rows = []
+    gram_rows = []
+    term_numbers = Counter()
+    for item, source, term in terms:
+        term_no = term_numbers[item]
+        term_numbers[item] += 1
+        term_rows.append((item, term_no, source, term))
+        gram_rows.extend((gram, item, term_no) for gram in get_grams(term))
+
+    _insert_rows(TERM_TABLE, ("item", "term_no", "source", "term"), term_rows)
+    _insert_rows(GRAM_TABLE, ("gram", "item", "term_no"), gram_rows)
+    if update_df:
+        _adjust_df(Counter(row[0] for row in gram_rows))
+
+
+def _remove(items):
+    items = tuple(items)
+    removed = frappe.db.sql(f"""
+        SELECT gram, COUNT(*) FROM `{GRAM_TABLE}` WHERE item IN %(items)s GROUP BY gram
+    """, {"items": items})
+    if not removed:
+        return
+
+    _adjust_df({gram: -count for gram, count in removed})
+    frappe.db.sql(f"DELETE FROM `{GRAM_TABLE}` WHERE item IN %(items)s", {"items": items})
+    frappe.db.sql(f"DELETE FROM `{TERM_TABLE}` WHERE item IN %(items)s", {"items": items})
+
+
+def reindex(items):
+    """Bring the terms of the given Items up to date, skipping Items whose texts did not change"""
+    items = [item for item in dict.fromkeys(items) if item]
+    if not items or not _table_exists():
+        return
+
+    current = defaultdict(set)
+    for term in _item_terms(items):
+        current[term[0]].add(term)
+
+    stored = defaultdict(set)
+    for row in frappe.db.sql(f"""
+        SELECT item, source, term FROM `{TERM_TABLE}` WHERE item IN %(items)s
+    """, {"items": tuple(items)}):
+        stored[row[0]].add(tuple(row))
+
+    changed = [item for item in items if current[item] != stored[item]]
+    if not changed:
+        return
+
+    _remove(changed)
+    _insert_terms(sorted(term for item in changed for term in current[item]))
+
+
+@instrument
+def index_item(doc, method=None):
+    """
+    Keep the index current for an Item
+    DocType Event: Item On Update
+    """
+    reindex([doc.name])
+
+
+@instrument
+def rename_item(doc, method=None, old=None, new=None, merge=False):
+    """
+    DocType Event: Item After Rename
+    """
+    if not _table_exists():
+        return
+
+    _remove([old])
+    reindex([new])
+
+
+@instrument
+def remove_item(doc, method=None):
+    """
+    DocType Event: Item On Trash
+    """
+    if _table_exists():
+        _remove([doc.name])
+
+
+@instrument
+def index_manufacturer_part(doc, method=None):
+    """
+    DocType Event: Item Manufacturer On Update / After Delete
+    """
+    reindex([doc.item_code])
+
+
+def rebuild():
+    """Rebuild the whole index from the Item catalog"""
+    ensure_index_tables()
+    frappe.db.set_default(BUILT_FLAG, 0)
+    for table in (TERM_TABLE, GRAM_TABLE, DF_TABLE):
+        frappe.db.sql_ddl(f"TRUNCATE TABLE `{table}`")
+
+    indexed = 0
+    last_name = ""
+    while True:
+        items = frappe.db.sql_list("""
+            SELECT name FROM `tabItem` WHERE name > %s ORDER BY name LIMIT %s
+        """, (last_name, REBUILD_PAGE))
+        if not items:
+            break
+
+        _insert_terms(_item_terms(items), update_df=False)
+
+        indexed += len(items)
+        last_name = items[-1]
+        frappe.db.commit()
+
+    frappe.db.sql(f"""
+        INSERT INTO `{DF_TABLE}` (`gram`, `df`)
+        SELECT gram, COUNT(*) FROM `{GRAM_TABLE}` GROUP BY gram
+    """)
+    frappe.db.set_default(BUILT_FLAG, 1)
+    frappe.db.commit()
+
+    # Recalls checked before the index existed were never fuzzy-matched
+    recall_fingerprint.bump_inventory_version()
+
+    return {"items": indexed}
+
+
+# --- Lookup ---
+
+def find_items(texts):
+    """
+    Rank Items against each query text
+
+    Args:
+        texts: dict mapping a caller key to a list of query texts
+
+    Returns:
+        dict mapping each key to a list of {item, score, term, source},
+        best first, at most recall_fuzzy_max_matches long
+    """
+    min_score = float(frappe.conf.get("recall_fuzzy_min_score") or DEFAULT_MIN_SCORE)
+    max_matches = int(frappe.conf.get("recall_fuzzy_max_matches") or DEFAULT_MAX_MATCHES)
+    max_df = int(frappe.conf.get("recall_fuzzy_max_gram_df") or DEFAULT_MAX_GRAM_DF)
+
+    queries = {
+        key: [grams for grams in (get_grams(text) for text in key_texts) if len(grams) >= MIN_QUERY_GRAMS]
+        for key, key_texts in texts.items()
+    }
+    result = {key: [] for key in texts}
+    all_grams = {gram for key_grams in queries.values() for grams in key_grams for gram in grams}
+    if not all_grams:
+        return result
+
+    # 1. Document frequencies of every query gram, in one query
+    df = dict(frappe.db.sql(f"""
+        SELECT gram, df FROM `{DF_TABLE}` WHERE gram IN %(grams)s
+    """, {"grams": tuple(all_grams)}))
+
+    # 2. Each query is looked up by its rarest grams only
+    lookup = {}
+    for key, key_grams in queries.items():
+        lookup[key] = []
+        for grams in key_grams:
+            known = sorted((gram for gram in grams if 0 < df.get(gram, 0) <= max_df), key=lambda gram: df[gram])
+            lookup[key].append((grams, set(known[:CANDIDATE_GRAMS])))
+
+    lookup_grams = {gram for key_lookups in lookup.values() for _grams, rare in key_lookups for gram in rare}
+    if not lookup_grams:
+        return result
+
+    postings = defaultdict(set)
+    for gram, item, term_no in frappe.db.sql(f"""
+        SELECT gram, item, term_no FROM `{GRAM_TABLE}` WHERE gram IN %(grams)s
+    """, {"grams": tuple(lookup_grams)}):
+        postings[gram].add((item, term_no))
+
+    # 3. Candidate terms, scored exactly on their full trigram sets
+    candidates = {}
+    for key, key_lookups in lookup.items():
+        candidates[key] = [
+            (grams, set().union(*(postings[gram] for gram in rare))) for grams, rare in key_lookups if rare
+        ]
+
+    candidate_items = {
+        item for key_candidates in candidates.values() for _grams, term_keys in key_candidates for item, _term_no in term_keys
+    }
+    if not candidate_items:
+        return result
+
+    terms = {
+        (row.item, row.term_no): row
+        for row in frappe.db.sql(f"""
+            SELECT item, term_no, source, term FROM `{TERM_TABLE}` WHERE item IN %(items)s
+        """, {"items": tuple(candidate_items)}, as_dict=True)
+    }
+    term_grams = {}
+
+    for key, key_candidates in candidates.items():
+        best = {}
+        for grams, term_keys in key_candidates:
+            for term_key in term_keys:
+                term = terms.get(term_key)
+                if not term:
+                    continue
+                if term_key not in term_grams:
+                    term_grams[term_key] = get_grams(term.term)
+                score = similarity(grams, term_grams[term_key])
+                if score >= min_score and score > best.get(term.item, {}).get("score", 0):
+                    best[term.item] = {
+                        "item": term.item, "score": round(score, 3), "term": term.term, "source": term.source
+                    }
+
+        result[key] = sorted(best.values(), key=lambda match: (-match["score"], match["item"]))[:max_matches]
+
+    return result
@@ -0,0 +1,154 @@
+"""
+GS1 UDI parser for openFDA code_info text
+
+Understands the Application Identifiers used on device labels:
+    (01) GTIN, (10) lot, (11) production date, (17) expiry, (21) serial
+
+Element strings are read both in human readable form "(01)...(17)..." and
+run together "0100884838087452172512311012345". A bare GTIN is accepted
+only on UDI/GTIN lines and only with a valid check digit, so phone,
+510(k) and catalog numbers are not reported as identifiers.
+"""
+import re
+
+FIXED_LENGTH_AIS = {"01": 14, "11": 6, "17": 6}
+VARIABLE_LENGTH_AIS = {"10": 20, "21": 20}
+
+# The value runs to the next bracketed AI or the end of the field, so a
+# lot or serial may contain spaces: "(10)LOT 123, (21)..."
+BRACKETED_AI = re.compile(r"\(\s*(01|10|11|17|21)\s*\)[\s:]*([^(),;\n]*)")
+# A run-together element string starting with (01), whose elements may be
+# separated by spaces, or a bare GTIN-12/13/14
+UNBRACKETED_UDI = re.compile(
+    r"(?<![0-9A-Z])(?:(01[0-9]{14}[0-9A-Z\-./]*(?:[ \t]+(?:1[017]|21)[0-9A-Z\-./]+)*)|([0-9]{12,14}))(?![0-9A-Z])"
+)
+SEPARATOR = re.compile(r"\s")
+ALL_DIGITS = re.compile(r"^[0-9]+$")
+
+
+def is_valid_gtin(digits):
+    """Check a GTIN-8/12/13/14 against its GS1 mod-10 check digit"""
+    if not digits or not ALL_DIGITS.match(digits) or len(digits) not in (8, 12, 13, 14):
+        return False
+
+    # Weights 3, 1, 3, ... run leftwards from the digit before the check digit
+    total = 3 * sum(map(int, digits[-2::-2])) + sum(map(int, digits[-3::-2]))
+    return (10 - total % 10) % 10 == int(digits[-1])
+
+
+def normalize_gtin(value):
+    """Return the GTIN-14 form of a valid GTIN, or None"""
+    value = str(value or "").strip()
+    if not is_valid_gtin(value):
+        return None
+    return value.zfill(14)
+
+
+def unpadded_gtin(gtin):
+    """
+    The shortest GTIN-12/13/14 form of a GTIN-14
+
+    Labels and batch IDs print GTIN-12 and GTIN-13 without the padding
+    zeros, and every padded form contains this one.
+    """
+    if len(gtin or "") != 14 or not ALL_DIGITS.match(gtin):
+        return gtin
+    return gtin.lstrip("0").zfill(12)
+
+
+def _expiry(value):
+    """YYMMDD to ISO date; DD 00 means end of month and is kept as 00"""
+    if len(value) != 6 or not value.isdigit():
+        return None
+    return f"20{value[0:2]}-{value[2:4]}-{value[4:6]}"
+
+
+def _empty_result():
+    return {"gtins": [], "lots": [], "serials": [], "expiry_dates": []}
+
+
+def _add(result, key, value):
+    if value and value not in result[key]:
+        result[key].append(value)
+
+
+def _add_ai(result, ai, value):
+    if ai == "01":
+        _add(result, "gtins", normalize_gtin(value))
+    elif ai == "10":
+        _add(result, "lots", value)
+    elif ai == "17":
+        _add(result, "expiry_dates", _expiry(value))
+    elif ai == "21":
+        _add(result, "serials", value)
+
+
+def _parse_element_string(result, text):
+    """Walk a run-together element string AI by AI; whitespace stands in for FNC1"""
+    position = 0
+    while position < len(text):
+        if text[position].isspace():
+            position += 1
+            continue
+
+        ai = text[position:position + 2]
+        position += 2
+
+        if ai in FIXED_LENGTH_AIS:
+            value = text[position:position + FIXED_LENGTH_AIS[ai]]
+            if len(value) != FIXED_LENGTH_AIS[ai] or not value.isdigit():
+                return
+            position += len(value)
+        elif ai in VARIABLE_LENGTH_AIS:
+            # A variable field runs to the next separator or the end
+            separator = SEPARATOR.search(text, position)
+            end = separator.start() if separator else len(text)
+            value = text[position:end][:VARIABLE_LENGTH_AIS[ai]]
+            position = end
+        else:
+            return
+
+        _add_ai(result, ai, value)
+
+
+def parse_code_info(code_info):
+    """
+    Parse UDI data out of an openFDA code_info blob
+
+    Returns:
+        dict with lists of gtins (GTIN-14), lots, serials and expiry_dates
+    """
+    result = _empty_result()
+    if not code_info:
+        return result
+
+    text = str(code_info).upper()
+
+    if "(" in text:
+        for ai, value in BRACKETED_AI.findall(text):
+            value = value.strip()
+            if ai in FIXED_LENGTH_AIS:
+                # "(01)0088483808745217251231" keeps going without brackets
+                _parse_element_string(result, ai + value.split(" ")[0])
+            else:
+                _add_ai(result, ai, value[:VARIABLE_LENGTH_AIS[ai]].strip())
+
+    for line in text.split("\n"):
+        if "UDI" not in line and "GTIN" not in line:
+            continue
+
+        if "(" in line:
+            line = BRACKETED_AI.sub(" ", line)
+
+        for element_string, digits in UNBRACKETED_UDI.findall(line):
+            if element_string:
+                _parse_element_string(result, element_string)
+            else:
+                _add(result, "gtins", normalize_gtin(digits))
+
+    return result
+
+
+def parse_code_infos(code_infos):
+    """Parse many code_info blobs in one call, results in input order"""
+    return [parse_code_info(code_info) for code_info in code_infos]
@@ -0,0 +1,260 @@
+"""
+Per-handler latency and query instrumentation
+
+Doc event handlers and whitelisted methods are wrapped with @instrument.
+A sampled invocation records wall time, DB query count and time, and
+Redis calls into a per-handler ring buffer in the cache (one pipelined
+round trip). get_hook_metrics aggregates the buffers into percentiles;
+metrics serves them in the Prometheus text format and the Hook Metrics
+desk page shows them.
+
+Site config:
+    hook_metrics_sample_rate: share of invocations recorded, default 1
+    hook_metrics_slow_ms: invocations slower than this are logged, default 1000
+    hook_metrics_buffer: samples kept per handler, default 1000
+"""
+import functools
+import json
+import random
+import time
+
+import frappe
+
+METRICS_KEY = "surgishop_custom:hook_metrics"
+HANDLERS_KEY = "surgishop_custom:hook_metrics:handlers"
+DEFAULT_BUFFER = 1000
+DEFAULT_SLOW_MS = 1000
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def _stack():
+    if getattr(frappe.local, "hook_metrics_stack", None) is None:
+        frappe.local.hook_metrics_stack = []
+    return frappe.local.hook_metrics_stack
+
+
+def _count_redis_calls():
+    """Count Redis commands of the instrumented call on this thread (installed once per process)"""
+    cache = frappe.cache
+    execute_command = getattr(cache, "execute_command", None)
+    if not execute_command or getattr(cache, "_hook_metrics_wrapped", False):
+        return
+
+    def counted_execute_command(*args, **options):
+        stack = getattr(frappe.local, "hook_metrics_stack", None)
+        if stack and not frappe.local.hook_metrics_paused:
+            for frame in stack:
+                frame["redis_calls"] += 1
+        return execute_command(*args, **options)
+
+    cache.execute_command = counted_execute_command
+    cache._hook_metrics_wrapped = True
+
+
+def _patch_db(stack):
+    """Time this request's queries while the outermost instrumented call runs"""
+    db = frappe.db
+    sql = db.sql
+
+    def timed_sql(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return sql(*args, **kwargs)
+        finally:
+            if not frappe.local.hook_metrics_paused:
+                seconds = time.perf_counter() - started
+                for frame in stack:
+                    frame["queries"] += 1
+                    frame["db_seconds"] += seconds
+
+    db.sql = timed_sql
+    return lambda: db.__dict__.pop("sql", None)
+
+
+def instrument(fn):
+    """Record the cost of every (sampled) call of a doc event handler or API method"""
+    handler = f"{fn.__module__}.{fn.__qualname__}".replace("surgishop_custom.", "", 1)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        sample_rate = frappe.conf.get("hook_metrics_sample_rate")
+        if not frappe.db or random.random() >= (1 if sample_rate is None else float(sample_rate)):
+            return fn(*args, **kwargs)
+
+        # Doc events are called as (doc, method, ...)
+        event = args[1] if len(args) > 1 and isinstance(args[1], str) else None
+        doctype = getattr(args[0], "doctype", None) if event else None
+
+        stack = _stack()
+        restore_db = None
+        if not stack:
+            _count_redis_calls()
+            restore_db = _patch_db(stack)
+            frappe.local.hook_metrics_paused = False
+
+        frame = {"queries": 0, "db_seconds": 0.0, "redis_calls": 0}
+        stack.append(frame)
+        error = 0
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            error = 1
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            stack.pop()
+            if restore_db:
+                restore_db()
+
+            frappe.local.hook_metrics_paused = True
+            try:
+                record(handler, doctype, event, seconds, frame, error)
+            except Exception:
+                # Metrics must never break the document being saved
+                pass
+            finally:
+                frappe.local.hook_metrics_paused = False
+
+    return wrapper
+
+
+def _series(handler, doctype, event):
+    return "|".join([handler, doctype or "", event or ""])
+
+
+def record(handler, doctype, event, seconds, frame, error=0):
+    """Push one sample into the handler's ring buffer"""
+    series = _series(handler, doctype, event)
+    size = int(frappe.conf.get("hook_metrics_buffer") or DEFAULT_BUFFER)
+    sample = json.dumps([
+        round(time.time()),
+        round(seconds * 1000, 2),
+        frame["queries"],
+        round(frame["db_seconds"] * 1000, 2),
+        frame["redis_calls"],
+        error,
+    ])
+
+    key = frappe.cache.make_key(f"{METRICS_KEY}:{series}")
+    pipeline = frappe.cache.pipeline()
+    pipeline.lpush(key, sample)
+    pipeline.ltrim(key, 0, size - 1)
+    pipeline.sadd(frappe.cache.make_key(HANDLERS_KEY), series)
+    pipeline.execute()
+
+    slow_ms = float(frappe.conf.get("hook_metrics_slow_ms") or DEFAULT_SLOW_MS)
+    if seconds * 1000 >= slow_ms:
+        frappe.logger("surgishop_custom.hook_metrics").warning({
+            "event": "slow_hook",
+            "handler": handler,
+            "doctype": doctype,
+            "doc_event": event,
+            "ms": round(seconds * 1000, 2),
+            "queries": frame["queries"],
+            "db_ms": round(frame["db_seconds"] * 1000, 2),
+            "redis_calls": frame["redis_calls"],
+        })
+
+
+def _quantile(ordered, q):
+    if not ordered:
+        return None
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def aggregate():
+    """Percentiles and averages per handler over the samples in the ring buffers"""
+    series_names = sorted(
+        name.decode() if isinstance(name, bytes) else name
+        for name in frappe.cache.smembers(HANDLERS_KEY)
+    )
+
+    pipeline = frappe.cache.pipeline()
+    for series in series_names:
+        pipeline.lrange(frappe.cache.make_key(f"{METRICS_KEY}:{series}"), 0, -1)
+    buffers = pipeline.execute() if series_names else []
+
+    metrics = []
+    for series, raw_samples in zip(series_names, buffers):
+        samples = [json.loads(sample) for sample in raw_samples]
+        if not samples:
+            continue
+
+        handler, doctype, event = series.split("|")
+        durations = sorted(sample[1] for sample in samples)
+        count = len(samples)
+        metrics.append({
+            "handler": handler,
+            "doctype": doctype or None,
+            "event": event or None,
+            "samples": count,
+            "errors": sum(sample[5] for sample in samples),
+            "p50_ms": _quantile(durations, 0.5),
+            "p90_ms": _quantile(durations, 0.9),
+            "p99_ms": _quantile(durations, 0.99),
+            "max_ms": durations[-1],
+            "total_ms": round(sum(durations), 2),
+            "avg_queries": round(sum(sample[2] for sample in samples) / count, 1),
+            "avg_db_ms": round(sum(sample[3] for sample in samples) / count, 2),
+            "avg_redis_calls": round(sum(sample[4] for sample in samples) / count, 1),
+            "last_seen": max(sample[0] for sample in samples),
+        })
+
+    return sorted(metrics, key=lambda metric: -metric["total_ms"])
+
+
+@frappe.whitelist()
+def get_hook_metrics():
+    """Aggregated handler metrics for the Hook Metrics page"""
+    frappe.only_for("System Manager")
+    return aggregate()
+
+
+@frappe.whitelist()
+def reset_hook_metrics():
+    """Empty every ring buffer"""
+    frappe.only_for("System Manager")
+    for series in frappe.cache.smembers(HANDLERS_KEY):
+        series = series.decode() if isinstance(series, bytes) else series
+        frappe.cache.delete_value(f"{METRICS_KEY}:{series}")
+    frappe.cache.delete_value(HANDLERS_KEY)
+
+
+def _labels(metric, **extra):
+    labels = {"handler": metric["handler"], "doctype": metric["doctype"] or "", "event": metric["event"] or "", **extra}
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+@frappe.whitelist()
+def metrics():
+    """Prometheus text exposition of the handler metrics"""
+    from werkzeug.wrappers import Response
+
+    frappe.only_for("System Manager")
+
+    lines = [
+        "# HELP surgishop_hook_duration_seconds Handler wall time over the sampled window",
+        "# TYPE surgishop_hook_duration_seconds summary",
+    ]
+    collected = aggregate()
+    for metric in collected:
+        for q in QUANTILES:
+            value = metric[f"p{int(q * 100)}_ms"]
+            lines.append(f"surgishop_hook_duration_seconds{{{_labels(metric, quantile=q)}}} {value / 1000:.6f}")
+        lines.append(f"surgishop_hook_duration_seconds_sum{{{_labels(metric)}}} {metric['total_ms'] / 1000:.6f}")
+        lines.append(f"surgishop_hook_duration_seconds_count{{{_labels(metric)}}} {metric['samples']}")
+
+    for name, field, help_text in (
+        ("surgishop_hook_db_queries", "avg_queries", "Average DB queries per call"),
+        ("surgishop_hook_db_seconds", "avg_db_ms", "Average DB time per call"),
+        ("surgishop_hook_redis_calls", "avg_redis_calls", "Average Redis commands per call"),
+        ("surgishop_hook_errors", "errors", "Failed calls in the sampled window"),
+    ):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for metric in collected:
+            value = metric[field] / 1000 if field == "avg_db_ms" else metric[field]
+            lines.append(f"{name}{{{_labels(metric)}}} {value}")
+
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,216 @@
+"""
+Rendered PDF cache
+
+Print formats are rendered once per document version and kept on disk in
+the site's private folder. The cache key includes the document's
+`modified` timestamp, the print format and the letterhead (defaults
+resolved, and when each was last changed), so an edit always produces a
+fresh render. Each document has its own subfolder, dropped on update,
+cancel and delete.
+
+download_pdf replaces frappe.utils.print_format.download_pdf, so manual
+reprints of the cached doctypes are served from the same files.
+
+The folder is bounded by size; the least recently used files go first.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+import frappe
+
+from surgishop_custom.logic.instrumentation import instrument
+
+CACHE_FOLDER = "pdf_cache"
+CACHED_DOCTYPES = ("Sales Invoice", "Delivery Note", "Packing Slip")
+DEFAULT_MAX_MB = 512
+HITS_KEY = "surgishop_custom:pdf_cache:hits"
+MISSES_KEY = "surgishop_custom:pdf_cache:misses"
+
+
+def _cache_dir():
+    path = frappe.get_site_path("private", CACHE_FOLDER)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _doc_dir(doctype, name):
+    return os.path.join(_cache_dir(), hashlib.sha1(f"{doctype}\0{name}".encode("utf-8")).hexdigest())
+
+
+def _cache_path(doctype, name, modified, print_format, letterhead):
+    # None means the doctype's default format and the default letterhead, which can change
+    print_format = print_format or frappe.get_meta(doctype).default_print_format or "Standard"
+    format_modified = frappe.db.get_value("Print Format", print_format, "modified")
+    letterhead_filters = letterhead or {"is_default": 1}
+    letterhead_version = frappe.db.get_value("Letter Head", letterhead_filters, ["name", "modified"])
+    version = hashlib.sha1(
+        f"{modified}\0{print_format}\0{format_modified}\0{letterhead_version}".encode("utf-8")
+    ).hexdigest()
+    return os.path.join(_doc_dir(doctype, name), f"{version}.pdf")
+
+
+def _write(path, pdf):
+    """Store a render; a concurrent invalidate may remove the folder, then it is simply not cached"""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file first so readers never see a partial PDF
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(pdf)
+        os.replace(tmp_path, path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def _cached_files():
+    """Every cached PDF, one folder level down (and any left in the root)"""
+    with os.scandir(_cache_dir()) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                with os.scandir(entry.path) as doc_entries:
+                    yield from (doc_entry for doc_entry in doc_entries if doc_entry.name.endswith(".pdf"))
+            elif entry.name.endswith(".pdf"):
+                yield entry
+
+
+def _count(key):
+    frappe.cache.incr(frappe.cache.make_key(key))
+
+
+def get_pdf(doctype, name, print_format=None, letterhead=None, doc=None):
+    """
+    Return the PDF bytes of a document, rendering only on a cache miss
+
+    Args:
+        doc: the loaded document, if the caller already has it
+    """
+    modified = doc.modified if doc else frappe.db.get_value(doctype, name, "modified")
+    path = _cache_path(doctype, name, modified, print_format, letterhead)
+
+    try:
+        with open(path, "rb") as f:
+            pdf = f.read()
+    except FileNotFoundError:
+        pdf = None
+
+    if pdf is not None:
+        # Touch for LRU eviction; the file may already be invalidated
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        _count(HITS_KEY)
+        return pdf
+
+    _count(MISSES_KEY)
+    pdf = frappe.get_print(
+        doctype,
+        name,
+        print_format=print_format,
+        doc=doc,
+        as_pdf=True,
+        letterhead=letterhead
+    )
+
+    if _write(path, pdf):
+        evict()
+    return pdf
+
+
+def evict(max_bytes=None):
+    """Delete least recently used files until the cache fits its size limit"""
+    max_bytes = max_bytes or (frappe.conf.get("pdf_cache_max_mb") or DEFAULT_MAX_MB) * 1024 * 1024
+
+    files = []
+    total = 0
+    for entry in _cached_files():
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+        total += stat.st_size
+
+    if total <= max_bytes:
+        return
+
+    # Trim to 90% so every miss does not trigger another eviction pass
+    for _mtime, size, path in sorted(files):
+        if total <= max_bytes * 0.9:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+@instrument
+def invalidate(doc, method=None):
+    """
+    Drop every cached PDF of a document
+    DocType Event: On Update / On Update After Submit / On Cancel / On Trash
+    """
+    shutil.rmtree(_doc_dir(doc.doctype, doc.name), ignore_errors=True)
+
+
+def prerender(doctype, name, print_format=None, letterhead=None):
+    """Background job: render a PDF ahead of time so the later send is a cache hit"""
+    get_pdf(doctype, name, print_format=print_format, letterhead=letterhead)
+
+
+@frappe.whitelist(allow_guest=True)
+@instrument
+def download_pdf(doctype, name, format=None, doc=None, no_letterhead=0, language=None, letterhead=None, **kwargs):
+    """
+    Cached replacement for frappe.utils.print_format.download_pdf
+    Override: override_whitelisted_methods
+
+    Guests (shared links), other doctypes and renders of an unsaved doc,
+    without letterhead or in another language go to the original.
+    """
+    if (
+        doctype not in CACHED_DOCTYPES
+        or doc
+        or int(no_letterhead or 0)
+        or language
+        or frappe.session.user == "Guest"
+    ):
+        from frappe.utils.print_format import download_pdf as render_pdf
+        return render_pdf(
+            doctype, name, format=format, doc=doc, no_letterhead=no_letterhead,
+            language=language, letterhead=letterhead, **kwargs
+        )
+
+    frappe.has_permission(doctype, "print", name, throw=True)
+
+    frappe.local.response.filename = f"{name.replace(' ', '-').replace('/', '-')}.pdf"
+    frappe.local.response.filecontent = get_pdf(doctype, name, print_format=format, letterhead=letterhead)
+    frappe.local.response.type = "pdf"
+
+
+@frappe.whitelist()
+@instrument
+def get_stats():
+    """Cache hit/miss counters and current size"""
+    frappe.only_for("System Manager")
+
+    hits = int(frappe.cache.get(frappe.cache.make_key(HITS_KEY)) or 0)
+    misses = int(frappe.cache.get(frappe.cache.make_key(MISSES_KEY)) or 0)
+
+    files = 0
+    size = 0
+    for entry in _cached_files():
+        files += 1
+        size += entry.stat().st_size
+
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+        "files": files,
+        "size_mb": round(size / 1024 / 1024, 1),
+    }
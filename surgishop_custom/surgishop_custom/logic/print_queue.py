@@ -0,0 +1,315 @@
+"""
+Print job queue for the warehouse printers
+
+Documents are queued for printing instead of calling the print webhook
+inside the submit. A worker drains the queue per printer: jobs queued in a
+burst (a pick wave of Delivery Notes) go out as one batched request over a
+pooled keep-alive HTTP connection. Failed jobs are retried with backoff
+and parked as Dead after MAX_ATTEMPTS.
+
+Batching and the pooled connection need print_webhook_url. Without it
+each job is still printed through the surgi_print_dn app, one call per
+job: that app only prints single documents and makes its own request.
+The queue still takes the print off the submit and adds retries.
+
+Site config:
+    print_webhook_url: batch endpoint; without it each job is printed
+        through the surgi_print_dn app as before
+    print_routes: {doctype: printer} overrides of PRINT_ROUTES
+    printer_concurrency: {printer: batches in flight}, default 1
+"""
+import frappe
+from frappe.utils import add_to_date, cint, now, now_datetime
+
+from surgishop_custom.logic import app_log
+from surgishop_custom.logic.instrumentation import instrument
+
+PRINT_JOB_TABLE = "__print_job"
+DEFAULT_PRINTER = "Brother_HL-L3210CW_series"
+PRINT_ROUTES = {
+    "Delivery Note": DEFAULT_PRINTER,
+    "Packing Slip": DEFAULT_PRINTER,
+}
+# surgi_print_dn methods used when no batch webhook is configured
+WEBHOOK_METHODS = {
+    "Delivery Note": "surgi_print_dn.api.print_delivery_note_via_webhook",
+    "Packing Slip": "surgi_print_dn.api.print_packing_slip_via_webhook",
+}
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 5
+RETRY_BASE_MINUTES = 1
+STALE_PRINTING_MINUTES = 10
+WEBHOOK_TIMEOUT = 30
+
+_session = None
+
+
+def ensure_print_job_table():
+    """Create the print job table if it does not exist yet"""
+    frappe.db.sql_ddl(f"""
+        CREATE TABLE IF NOT EXISTS `{PRINT_JOB_TABLE}` (
+            `id` BIGINT NOT NULL AUTO_INCREMENT,
+            `reference_doctype` VARCHAR(140) NOT NULL,
+            `reference_name` VARCHAR(140) NOT NULL,
+            `print_format` VARCHAR(140) NULL,
+            `printer` VARCHAR(140) NOT NULL,
+            `status` VARCHAR(20) NOT NULL,
+            `attempts` INT NOT NULL DEFAULT 0,
+            `next_attempt_at` DATETIME(6) NULL,
+            `batch_id` VARCHAR(20) NULL,
+            `last_error` TEXT NULL,
+            `creation` DATETIME(6) NOT NULL,
+            `modified` DATETIME(6) NOT NULL,
+            PRIMARY KEY (`id`),
+            KEY `status_printer` (`status`, `printer`, `next_attempt_at`),
+            KEY `reference` (`reference_doctype`, `reference_name`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+
+def get_printer(doctype):
+    routes = {**PRINT_ROUTES, **(frappe.conf.get("print_routes") or {})}
+    return routes.get(doctype) or DEFAULT_PRINTER
+
+
+def queue_print(doctype, name, print_format=None, printer=None):
+    """
+    Queue a document for printing
+
+    A document that is already waiting to print (Queued or Retrying) is
+    not queued again; once printed it can be queued for a reprint.
+
+    Returns:
+        the print job id
+    """
+    existing = frappe.db.sql(f"""
+        SELECT id FROM `{PRINT_JOB_TABLE}`
+        WHERE reference_doctype = %s AND reference_name = %s AND status IN ('Queued', 'Retrying')
+        LIMIT 1
+    """, (doctype, name))
+    if existing:
+        return existing[0][0]
+
+    timestamp = now()
+    frappe.db.sql(f"""
+        INSERT INTO `{PRINT_JOB_TABLE}`
+            (`reference_doctype`, `reference_name`, `print_format`, `printer`, `status`, `creation`, `modified`)
+        VALUES (%s, %s, %s, %s, 'Queued', %s, %s)
+    """, (doctype, name, print_format, printer or get_printer(doctype), timestamp, timestamp))
+    job_id = frappe.db.sql("SELECT LAST_INSERT_ID()")[0][0]
+
+    _wake_worker()
+    return job_id
+
+
+def _wake_worker():
+    frappe.enqueue(
+        "surgishop_custom.logic.print_queue.process_print_queue",
+        queue="short",
+        enqueue_after_commit=True,
+        job_id="print_queue_worker",
+        deduplicate=True
+    )
+
+
+def _get_session():
+    """One keep-alive connection pool per worker process"""
+    global _session
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        _session = requests.Session()
+        _session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        _session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    return _session
+
+
+def process_print_queue():
+    """
+    Scheduler Event: every minute (also woken by queue_print)
+    Drain queued print jobs printer by printer in batches
+    """
+    _release_stale_jobs()
+
+    while True:
+        printers = frappe.db.sql_list(f"""
+            SELECT DISTINCT printer
+            FROM `{PRINT_JOB_TABLE}`
+            WHERE status IN ('Queued', 'Retrying')
+            AND (next_attempt_at IS NULL OR next_attempt_at <= %s)
+        """, (now(),))
+
+        printed_any = False
+        for printer in printers:
+            batch = _claim_batch(printer)
+            if batch:
+                _print_batch(printer, batch)
+                printed_any = True
+
+        if not printed_any:
+            break
+
+
+def _release_stale_jobs():
+    """Jobs stuck in Printing (worker died mid-batch) go back to Retrying"""
+    frappe.db.sql(f"""
+        UPDATE `{PRINT_JOB_TABLE}`
+        SET status = 'Retrying', next_attempt_at = NULL, modified = %s
+        WHERE status = 'Printing' AND modified < %s
+    """, (now(), add_to_date(now_datetime(), minutes=-STALE_PRINTING_MINUTES)))
+    frappe.db.commit()
+
+
+def _claim_batch(printer):
+    """Claim up to BATCH_SIZE due jobs for a printer, respecting its concurrency limit"""
+    limit = cint((frappe.conf.get("printer_concurrency") or {}).get(printer)) or 1
+    in_flight = frappe.db.sql(f"""
+        SELECT COUNT(DISTINCT batch_id) FROM `{PRINT_JOB_TABLE}`
+        WHERE printer = %s AND status = 'Printing'
+    """, (printer,))[0][0]
+    if in_flight >= limit:
+        return []
+
+    jobs = frappe.db.sql(f"""
+        SELECT id, reference_doctype, reference_name, print_format, attempts
+        FROM `{PRINT_JOB_TABLE}`
+        WHERE printer = %s
+        AND status IN ('Queued', 'Retrying')
+        AND (next_attempt_at IS NULL OR next_attempt_at <= %s)
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    """, (printer, now(), BATCH_SIZE), as_dict=True)
+
+    if jobs:
+        batch_id = frappe.generate_hash(length=10)
+        frappe.db.sql(f"""
+            UPDATE `{PRINT_JOB_TABLE}`
+            SET status = 'Printing', batch_id = %(batch_id)s, modified = %(now)s
+            WHERE id IN %(ids)s
+        """, {"batch_id": batch_id, "now": now(), "ids": tuple(job.id for job in jobs)})
+    frappe.db.commit()
+
+    return jobs
+
+
+def _print_batch(printer, jobs):
+    """Submit one batch and record the outcome of every job in it"""
+    failed = {}
+    url = frappe.conf.get("print_webhook_url")
+
+    if url:
+        try:
+            response = _get_session().post(url, json={
+                "printer": printer,
+                "jobs": [
+                    {
+                        "id": job.id,
+                        "doctype": job.reference_doctype,
+                        "name": job.reference_name,
+                        "print_format": job.print_format,
+                    }
+                    for job in jobs
+                ],
+            }, timeout=WEBHOOK_TIMEOUT)
+            response.raise_for_status()
+            # The webhook may report individual jobs it could not print
+            body = response.json() if response.content else {}
+            for failure in body.get("failed") or []:
+                failed[cint(failure.get("id"))] = failure.get("error") or "Printer rejected the job"
+        except Exception as print_err:
+            failed = {job.id: str(print_err) for job in jobs}
+    else:
+        for job in jobs:
+            try:
+                kwargs = {"doc_name": job.reference_name, "printer_name": printer}
+                if job.print_format:
+                    kwargs["print_format"] = job.print_format
+                frappe.call(WEBHOOK_METHODS[job.reference_doctype], **kwargs)
+            except Exception as print_err:
+                failed[job.id] = str(print_err)
+
+    printed = [job.id for job in jobs if job.id not in failed]
+    if printed:
+        frappe.db.sql(f"""
+            UPDATE `{PRINT_JOB_TABLE}`
+            SET status = 'Printed', last_error = NULL, modified = %(now)s
+            WHERE id IN %(ids)s
+        """, {"now": now(), "ids": tuple(printed)})
+
+    for job in jobs:
+        if job.id not in failed:
+            continue
+
+        attempts = job.attempts + 1
+        if attempts >= MAX_ATTEMPTS:
+            status, next_attempt_at = "Dead", None
+            app_log.error(
+                "print_job_dead", ref=job.reference_name, exc=False, title="Print job failed",
+                error=failed[job.id], job_id=job.id, reference_doctype=job.reference_doctype, printer=printer
+            )
+        else:
+            status = "Retrying"
+            next_attempt_at = add_to_date(now_datetime(), minutes=RETRY_BASE_MINUTES * 2 ** (attempts - 1))
+
+        frappe.db.sql(f"""
+            UPDATE `{PRINT_JOB_TABLE}`
+            SET status = %s, attempts = %s, next_attempt_at = %s, last_error = %s, modified = %s
+            WHERE id = %s
+        """, (status, attempts, next_attempt_at, failed[job.id], now(), job.id))
+
+    frappe.db.commit()
+
+
+@frappe.whitelist()
+@instrument
+def get_print_queue_stats():
+    """Jobs per printer and status, plus the last hour's throughput"""
+    frappe.only_for(["System Manager", "Stock Manager"])
+
+    by_status = frappe.db.sql(f"""
+        SELECT printer, status, COUNT(*) AS jobs
+        FROM `{PRINT_JOB_TABLE}`
+        GROUP BY printer, status
+    """, as_dict=True)
+
+    printed_last_hour = frappe.db.sql(f"""
+        SELECT printer, COUNT(*) AS jobs
+        FROM `{PRINT_JOB_TABLE}`
+        WHERE status = 'Printed' AND modified >= %s
+        GROUP BY printer
+    """, (add_to_date(now_datetime(), hours=-1),), as_dict=True)
+
+    dead = frappe.db.sql(f"""
+        SELECT id, reference_doctype, reference_name, printer, attempts, last_error, modified
+        FROM `{PRINT_JOB_TABLE}`
+        WHERE status = 'Dead'
+        ORDER BY modified DESC
+        LIMIT 100
+    """, as_dict=True)
+
+    return {"by_status": by_status, "printed_last_hour": printed_last_hour, "dead": dead}
+
+
+@frappe.whitelist()
+@instrument
+def requeue_dead_jobs(job_ids=None):
+    """Give Dead print jobs (all, or the given ids) a fresh set of attempts"""
+    frappe.only_for(["System Manager", "Stock Manager"])
+
+    conditions = ""
+    values = {"now": now()}
+    if job_ids not in (None, ""):
+        job_ids = frappe.parse_json(job_ids) if isinstance(job_ids, str) else job_ids
+        if not job_ids:
+            return
+        conditions = "AND id IN %(ids)s"
+        values["ids"] = tuple(cint(job_id) for job_id in job_ids)
+
+    frappe.db.sql(f"""
+        UPDATE `{PRINT_JOB_TABLE}`
+        SET status = 'Queued', attempts = 0, next_attempt_at = NULL, modified = %(now)s
+        WHERE status = 'Dead' {conditions}
+    """, values)
+    _wake_worker()
@@ -1,15 +1,40 @@
 """
 Purchase Receipt Server Scripts
 """
+import csv
+import io
+
 import frappe
-from frappe.utils import flt
+from frappe.utils import cstr, flt, today
+
+from surgishop_custom.logic.instrumentation import instrument
+
+BULK_COLUMNS = ("item_code", "batch_no", "accepted_qty", "blemish_qty", "rejected_qty", "warehouse")
+BULK_ITEM_CHUNK = 500
+MAX_REPORTED_ERRORS = 100
 
 
+@instrument
 def allow_blemish(doc, method=None):
     """
     Purchase Receipt allow blemish in received qty
     DocType Event: Before Validate
+
+    qty is entered as the ordered (good) quantity and expanded to include
+    blemish and rejected quantities. A row whose qty is unchanged since it
+    was last expanded (earlier in this save, or in the saved document) has
+    its base recovered from those values instead of adding blemish and
+    rejected a second time.
     """
+    previous = doc.get_doc_before_save()
+    expanded = {
+        item.name: (flt(item.qty), flt(item.get("custom_blemish_quantity")), flt(item.get("rejected_qty")))
+        for item in (previous.items if previous else [])
+        if item.name
+    }
+    # Rows expanded by an earlier validate of this same save
+    expanded.update(doc.flags.blemish_expanded or {})
+
     total_blemish = 0.0
     total_rejected = 0.0
     total_received = 0.0
@@ -19,6 +44,10 @@ def allow_blemish(doc, method=None):
         blemish = flt(item.get("custom_blemish_quantity") or 0)
         rejected = flt(item.get("rejected_qty") or 0)
 
+        last = expanded.get(item.name)
+        if last and last[0] == qty_ordered:
+            qty_ordered = last[0] - last[1] - last[2]
+
         accepted = qty_ordered + blemish
         received = accepted + rejected
 
@@ -33,3 +62,157 @@ def allow_blemish(doc, method=None):
     doc.custom_total_blemish_quantity = total_blemish
     doc.custom_total_rejected_quantity = total_rejected
     doc.custom_total_received = total_received
+
+    doc.flags.blemish_expanded = {
+        item.name: (flt(item.qty), flt(item.get("custom_blemish_quantity")), flt(item.get("rejected_qty")))
+        for item in doc.items
+        if item.name
+    }
+
+
+def _open_lines(file_url=None):
+    """Text stream over the uploaded CSV (request file, or an existing File)"""
+    if file_url:
+        file_doc = frappe.get_doc("File", {"file_url": file_url})
+        # Private files of other documents must not be readable through here
+        file_doc.check_permission("read")
+        return open(file_doc.get_full_path(), newline="", encoding="utf-8-sig")
+
+    upload = frappe.request and frappe.request.files.get("file")
+    if not upload:
+        frappe.throw("Attach the ASN/CSV as 'file' or pass a file_url.")
+    return io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline="")
+
+
+def _check_items(pending, known_items, errors):
+    """Validate a chunk of lines against Item in one query"""
+    unknown = {line["item_code"] for line in pending} - known_items.keys()
+    if unknown:
+        for item in frappe.get_all(
+            "Item",
+            filters={"name": ["in", list(unknown)]},
+            fields=["name", "item_name", "stock_uom", "disabled"]
+        ):
+            known_items[item.name] = item
+
+    for line in pending:
+        item = known_items.get(line["item_code"])
+        if not item:
+            errors.append({"line": line["line"], "error": f"Item {line['item_code']} not found"})
+        elif item.disabled:
+            errors.append({"line": line["line"], "error": f"Item {line['item_code']} is disabled"})
+
+
+@frappe.whitelist()
+@instrument
+def receive_bulk(supplier, company=None, file_url=None, rejected_warehouse=None, posting_date=None, submit=0):
+    """
+    Build one Purchase Receipt from an ASN/CSV of received lines
+
+    The file is read row by row and validated in chunks, so only the
+    receipt being built is held in memory. Columns: item_code, batch_no,
+    accepted_qty, blemish_qty, rejected_qty, warehouse (an optional
+    rejected_warehouse column overrides the argument per line).
+
+    Returns:
+        dict with success, the Purchase Receipt name and totals, or the
+        line errors when nothing was created
+    """
+    frappe.has_permission("Purchase Receipt", "create", throw=True)
+
+    company = company or frappe.defaults.get_user_default("Company")
+    known_items = {}
+    warehouses = set(frappe.get_all("Warehouse", filters={"company": company, "disabled": 0}, pluck="name"))
+    errors = []
+    rows = []
+    pending = []
+    totals = {"accepted": 0.0, "blemish": 0.0, "rejected": 0.0}
+
+    with _open_lines(file_url) as stream:
+        reader = csv.DictReader(stream)
+        missing = [column for column in ("item_code", "accepted_qty", "warehouse") if column not in (reader.fieldnames or [])]
+        if missing:
+            frappe.throw(f"Missing column(s): {', '.join(missing)}")
+
+        for line_no, raw in enumerate(reader, start=2):
+            line = {column: cstr(raw.get(column)).strip() for column in BULK_COLUMNS}
+            line["line"] = line_no
+            accepted = flt(line["accepted_qty"])
+            blemish = flt(line["blemish_qty"])
+            rejected = flt(line["rejected_qty"])
+            line_rejected_warehouse = cstr(raw.get("rejected_warehouse")).strip() or rejected_warehouse
+
+            if not line["item_code"]:
+                errors.append({"line": line_no, "error": "Item code is missing"})
+                continue
+            if min(accepted, blemish, rejected) < 0 or not (accepted or blemish or rejected):
+                errors.append({"line": line_no, "error": "Quantities must be positive"})
+                continue
+            if line["warehouse"] not in warehouses:
+                errors.append({"line": line_no, "error": f"Warehouse {line['warehouse']} is not valid for {company}"})
+                continue
+            if rejected and not line_rejected_warehouse:
+                errors.append({"line": line_no, "error": "Rejected quantity needs a rejected warehouse"})
+                continue
+
+            totals["accepted"] += accepted
+            totals["blemish"] += blemish
+            totals["rejected"] += rejected
+
+            # allow_blemish expands qty by blemish and rejected on insert
+            rows.append({
+                "item_code": line["item_code"],
+                "batch_no": line["batch_no"] or None,
+                "use_serial_batch_fields": 1 if line["batch_no"] else 0,
+                "warehouse": line["warehouse"],
+                "qty": accepted,
+                "custom_blemish_quantity": blemish,
+                "rejected_qty": rejected,
+                "rejected_warehouse": line_rejected_warehouse if rejected else None,
+            })
+            pending.append(line)
+
+            if len(pending) >= BULK_ITEM_CHUNK:
+                _check_items(pending, known_items, errors)
+                pending = []
+
+            if len(errors) >= MAX_REPORTED_ERRORS:
+                break
+
+    if pending:
+        _check_items(pending, known_items, errors)
+
+    if errors:
+        return {"success": False, "errors": errors[:MAX_REPORTED_ERRORS]}
+    if not rows:
+        return {"success": False, "errors": [{"line": None, "error": "The file has no lines"}]}
+
+    for row in rows:
+        item = known_items[row["item_code"]]
+        row["item_name"] = item.item_name
+        row["uom"] = row["stock_uom"] = item.stock_uom
+        row["conversion_factor"] = 1
+
+    receipt = frappe.get_doc({
+        "doctype": "Purchase Receipt",
+        "supplier": supplier,
+        "company": company,
+        "posting_date": posting_date or today(),
+        "set_posting_time": 1 if posting_date else 0,
+        "items": rows,
+    })
+    del rows
+
+    receipt.insert()
+    if int(submit):
+        receipt.submit()
+
+    return {
+        "success": True,
+        "purchase_receipt": receipt.name,
+        "lines": len(receipt.items),
+        "total_accepted": totals["accepted"],
+        "total_blemish": totals["blemish"],
+        "total_rejected": totals["rejected"],
+        "total_received": receipt.custom_total_received,
+    }
@@ -0,0 +1,160 @@
+"""
+Recall fingerprint store
+
+Remembers, per recall_number, a hash of the fields that drive matching
+(product_code, code_info, status, device_name) and the inventory version
+the recall was last checked against. A recall whose hash and inventory
+version are both unchanged cannot produce new matches, so repeat feeds
+skip it.
+
+The inventory version is a random token in the cache that is replaced
+whenever existing Batches or the matched Item fields change. New Batches
+are checked by recall_watch as they are created, so they do not force a
+re-check of every recall. If the cache loses the token, a new one is
+issued and every recall is simply checked again.
+"""
+import hashlib
+import json
+
+import frappe
+from frappe.utils import now
+
+from surgishop_custom.logic.instrumentation import instrument
+
+FINGERPRINT_TABLE = "__recall_fingerprint"
+INVENTORY_VERSION_KEY = "surgishop_custom:recall_inventory_version"
+UPSERT_CHUNK = 1000
+
+
+def ensure_fingerprint_table():
+    """Create the fingerprint table if it does not exist yet"""
+    frappe.db.sql_ddl(f"""
+        CREATE TABLE IF NOT EXISTS `{FINGERPRINT_TABLE}` (
+            `recall_number` VARCHAR(140) NOT NULL,
+            `fingerprint` CHAR(32) NOT NULL,
+            `inventory_version` VARCHAR(32) NOT NULL,
+            `checked_on` DATETIME(6) NOT NULL,
+            PRIMARY KEY (`recall_number`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+
+def get_fingerprint(recall):
+    """Content hash of the recall fields that affect matching"""
+    payload = json.dumps(
+        [recall.get("product_code"), recall.get("code_info"), recall.get("status"), recall.get("device_name")],
+        default=str
+    )
+    return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+
+def get_inventory_version():
+    version = frappe.cache.get_value(INVENTORY_VERSION_KEY)
+    if not version:
+        version = bump_inventory_version()
+    return version
+
+
+@instrument
+def bump_inventory_version(doc=None, method=None, *args):
+    """
+    Mark the inventory as changed so every recall is checked again
+    DocType Event: Batch After Rename
+    """
+    version = frappe.generate_hash(length=16)
+    frappe.cache.set_value(INVENTORY_VERSION_KEY, version)
+    return version
+
+
+@instrument
+def batch_changed(doc, method=None):
+    """
+    Bump the inventory version when an existing Batch gets a new batch_id
+    DocType Event: Batch On Update
+    """
+    previous = doc.get_doc_before_save()
+    if previous and previous.batch_id != doc.batch_id:
+        bump_inventory_version()
+
+
+@instrument
+def item_changed(doc, method=None, *args):
+    """
+    Bump the inventory version when an Item field used for matching changes
+    DocType Event: Item On Update / After Rename / On Trash
+    """
+    if method != "on_update":
+        bump_inventory_version()
+        return
+
+    previous = doc.get_doc_before_save()
+    if (
+        not previous
+        or previous.item_name != doc.item_name
+        or {row.barcode for row in previous.get("barcodes", [])} != {row.barcode for row in doc.get("barcodes", [])}
+    ):
+        bump_inventory_version()
+
+
+def split_unchanged(recalls, inventory_version):
+    """
+    Split recalls into (changed, unchanged) against the stored fingerprints
+
+    Recalls without a recall_number are always treated as changed.
+    """
+    recall_numbers = list({recall.get("recall_number") for recall in recalls if recall.get("recall_number")})
+    stored = {}
+    if recall_numbers:
+        stored = {
+            row.recall_number: row
+            for row in frappe.db.sql(f"""
+                SELECT recall_number, fingerprint, inventory_version
+                FROM `{FINGERPRINT_TABLE}`
+                WHERE recall_number IN %(recall_numbers)s
+            """, {"recall_numbers": tuple(recall_numbers)}, as_dict=True)
+        }
+
+    changed = []
+    unchanged = []
+    for recall in recalls:
+        row = stored.get(recall.get("recall_number"))
+        if (
+            row
+            and row.fingerprint == get_fingerprint(recall)
+            and row.inventory_version == inventory_version
+        ):
+            unchanged.append(recall)
+        else:
+            changed.append(recall)
+
+    return changed, unchanged
+
+
+def record(recalls, inventory_version):
+    """Store the fingerprints of checked recalls in multi-row upserts"""
+    rows = {
+        recall.get("recall_number"): get_fingerprint(recall)
+        for recall in recalls
+        if recall.get("recall_number")
+    }
+    if not rows:
+        return
+
+    checked_on = now()
+    items = list(rows.items())
+    for i in range(0, len(items), UPSERT_CHUNK):
+        chunk = items[i:i + UPSERT_CHUNK]
+        placeholders = ", ".join(["(%s, %s, %s, %s)"] * len(chunk))
+        values = [
+            value
+            for recall_number, fingerprint in chunk
+            for value in (recall_number, fingerprint, inventory_version, checked_on)
+        ]
+        frappe.db.sql(f"""
+            INSERT INTO `{FINGERPRINT_TABLE}` (`recall_number`, `fingerprint`, `inventory_version`, `checked_on`)
+            VALUES {placeholders}
+            ON DUPLICATE KEY UPDATE
+                `fingerprint` = VALUES(`fingerprint`),
+                `inventory_version` = VALUES(`inventory_version`),
+                `checked_on` = VALUES(`checked_on`)
+        """, values)
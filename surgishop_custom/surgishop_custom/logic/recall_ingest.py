@@ -0,0 +1,333 @@
+"""
+Streaming ingestion of openFDA device recall dumps
+
+A full export (the download's {"meta": ..., "results": [...]} wrapper, a
+bare JSON array or NDJSON; plain, gzip or zip compressed) is decoded one
+record at a time with JSONDecoder.raw_decode over a bounded text buffer,
+normalised to the shape check_recalls expects and matched in chunks.
+Matches are mailed in batches as they are found and only counted after
+that, so memory stays at roughly one read buffer plus one chunk, whatever
+the size of the dump or the number of matches.
+
+Entry points: ingest_recall_file (an upload or an existing File, run as a
+background job and polled with api.get_recall_check_status) and the
+`bench --site <site> ingest-recalls <path>` command.
+"""
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import time
+import zipfile
+from contextlib import ExitStack, contextmanager
+
+import frappe
+from frappe.utils import cint, now
+
+from surgishop_custom.logic import app_log
+from surgishop_custom.logic.instrumentation import instrument
+
+READ_SIZE = 1024 * 1024
+MAX_RECORD_SIZE = 16 * 1024 * 1024
+INGEST_CHUNK = 500
+NOTIFY_BATCH = 500
+IMPORT_FOLDER = "recall_imports"
+WHITESPACE = " \t\r\n"
+WRAPPER_KEYS = ("meta", "results")
+
+_decoder = json.JSONDecoder()
+_first_key = re.compile(r'\{\s*"([^"\\]*)"')
+
+
+@contextmanager
+def open_dump(path):
+    """Text stream over a recall dump, decompressing gzip and zip on the fly"""
+    with ExitStack() as stack:
+        with open(path, "rb") as probe:
+            magic = probe.read(4)
+
+        if magic[:2] == b"\x1f\x8b":
+            raw = stack.enter_context(gzip.open(path, "rb"))
+        elif magic == b"PK\x03\x04":
+            archive = stack.enter_context(zipfile.ZipFile(path))
+            raw = stack.enter_context(archive.open(archive.namelist()[0]))
+        else:
+            raw = stack.enter_context(open(path, "rb"))
+
+        yield stack.enter_context(io.TextIOWrapper(raw, encoding="utf-8-sig"))
+
+
+class _Reader:
+    """A sliding text window over the stream for raw_decode"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = ""
+        self.pos = 0
+
+    def fill(self):
+        chunk = self.stream.read(READ_SIZE)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self, skip=WHITESPACE + ","):
+        """Next significant character, or "" at the end of the stream"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in skip:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char):
+        if self.peek(WHITESPACE) != char:
+            raise ValueError(f"Expected '{char}' at offset {self.pos} of the recall dump")
+        self.pos += 1
+
+    def decode(self):
+        """Decode the next JSON value, reading more as needed"""
+        self.peek(WHITESPACE)
+        while True:
+            try:
+                value, self.pos = _decoder.raw_decode(self.buffer, self.pos)
+                return value
+            except json.JSONDecodeError:
+                # Usually a value cut off at the end of the buffer
+                if len(self.buffer) - self.pos > MAX_RECORD_SIZE or not self.fill():
+                    raise
+
+
+def _iter_array(reader):
+    while True:
+        char = reader.peek()
+        if char == "]":
+            reader.pos += 1
+            return
+        if not char:
+            raise ValueError("The recall dump ended inside the results array")
+        yield reader.decode()
+
+
+def iter_records(stream):
+    """Yield the raw recall records of a dump one by one"""
+    reader = _Reader(stream)
+    first = reader.peek()
+
+    if first == "[":
+        reader.pos += 1
+        yield from _iter_array(reader)
+        return
+
+    key = _first_key.match(reader.buffer, reader.pos) if first == "{" else None
+    if key and key.group(1) in WRAPPER_KEYS:
+        reader.pos += 1
+        while reader.peek() == '"':
+            name = reader.decode()
+            reader.expect(":")
+            if name == "results" and reader.peek(WHITESPACE) == "[":
+                reader.pos += 1
+                yield from _iter_array(reader)
+            else:
+                reader.decode()
+        return
+
+    # NDJSON, or concatenated objects
+    while reader.peek():
+        yield reader.decode()
+
+
+def _iso_date(value):
+    value = str(value or "")
+    if len(value) == 8 and value.isdigit():
+        return f"{value[:4]}-{value[4:6]}-{value[6:]}"
+    return value or None
+
+
+def normalize_recall(record):
+    """
+    Map an openFDA device recall record onto the fields check_recalls uses
+
+    Records already in that shape pass through. Returns None for records
+    without a recall number.
+    """
+    if not isinstance(record, dict):
+        return None
+
+    openfda = record.get("openfda") or {}
+    recall_number = record.get("product_res_number") or record.get("recall_number")
+    if not recall_number:
+        return None
+
+    return {
+        "id": record.get("cfres_id") or record.get("id") or "",
+        "recall_number": recall_number,
+        "product_code": record.get("product_code") or openfda.get("product_code") or "",
+        "device_name": openfda.get("device_name") or record.get("device_name") or record.get("product_description") or "",
+        "code_info": record.get("code_info") or "",
+        "status": record.get("recall_status") or record.get("status") or "",
+        "reason": record.get("reason_for_recall") or record.get("reason") or "",
+        "recall_date": _iso_date(
+            record.get("event_date_initiated") or record.get("recall_status_date") or record.get("recall_date")
+        ),
+    }
+
+
+def ingest(stream, force=False, chunk_size=INGEST_CHUNK, on_progress=None):
+    """
+    Match every recall of a dump stream against inventory, committing per chunk
+
+    Returns:
+        dict with records, invalid_count, processed_count, skipped_count,
+        matched_count, elapsed_seconds and records_per_second
+    """
+    from surgishop_custom.api import check_recalls, send_recall_notification
+
+    started = time.monotonic()
+    stats = {"records": 0, "invalid_count": 0, "processed_count": 0, "skipped_count": 0, "matched_count": 0}
+    unnotified = []
+
+    def notify():
+        if unnotified:
+            send_recall_notification(unnotified)
+            frappe.db.commit()
+            unnotified.clear()
+
+    def check(chunk):
+        checked = check_recalls(chunk, force=force)
+        frappe.db.commit()
+        unnotified.extend(checked["matches"])
+        stats["processed_count"] += checked["processed_count"]
+        stats["skipped_count"] += checked["skipped_count"]
+        stats["matched_count"] += len(checked["matches"])
+        if len(unnotified) >= NOTIFY_BATCH:
+            notify()
+        elapsed = time.monotonic() - started
+        stats["elapsed_seconds"] = round(elapsed, 1)
+        stats["records_per_second"] = round(stats["records"] / elapsed, 1) if elapsed else None
+        if on_progress:
+            on_progress(dict(stats))
+
+    chunk = []
+    try:
+        for record in iter_records(stream):
+            recall = normalize_recall(record)
+            if not recall:
+                stats["invalid_count"] += 1
+                continue
+            chunk.append(recall)
+            stats["records"] += 1
+            if len(chunk) >= chunk_size:
+                check(chunk)
+                chunk = []
+        if chunk:
+            check(chunk)
+    finally:
+        # Chunks committed before a failure still get their alert
+        notify()
+
+    return stats
+
+
+def ingest_path(path, force=False, chunk_size=INGEST_CHUNK, on_progress=None):
+    with open_dump(path) as stream:
+        return ingest(stream, force=force, chunk_size=chunk_size, on_progress=on_progress)
+
+
+def _store_upload():
+    """Stream the uploaded dump to a private file for the background job"""
+    upload = frappe.request and frappe.request.files.get("file")
+    if not upload:
+        frappe.throw("Attach the openFDA recall dump as 'file' or pass a file_url.")
+
+    folder = frappe.get_site_path("private", "files", IMPORT_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    filename = re.sub(r"[^\w.-]", "_", os.path.basename(upload.filename or "recalls.json.gz"))
+    path = os.path.join(folder, f"{frappe.generate_hash(length=10)}-{filename}")
+    with open(path, "wb") as f:
+        shutil.copyfileobj(upload.stream, f, READ_SIZE)
+    return path
+
+
+@frappe.whitelist()
+@instrument
+def ingest_recall_file(file_url=None, force=0, chunk_size=INGEST_CHUNK):
+    """
+    Queue the ingestion of an openFDA device recall dump
+
+    Args:
+        file_url: an existing File; otherwise the dump is uploaded as 'file'
+        force: check every recall, even if unchanged since the last run
+        chunk_size: recalls matched and committed per step
+
+    Returns:
+        dict with job_id to poll with api.get_recall_check_status
+    """
+    from surgishop_custom.api import _save_recall_job_progress
+
+    frappe.only_for("System Manager")
+
+    if file_url:
+        path, uploaded = frappe.get_doc("File", {"file_url": file_url}).get_full_path(), False
+    else:
+        path, uploaded = _store_upload(), True
+
+    check_id = frappe.generate_hash(length=16)
+    _save_recall_job_progress(check_id, {
+        "status": "Queued",
+        "owner": frappe.session.user,
+        "source": os.path.basename(path),
+        "records": 0,
+        "processed": 0,
+        "queued_at": now()
+    })
+
+    frappe.enqueue(
+        "surgishop_custom.logic.recall_ingest.run_ingest_job",
+        queue="long",
+        timeout=4 * 60 * 60,
+        job_id=f"recall_ingest::{check_id}",
+        check_id=check_id,
+        path=path,
+        force=cint(force),
+        chunk_size=cint(chunk_size) or INGEST_CHUNK,
+        remove_file=uploaded
+    )
+
+    return {"success": True, "job_id": check_id}
+
+
+def run_ingest_job(check_id, path, force=0, chunk_size=INGEST_CHUNK, remove_file=False):
+    """Background job: stream the dump through the matcher, reporting progress per chunk"""
+    from surgishop_custom.api import _recall_job_key, _save_recall_job_progress
+
+    progress = frappe.cache.get_value(_recall_job_key(check_id)) or {}
+    progress.update({"status": "Running", "started_at": now()})
+    _save_recall_job_progress(check_id, progress)
+
+    def on_progress(stats):
+        progress.update(stats, processed=stats["records"])
+        _save_recall_job_progress(check_id, progress)
+
+    result = None
+    try:
+        result = ingest_path(path, force=cint(force), chunk_size=cint(chunk_size), on_progress=on_progress)
+        progress["status"] = "Completed"
+
+    except Exception as e:
+        frappe.db.rollback()
+        progress.update({"status": "Failed", "error": str(e)})
+        app_log.error("recall_ingest_failed", ref=check_id, title="Recall dump ingestion failed", source=path)
+        raise
+
+    finally:
+        progress["result"] = {"success": progress["status"] == "Completed", **(result or {})}
+        progress["finished_at"] = now()
+        _save_recall_job_progress(check_id, progress)
+        if remove_file and os.path.exists(path):
+            os.remove(path)
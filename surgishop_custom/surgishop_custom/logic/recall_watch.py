@@ -0,0 +1,192 @@
+"""
+Reverse recall check for newly created Batches
+
+Keeps the active recalls seen by check_recall_inventory in a small local
+index (recall payload plus its GTINs and lot numbers). When a Batch is
+created, only that batch_id is looked up in the index, so receipts are
+checked against known recalls as they arrive instead of at the next feed.
+"""
+import json
+import re
+
+import frappe
+from frappe.utils import now
+
+from surgishop_custom.logic import gs1
+from surgishop_custom.logic.instrumentation import instrument
+from surgishop_custom.logic.tables import table_exists
+
+RECALL_TABLE = "__active_recall"
+IDENTIFIER_TABLE = "__active_recall_identifier"
+INACTIVE_STATUSES = ("Terminated",)
+INSERT_CHUNK = 1000
+
+# GTINs are indexed in their unpadded GTIN-12/13/14 form, as udi_index
+# finds them in batch IDs
+GTIN_LENGTHS = (12, 13, 14)
+DIGIT_RUN = re.compile(r"[0-9]{%d,}" % min(GTIN_LENGTHS))
+
+
+def ensure_index_tables():
+    """Create the active recall tables if they do not exist yet"""
+    frappe.db.sql_ddl(f"""
+        CREATE TABLE IF NOT EXISTS `{RECALL_TABLE}` (
+            `recall_number` VARCHAR(140) NOT NULL,
+            `recall` LONGTEXT NOT NULL,
+            `modified` DATETIME(6) NOT NULL,
+            PRIMARY KEY (`recall_number`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    frappe.db.sql_ddl(f"""
+        CREATE TABLE IF NOT EXISTS `{IDENTIFIER_TABLE}` (
+            `kind` VARCHAR(10) NOT NULL,
+            `identifier` VARCHAR(140) NOT NULL,
+            `gtin` VARCHAR(14) NOT NULL,
+            `recall_number` VARCHAR(140) NOT NULL,
+            PRIMARY KEY (`kind`, `identifier`, `gtin`, `recall_number`),
+            KEY `recall_number` (`recall_number`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+
+def _insert(table, columns, rows):
+    for i in range(0, len(rows), INSERT_CHUNK):
+        chunk = rows[i:i + INSERT_CHUNK]
+        placeholders = ", ".join(["(" + ", ".join(["%s"] * len(columns)) + ")"] * len(chunk))
+        frappe.db.sql(
+            f"INSERT IGNORE INTO `{table}` ({', '.join(f'`{c}`' for c in columns)}) VALUES {placeholders}",
+            [value for row in chunk for value in row]
+        )
+
+
+def index_recalls(recalls):
+    """
+    Replace the indexed identifiers of these recalls
+
+    Called with the recalls check_recall_inventory actually processed.
+    Terminated recalls are dropped from the index.
+    """
+    recalls = {recall.get("recall_number"): recall for recall in recalls if recall.get("recall_number")}
+    if not recalls:
+        return
+
+    recall_numbers = tuple(recalls)
+    frappe.db.sql(f"DELETE FROM `{RECALL_TABLE}` WHERE recall_number IN %(names)s", {"names": recall_numbers})
+    frappe.db.sql(f"DELETE FROM `{IDENTIFIER_TABLE}` WHERE recall_number IN %(names)s", {"names": recall_numbers})
+
+    timestamp = now()
+    recall_rows = []
+    identifier_rows = []
+    for recall_number, recall in recalls.items():
+        if recall.get("status") in INACTIVE_STATUSES:
+            continue
+
+        udi = gs1.parse_code_info(recall.get("code_info", ""))
+        if not udi["gtins"]:
+            continue
+
+        recall_rows.append((recall_number, json.dumps(recall, default=str), timestamp))
+        for gtin in udi["gtins"]:
+            identifier_rows.append(("gtin", gs1.unpadded_gtin(gtin), gtin, recall_number))
+            for lot in udi["lots"]:
+                identifier_rows.append(("lot", lot, gtin, recall_number))
+
+    _insert(RECALL_TABLE, ("recall_number", "recall", "modified"), recall_rows)
+    _insert(IDENTIFIER_TABLE, ("kind", "identifier", "gtin", "recall_number"), identifier_rows)
+
+
+def _gtin_windows(batch_id):
+    """Every 12, 13 and 14 digit window of the digit runs in a batch_id"""
+    windows = set()
+    for run in DIGIT_RUN.findall(str(batch_id or "")):
+        for length in GTIN_LENGTHS:
+            for i in range(len(run) - length + 1):
+                windows.add(run[i:i + length])
+    return windows
+
+
+def find_recalls_for_batch(batch_id, item_code):
+    """
+    Recall numbers whose GTINs or lots match a batch
+
+    Mirrors check_recall_inventory: a GTIN anywhere in the batch_id, or the
+    batch_id equal to a recalled lot of a GTIN the item carries as barcode.
+    """
+    batch_id = str(batch_id or "").upper()
+    windows = _gtin_windows(batch_id)
+    if not windows and not batch_id:
+        return []
+
+    conditions = []
+    values = {"batch_id": batch_id}
+    if windows:
+        conditions.append("(kind = 'gtin' AND identifier IN %(windows)s)")
+        values["windows"] = tuple(windows)
+    conditions.append("(kind = 'lot' AND identifier = %(batch_id)s)")
+
+    rows = frappe.db.sql(f"""
+        SELECT kind, gtin, recall_number
+        FROM `{IDENTIFIER_TABLE}`
+        WHERE {' OR '.join(conditions)}
+    """, values, as_dict=True)
+
+    lot_rows = [row for row in rows if row.kind == "lot"]
+    barcodes = set()
+    if lot_rows and item_code:
+        barcodes = {
+            gs1.normalize_gtin(barcode)
+            for barcode in frappe.get_all(
+                "Item Barcode",
+                filters={"parent": item_code, "parenttype": "Item"},
+                pluck="barcode"
+            )
+        }
+
+    return list(dict.fromkeys(
+        row.recall_number
+        for row in rows
+        if row.kind == "gtin" or row.gtin in barcodes
+    ))
+
+
+@instrument
+def check_new_batch(doc, method=None):
+    """
+    Check a newly created Batch against the active recall index
+    DocType Event: Batch After Insert
+    """
+    if not table_exists(IDENTIFIER_TABLE):
+        return
+
+    recall_numbers = find_recalls_for_batch(doc.batch_id, doc.item)
+    if not recall_numbers:
+        return
+
+    from surgishop_custom import api
+
+    recalls = [
+        json.loads(recall)
+        for recall in frappe.db.sql_list(f"""
+            SELECT recall
+            FROM `{RECALL_TABLE}`
+            WHERE recall_number IN %(names)s
+        """, {"names": tuple(recall_numbers)})
+    ]
+
+    existing = api.get_existing_match_keys(recalls)
+    item_name = frappe.db.get_value("Item", doc.item, "item_name")
+    rows = [
+        api.build_recall_match(
+            recall=recall,
+            match_type="Batch UDI Match",
+            item_code=doc.item,
+            item_name=item_name,
+            batch_number=doc.name
+        )
+        for recall in recalls
+        if (recall.get("recall_number"), "Batch UDI Match", doc.name) not in existing
+    ]
+
+    matches = api.insert_recall_matches(rows)
+    if matches:
+        api.send_recall_notification(matches)
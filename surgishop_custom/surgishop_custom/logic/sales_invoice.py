@@ -1,10 +1,27 @@
 """
 Sales Invoice Server Scripts
 """
+import json
+import time
+
 import frappe
-from frappe.utils import add_to_date, now_datetime, format_datetime
+from frappe.utils import add_to_date, cint, get_datetime, now_datetime, format_datetime
+
+from surgishop_custom.logic import app_log, pdf_cache
+from surgishop_custom.logic.instrumentation import instrument
+
+INVOICE_PRINT_FORMAT = "Surgi Sales Invoice"
+SEND_PARALLELISM = 4
+SEND_COMMIT_EVERY = 20
+SEND_METRICS_KEY = "surgishop_custom:invoice_send_metrics"
+SEND_METRICS_KEEP = 100
+NEXT_DUE_KEY = "surgishop_custom:invoice_next_due"
+NEXT_DUE_TTL = 3600
+NOTHING_SCHEDULED = ""
+STUCK_SENDING_MINUTES = 30
 
 
+@instrument
 def auto_send_setup(doc, method=None):
     """
     Server Script: Sales Invoice - Auto Send Setup
@@ -20,63 +37,344 @@ def auto_send_setup(doc, method=None):
         # Set custom field values (we only need send_time and status)
         doc.custom_scheduled_send_time = send_time
         doc.custom_auto_send_status = 'Scheduled'
+        lower_next_due(send_time)
         
         frappe.msgprint(
             "Invoice will be automatically sent to customer on " + str(format_datetime(send_time)),
             indicator='green',
             title='Auto-Send Scheduled'
         )
+        
+        # Render the PDF now so the send 24 hours later reads it from cache
+        frappe.enqueue(
+            "surgishop_custom.logic.pdf_cache.prerender",
+            queue="short",
+            enqueue_after_commit=True,
+            doctype="Sales Invoice",
+            name=doc.name,
+            print_format=INVOICE_PRINT_FORMAT
+        )
 
 
 def send_pending_invoices():
     """
     Server Script: Send Pending Invoices
     Type: Scheduler Event
-    Event: Hourly
+    Event: Cron, every minute
+    
+    Idle ticks only read the cached next-due watermark. Once it has passed,
+    the due invoices are read through the auto-send status/time index and
+    fanned out to parallel send jobs. Each job claims its invoices before
+    sending, so overlapping runs never send one twice.
+    
+    The jobs have fixed ids, so while one from an earlier tick is still
+    running its new share is dropped. Nothing is lost: after its own share
+    every job keeps claiming due invoices until none are left unclaimed.
     """
+    if not is_send_due():
+        return
+    
     # Get all invoices scheduled for auto-send where send time has passed
     # Exclude returns/credit notes (is_return = 0)
-    invoices = frappe.db.sql("""
-        SELECT name, customer, customer_name, contact_email
+    invoices = frappe.db.sql_list("""
+        SELECT name
         FROM `tabSales Invoice`
-        WHERE docstatus = 1
+        WHERE custom_auto_send_status = 'Scheduled'
+        AND custom_scheduled_send_time <= NOW()
+        AND docstatus = 1
         AND is_return = 0
-        AND custom_auto_send_status = 'Scheduled'
+        ORDER BY custom_scheduled_send_time
+    """)
+    
+    # Invoices fanned out below stay Scheduled until a job claims them,
+    # so the watermark keeps the next tick looking until they are gone
+    update_next_due()
+    
+    if not invoices:
+        return
+    
+    run_id = frappe.generate_hash(length=10)
+    parallelism = min(cint(frappe.conf.get("invoice_send_parallelism")) or SEND_PARALLELISM, len(invoices))
+    
+    if parallelism <= 1:
+        send_invoice_batch(invoices, run_id)
+        return
+    
+    for worker in range(parallelism):
+        frappe.enqueue(
+            "surgishop_custom.logic.sales_invoice.send_invoice_batch",
+            queue="long",
+            job_id=f"surgishop_custom:send_invoice_batch:{worker}",
+            deduplicate=True,
+            invoice_names=invoices[worker::parallelism],
+            run_id=run_id
+        )
+
+
+def is_send_due():
+    """Whether the earliest scheduled send time has passed (True when unknown)"""
+    next_due = frappe.cache.get_value(NEXT_DUE_KEY)
+    if next_due is None:
+        return True
+    return next_due != NOTHING_SCHEDULED and get_datetime(next_due) <= now_datetime()
+
+
+def update_next_due():
+    """Cache the earliest send time of any Scheduled invoice"""
+    next_due = frappe.db.sql("""
+        SELECT custom_scheduled_send_time
+        FROM `tabSales Invoice`
+        WHERE custom_auto_send_status = 'Scheduled'
         AND custom_scheduled_send_time IS NOT NULL
-        AND custom_scheduled_send_time <= NOW()
-    """, as_dict=True)
+        AND docstatus = 1
+        AND is_return = 0
+        ORDER BY custom_scheduled_send_time
+        LIMIT 1
+    """)
+    frappe.cache.set_value(
+        NEXT_DUE_KEY,
+        str(next_due[0][0]) if next_due else NOTHING_SCHEDULED,
+        expires_in_sec=NEXT_DUE_TTL
+    )
+
+
+def lower_next_due(send_time):
+    """Pull the watermark forward when a new send is scheduled before it"""
+    next_due = frappe.cache.get_value(NEXT_DUE_KEY)
+    if next_due is None:
+        return
+    if next_due == NOTHING_SCHEDULED or get_datetime(send_time) < get_datetime(next_due):
+        frappe.cache.set_value(NEXT_DUE_KEY, str(send_time), expires_in_sec=NEXT_DUE_TTL)
+
+
+def send_invoice_batch(invoice_names, run_id=None):
+    """
+    Send a share of the due invoices, then any due invoice still unclaimed
     
-    for invoice in invoices:
-        try:
-            send_invoice_email(invoice.name)
-            
-            # Update status
-            frappe.db.set_value(
-                'Sales Invoice',
-                invoice.name,
-                {
-                    'custom_auto_send_status': 'Sent',
-                    'custom_actual_send_time': now_datetime()
-                },
-                update_modified=False
-            )
-            frappe.db.commit()
-            
-        except Exception as e:
-            # Mark as failed and log error
-            frappe.db.set_value(
-                'Sales Invoice',
-                invoice.name,
-                'custom_auto_send_status',
-                'Failed',
-                update_modified=False
-            )
-            frappe.db.commit()
+    Invoices are claimed first and sent one by one; each failure is rolled
+    back to its own savepoint so it cannot undo the sends around it.
+    Commits happen every SEND_COMMIT_EVERY invoices. Once the share is done
+    the job claims SEND_COMMIT_EVERY due invoices at a time, which picks up
+    shares that were dropped while this job was running.
+    """
+    started = time.monotonic()
+    claimed = claim_invoices(invoice_names)
+    claimed_count = sent = failed = 0
+    
+    while claimed:
+        for invoice_name in claimed:
+            claimed_count += 1
+            if send_claimed_invoice(invoice_name, run_id):
+                sent += 1
+            else:
+                failed += 1
             
-            frappe.log_error(
-                message="Invoice: " + invoice.name + "\nError: " + str(e),
-                title="Failed to send invoice email"
-            )
+            if claimed_count % SEND_COMMIT_EVERY == 0:
+                frappe.db.commit()
+        
+        frappe.db.commit()
+        claimed = claim_due_invoices(SEND_COMMIT_EVERY)
+    
+    seconds = time.monotonic() - started
+    record_send_metrics({
+        "run_id": run_id,
+        "assigned": len(invoice_names),
+        "claimed": claimed_count,
+        "sent": sent,
+        "failed": failed,
+        "seconds": round(seconds, 2),
+        "invoices_per_second": round(claimed_count / seconds, 2) if seconds else None,
+        "finished_at": str(now_datetime())
+    })
+
+
+def send_claimed_invoice(invoice_name, run_id=None):
+    """Send one claimed invoice and record Sent or Failed; True when it went out"""
+    frappe.db.savepoint("send_invoice")
+    try:
+        send_invoice_email(invoice_name)
+        
+        # Update status
+        frappe.db.set_value(
+            'Sales Invoice',
+            invoice_name,
+            {
+                'custom_auto_send_status': 'Sent',
+                'custom_actual_send_time': now_datetime()
+            },
+            update_modified=False
+        )
+        return True
+        
+    except Exception as e:
+        frappe.db.rollback(save_point="send_invoice")
+        
+        # Mark as failed and log the error outside the transaction
+        frappe.db.set_value(
+            'Sales Invoice',
+            invoice_name,
+            'custom_auto_send_status',
+            'Failed',
+            update_modified=False
+        )
+        
+        app_log.error(
+            "invoice_send_failed",
+            ref=invoice_name,
+            title="Failed to send invoice email",
+            error=str(e),
+            run_id=run_id
+        )
+        return False
+
+
+def claim_invoices(invoice_names):
+    """
+    Move still-Scheduled invoices to Sending and return the ones we got
+    
+    Rows locked by another run are skipped rather than waited on, and the
+    status change is committed before any email goes out.
+    """
+    if not invoice_names:
+        return []
+    
+    return _claim(frappe.db.sql_list("""
+        SELECT name
+        FROM `tabSales Invoice`
+        WHERE name IN %(names)s
+        AND custom_auto_send_status = 'Scheduled'
+        FOR UPDATE SKIP LOCKED
+    """, {"names": tuple(invoice_names)}))
+
+
+def claim_due_invoices(limit):
+    """Claim up to `limit` due invoices that no other job has claimed"""
+    return _claim(frappe.db.sql_list("""
+        SELECT name
+        FROM `tabSales Invoice`
+        WHERE custom_auto_send_status = 'Scheduled'
+        AND custom_scheduled_send_time <= NOW()
+        AND docstatus = 1
+        AND is_return = 0
+        ORDER BY custom_scheduled_send_time
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    """, {"limit": limit}))
+
+
+def _claim(claimed):
+    if claimed:
+        frappe.db.set_value(
+            'Sales Invoice',
+            {'name': ['in', claimed]},
+            {
+                'custom_auto_send_status': 'Sending',
+                'custom_send_claimed_at': now_datetime()
+            },
+            update_modified=False
+        )
+    frappe.db.commit()
+    
+    return claimed
+
+
+def record_send_metrics(metrics):
+    """Log a send job's throughput and keep the last runs for get_send_metrics"""
+    app_log.info("invoice_send_batch", ref=metrics["run_id"], **metrics)
+    frappe.cache.lpush(SEND_METRICS_KEY, json.dumps(metrics))
+    frappe.cache.ltrim(SEND_METRICS_KEY, 0, SEND_METRICS_KEEP - 1)
+
+
+@frappe.whitelist()
+@instrument
+def get_send_metrics():
+    """Throughput of the most recent invoice send jobs, newest first"""
+    frappe.only_for("System Manager")
+    return [json.loads(row) for row in frappe.cache.lrange(SEND_METRICS_KEY, 0, -1)]
+
+
+# Claimed before the claim time was recorded: fall back to the scheduled time
+STUCK_SENDING = (
+    "custom_auto_send_status = 'Sending' "
+    "AND COALESCE(custom_send_claimed_at, custom_scheduled_send_time) <= %(stuck_before)s"
+)
+
+
+def _auto_send_rows(conditions, order_by):
+    return frappe.db.sql(f"""
+        SELECT name, customer, customer_name, grand_total,
+            custom_auto_send_status, custom_scheduled_send_time, custom_send_claimed_at, custom_actual_send_time
+        FROM `tabSales Invoice`
+        WHERE docstatus = 1 AND is_return = 0 AND {conditions}
+        ORDER BY {order_by}
+        LIMIT 100
+    """, {"stuck_before": add_to_date(now_datetime(), minutes=-STUCK_SENDING_MINUTES)}, as_dict=True)
+
+
+@frappe.whitelist()
+@instrument
+def get_auto_send_overview():
+    """Backlogged, upcoming, failed and stuck auto-sends, plus the watermark"""
+    frappe.only_for(["Accounts Manager", "System Manager"])
+
+    counts = frappe.db.sql("""
+        SELECT custom_auto_send_status AS status,
+            SUM(custom_scheduled_send_time <= NOW()) AS due,
+            COUNT(*) AS invoices
+        FROM `tabSales Invoice`
+        WHERE custom_auto_send_status IN ('Scheduled', 'Sending', 'Failed')
+        AND docstatus = 1
+        AND is_return = 0
+        GROUP BY custom_auto_send_status
+    """, as_dict=True)
+
+    return {
+        "counts": counts,
+        "next_due": frappe.cache.get_value(NEXT_DUE_KEY),
+        # Scheduled but overdue: the dispatcher or the send jobs are behind
+        "backlog": _auto_send_rows(
+            "custom_auto_send_status = 'Scheduled' AND custom_scheduled_send_time <= NOW()",
+            "custom_scheduled_send_time"
+        ),
+        "scheduled": _auto_send_rows(
+            "custom_auto_send_status = 'Scheduled' AND custom_scheduled_send_time > NOW()",
+            "custom_scheduled_send_time"
+        ),
+        "failed": _auto_send_rows(
+            "custom_auto_send_status = 'Failed'",
+            "custom_scheduled_send_time DESC"
+        ),
+        # Claimed but never marked Sent or Failed, e.g. the worker died mid-batch
+        "stuck": _auto_send_rows(STUCK_SENDING, "custom_send_claimed_at"),
+    }
+
+
+@frappe.whitelist()
+@instrument
+def requeue_auto_send(invoices=None):
+    """Schedule Failed and stuck Sending invoices (all, or the given ones) to go out now; an empty list requeues nothing"""
+    frappe.only_for(["Accounts Manager", "System Manager"])
+
+    conditions = ""
+    values = {"now": now_datetime(), "stuck_before": add_to_date(now_datetime(), minutes=-STUCK_SENDING_MINUTES)}
+    if invoices not in (None, ""):
+        invoices = frappe.parse_json(invoices) if isinstance(invoices, str) else invoices
+        if not invoices:
+            return
+        conditions = "AND name IN %(names)s"
+        values["names"] = tuple(invoices)
+
+    frappe.db.sql(f"""
+        UPDATE `tabSales Invoice`
+        SET custom_auto_send_status = 'Scheduled', custom_scheduled_send_time = %(now)s
+        WHERE docstatus = 1
+        AND (
+            custom_auto_send_status = 'Failed'
+            OR ({STUCK_SENDING})
+        )
+        {conditions}
+    """, values)
+    frappe.cache.delete_value(NEXT_DUE_KEY)
 
 
 def send_invoice_email(invoice_name):
@@ -102,15 +400,12 @@ def send_invoice_email(invoice_name):
     message = message + "[YOUR CUSTOM EMAIL BODY WILL GO HERE]\n\n"
     message = message + "Best regards,\nSurgiShop Accounting Team"
     
-    # Generate PDF with custom print format
-    print_format = "Surgi Sales Invoice"
-    
-    # Get PDF content using frappe.utils.pdf
-    from frappe.utils.pdf import get_pdf
-    pdf_content = get_pdf(
+    # Generate PDF with custom print format (usually pre-rendered at submit)
+    pdf_content = pdf_cache.get_pdf(
         'Sales Invoice',
         invoice.name,
-        print_format=print_format
+        print_format=INVOICE_PRINT_FORMAT,
+        doc=invoice
     )
     
     # Send email with attachment
@@ -1,15 +1,34 @@
 """
 Sales Order Server Scripts
 """
+from collections import defaultdict
+from functools import partial
+
 import frappe
+from frappe.utils import cint, flt
+
+from surgishop_custom.logic import app_log, print_queue
+from surgishop_custom.logic.instrumentation import instrument
 
+BULK_PENDING_KEY = "surgishop_custom:bulk_delivery_orders"
+BULK_COMMIT_EVERY = 50
+BULK_POP = 500
 
+
+@instrument
 def create_delivery_note(doc, method=None):
     """
     Emulate clicking "Create → Delivery Note" right after a Sales Order is submitted.
     Leaves the Delivery Note as a Draft and automatically prints it.
+
+    During a bulk submit or data import the order is handed to
+    create_delivery_notes instead, which handles the whole set at once.
     """
     if doc.docstatus == 1:
+        if in_bulk_submit():
+            defer_to_bulk(doc.name)
+            return
+
         try:
             # Use the same backend method the button calls
             from erpnext.selling.doctype.sales_order.sales_order import make_delivery_note
@@ -26,22 +45,190 @@ def create_delivery_note(doc, method=None):
                     f"Draft Delivery Note {dn.name} created from Sales Order {doc.name}.",
                     alert=True, indicator="green"
                 )
-                
-                # Automatically print the Delivery Note using surgi_print_dn app
-                # Silently attempt printing - don't show error if it fails
-                try:
-                    printer_name = "Brother_HL-L3210CW_series"
-                    frappe.call(
-                        "surgi_print_dn.api.print_delivery_note_via_webhook",
-                        doc_name=dn.name,
-                        printer_name=printer_name
-                    )
-                    # Silent success - no popup needed
-                    frappe.logger().info(f"Auto-print successful for DN {dn.name}")
-                except:
-                    # Silent failure - no popup to confuse user
-                    frappe.logger().info(f"Auto-print attempted for DN {dn.name}")
-                    
+
+                # Automatically print the Delivery Note through the print queue
+                # Failures are retried by the queue - no popup to confuse user
+                print_queue.queue_print("Delivery Note", dn.name)
+
         except Exception as e:
-            frappe.log_error(message=str(e), title=f"Auto DN creation failed for {doc.name}")
+            app_log.error("auto_delivery_note_failed", ref=doc.name, title="Auto DN creation failed", error=str(e))
             frappe.msgprint("Auto Delivery Note creation failed — check Error Log.", alert=True, indicator="red")
+
+
+def in_bulk_submit():
+    """True while Sales Orders are being submitted by Data Import or list view bulk submit"""
+    if frappe.flags.in_import or frappe.flags.in_bulk_delivery:
+        return True
+
+    # Bulk submit of < 20 documents runs inside the request itself
+    if "submit_cancel_or_update_docs" in (frappe.form_dict.get("cmd") or ""):
+        return True
+
+    # Larger bulk submits run as a background job
+    from rq import get_current_job
+    job = get_current_job()
+    return bool(job and "_bulk_action" in str(job.kwargs.get("job_name") or job.kwargs.get("method") or ""))
+
+
+def defer_to_bulk(sales_order):
+    """
+    Collect a submitted Sales Order for the next bulk Delivery Note run
+
+    The order is added once its submit has committed, so a rolled back
+    submit leaves nothing behind and the job never sees it unsubmitted.
+    """
+    frappe.db.after_commit.add(partial(frappe.cache.sadd, BULK_PENDING_KEY, sales_order))
+    frappe.enqueue(
+        "surgishop_custom.logic.sales_order.process_bulk_pending",
+        queue="long",
+        enqueue_after_commit=True,
+        job_id="bulk_delivery_notes",
+        deduplicate=True
+    )
+
+
+def process_bulk_pending():
+    """
+    Background job, also Scheduler Event: every minute
+    Create Delivery Notes for Sales Orders collected during bulk submits
+
+    Orders are popped atomically, so the cron run and the queued job never
+    work on the same order.
+    """
+    while True:
+        pending = _pop_pending()
+        if not pending:
+            return
+
+        try:
+            create_delivery_notes(pending, combine=frappe.conf.get("bulk_delivery_combine"))
+        except Exception:
+            # Hand the orders to the next run rather than dropping them
+            frappe.cache.sadd(BULK_PENDING_KEY, *pending)
+            raise
+
+
+def _pop_pending():
+    # RedisWrapper.spop prefixes the key itself and pops a single member,
+    # so pop BULK_POP at once with the plain command on the prefixed key
+    pipeline = frappe.cache.pipeline()
+    pipeline.spop(frappe.cache.make_key(BULK_PENDING_KEY), BULK_POP)
+    return [name.decode() if isinstance(name, bytes) else name for name in pipeline.execute()[0] or []]
+
+
+@frappe.whitelist()
+@instrument
+def create_delivery_notes(sales_orders, combine=0):
+    """
+    Create draft Delivery Notes for many submitted Sales Orders
+
+    Every order still goes through ERPNext's make_delivery_note mapper;
+    the run saves the per-order overhead around it: orders can be combined
+    into one DN, inserts commit in batches, and the DNs are printed and
+    reported once.
+
+    Orders that already have a draft or submitted Delivery Note are skipped.
+
+    Args:
+        sales_orders: list of Sales Order names
+        combine: merge orders with the same customer, shipping address,
+            company, currency and price list into one Delivery Note
+
+    Returns:
+        dict with created, skipped and failed lists
+    """
+    frappe.has_permission("Delivery Note", "create", throw=True)
+    from erpnext.selling.doctype.sales_order.sales_order import make_delivery_note
+
+    if isinstance(sales_orders, str):
+        sales_orders = frappe.parse_json(sales_orders)
+    sales_orders = list(dict.fromkeys(sales_orders or []))
+
+    summary = {"created": [], "skipped": [], "failed": []}
+    if not sales_orders:
+        return summary
+
+    orders = frappe.get_all(
+        "Sales Order",
+        filters={"name": ["in", sales_orders]},
+        fields=["name", "docstatus", "status", "per_delivered", "customer", "shipping_address_name",
+                "company", "currency", "selling_price_list"]
+    )
+
+    # A retried or overlapping run must not create a second DN for an order
+    existing_notes = dict(frappe.db.sql("""
+        SELECT dni.against_sales_order, MIN(dni.parent)
+        FROM `tabDelivery Note Item` dni
+        WHERE dni.against_sales_order IN %(orders)s
+        AND dni.docstatus < 2
+        GROUP BY dni.against_sales_order
+    """, {"orders": tuple(order.name for order in orders)})) if orders else {}
+
+    found = {order.name for order in orders}
+    summary["skipped"].extend(
+        {"sales_order": name, "reason": "Not found"} for name in sales_orders if name not in found
+    )
+
+    groups = defaultdict(list)
+    for order in orders:
+        if order.docstatus != 1 or order.status in ("Closed", "On Hold"):
+            reason = "Not submitted" if order.docstatus != 1 else f"Status is {order.status}"
+        elif flt(order.per_delivered) >= 100:
+            reason = "Already delivered"
+        elif order.name in existing_notes:
+            reason = f"Delivery Note {existing_notes[order.name]} already exists"
+        else:
+            reason = None
+
+        if reason:
+            summary["skipped"].append({"sales_order": order.name, "reason": reason})
+            continue
+
+        key = (
+            (order.customer, order.shipping_address_name, order.company, order.currency, order.selling_price_list)
+            if cint(combine) else order.name
+        )
+        groups[key].append(order.name)
+
+    for count, group in enumerate(groups.values(), start=1):
+        frappe.db.savepoint("bulk_delivery_note")
+        try:
+            # Chaining target_doc merges every order of the group into one DN
+            dn = None
+            for sales_order in group:
+                dn = make_delivery_note(sales_order, target_doc=dn)
+
+            if not dn or not dn.get("items"):
+                summary["skipped"].extend(
+                    {"sales_order": name, "reason": "No deliverable items"} for name in group
+                )
+                continue
+
+            dn = frappe.get_doc(dn) if isinstance(dn, dict) else dn
+            dn.insert(ignore_permissions=True)
+            summary["created"].append({"delivery_note": dn.name, "sales_orders": group})
+
+        except Exception as e:
+            frappe.db.rollback(save_point="bulk_delivery_note")
+            summary["failed"].extend({"sales_order": name, "error": str(e)} for name in group)
+            app_log.error(
+                "bulk_delivery_note_failed", ref=group[0], title="Bulk DN creation failed",
+                error=str(e), sales_orders=group
+            )
+
+        if count % BULK_COMMIT_EVERY == 0:
+            frappe.db.commit()
+
+    # One print burst; the print queue sends it to the printer as a batch
+    for created in summary["created"]:
+        print_queue.queue_print("Delivery Note", created["delivery_note"])
+
+    frappe.db.commit()
+
+    frappe.msgprint(
+        f"{len(summary['created'])} Draft Delivery Note(s) created, "
+        f"{len(summary['skipped'])} order(s) skipped, {len(summary['failed'])} failed.",
+        alert=True, indicator="red" if summary["failed"] else "green"
+    )
+
+    return summary
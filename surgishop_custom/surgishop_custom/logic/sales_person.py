@@ -0,0 +1,65 @@
+"""
+Default Sales Person resolution
+
+The Sales Person of a user is the User's sales_person field, or else the
+Sales Person linked to the User's employee. Results are cached per user in
+one hash that is dropped whenever a User, Employee or Sales Person changes,
+and shipped in the boot payload so new Sales Orders need no lookup.
+"""
+import frappe
+
+from surgishop_custom.logic.instrumentation import instrument
+
+SALES_PERSON_MAP_KEY = "surgishop_custom:default_sales_person"
+
+
+def _resolve(user):
+    user_meta = frappe.get_meta("User")
+    fields = [field for field in ("sales_person", "employee") if user_meta.has_field(field)]
+    if not fields:
+        return None
+
+    values = frappe.db.get_value("User", user, fields, as_dict=True)
+    if not values:
+        return None
+
+    if values.get("sales_person"):
+        return values.sales_person
+
+    if values.get("employee"):
+        return frappe.db.get_value(
+            "Sales Person", {"employee": values.employee}, "name"
+        )
+
+    return None
+
+
+def get_default_sales_person(user=None):
+    user = user or frappe.session.user
+    sales_person = frappe.cache.hget(SALES_PERSON_MAP_KEY, user)
+    if sales_person is None:
+        sales_person = _resolve(user) or ""
+        frappe.cache.hset(SALES_PERSON_MAP_KEY, user, sales_person)
+    return sales_person or None
+
+
+@instrument
+def invalidate(doc=None, method=None, *args):
+    """
+    Drop the cached user -> sales person map
+    DocType Event: User / Employee / Sales Person On Update / After Rename / On Trash
+    """
+    frappe.cache.delete_value(SALES_PERSON_MAP_KEY)
+
+
+def boot_session(bootinfo):
+    """Ship the user's default Sales Person with the desk boot"""
+    if frappe.session.user != "Guest":
+        bootinfo.default_sales_person = get_default_sales_person()
+
+
+@frappe.whitelist()
+@instrument
+def get_sales_person():
+    """Default Sales Person of the current user, for sessions booted before it was set"""
+    return get_default_sales_person()
@@ -0,0 +1,293 @@
+"""
+Batch to customer shipment lineage
+
+One row per (voucher item, Batch) in __batch_shipment with the customer,
+shipping address, quantity and posting date, written when a Delivery Note
+or a Sales Invoice that updates stock is submitted, and removed when it is
+cancelled. Batches come from the item's Serial and Batch Bundle, or from
+its batch_no field when the voucher uses the legacy batch fields. Returns
+are stored with negative quantities, so sums give what the customer still
+holds.
+
+get_recall_exposure answers "who received these batches" for recall
+notices with indexed queries.
+
+Backfill from the console with:
+    bench --site <site> backfill-shipment-lineage
+"""
+from collections import defaultdict
+
+import frappe
+from frappe.utils import flt, now
+
+from surgishop_custom.logic.instrumentation import instrument
+from surgishop_custom.logic.tables import table_exists
+
+LINEAGE_TABLE = "__batch_shipment"
+VOUCHER_TYPES = ("Delivery Note", "Sales Invoice")
+INSERT_CHUNK = 1000
+BACKFILL_PAGE = 500
+
+
+def ensure_lineage_table():
+    """Create the lineage table if it does not exist yet"""
+    frappe.db.sql_ddl(f"""
+        CREATE TABLE IF NOT EXISTS `{LINEAGE_TABLE}` (
+            `voucher_detail` VARCHAR(140) NOT NULL,
+            `batch_no` VARCHAR(140) NOT NULL,
+            `voucher_type` VARCHAR(140) NOT NULL,
+            `voucher_no` VARCHAR(140) NOT NULL,
+            `item_code` VARCHAR(140) NOT NULL,
+            `customer` VARCHAR(140) NULL,
+            `shipping_address` VARCHAR(140) NULL,
+            `qty` DECIMAL(21,9) NOT NULL DEFAULT 0,
+            `posting_date` DATE NULL,
+            `modified` DATETIME(6) NOT NULL,
+            PRIMARY KEY (`voucher_detail`, `batch_no`),
+            KEY `batch_customer` (`batch_no`, `customer`),
+            KEY `voucher_no` (`voucher_no`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+
+def _table_exists():
+    return table_exists(LINEAGE_TABLE)
+
+
+def _ships_stock(voucher_type):
+    """Sales Invoices only move stock when they update it themselves"""
+    return "AND update_stock = 1" if voucher_type == "Sales Invoice" else ""
+
+
+def _lineage_rows(voucher_type, vouchers):
+    """Lineage rows of submitted vouchers of one type, read in three queries"""
+    if not vouchers:
+        return []
+
+    headers = {
+        voucher.name: voucher
+        for voucher in frappe.db.sql(f"""
+            SELECT name, customer, shipping_address_name, posting_date, is_return
+            FROM `tab{voucher_type}`
+            WHERE name IN %(names)s AND docstatus = 1 {_ships_stock(voucher_type)}
+        """, {"names": tuple(vouchers)}, as_dict=True)
+    }
+    if not headers:
+        return []
+
+    items = frappe.db.sql(f"""
+        SELECT name, parent, item_code, stock_qty, batch_no, serial_and_batch_bundle
+        FROM `tab{voucher_type} Item`
+        WHERE parent IN %(names)s AND parenttype = %(voucher_type)s
+    """, {"names": tuple(headers), "voucher_type": voucher_type}, as_dict=True)
+
+    bundles = [item.serial_and_batch_bundle for item in items if item.serial_and_batch_bundle]
+    bundle_batches = defaultdict(list)
+    if bundles:
+        for entry in frappe.db.sql("""
+            SELECT parent, batch_no, SUM(ABS(qty)) AS qty
+            FROM `tabSerial and Batch Entry`
+            WHERE parent IN %(bundles)s AND IFNULL(batch_no, '') != ''
+            GROUP BY parent, batch_no
+        """, {"bundles": tuple(bundles)}, as_dict=True):
+            bundle_batches[entry.parent].append((entry.batch_no, flt(entry.qty)))
+
+    timestamp = now()
+    rows = []
+    for item in items:
+        voucher = headers[item.parent]
+        if item.serial_and_batch_bundle:
+            batches = bundle_batches[item.serial_and_batch_bundle]
+        elif item.batch_no:
+            batches = [(item.batch_no, abs(flt(item.stock_qty)))]
+        else:
+            continue
+
+        sign = -1 if voucher.is_return else 1
+        rows.extend(
+            (item.name, batch_no, voucher_type, voucher.name, item.item_code, voucher.customer,
+             voucher.shipping_address_name, sign * qty, voucher.posting_date, timestamp)
+            for batch_no, qty in batches
+        )
+    return rows
+
+
+def _write(rows):
+    for i in range(0, len(rows), INSERT_CHUNK):
+        chunk = rows[i:i + INSERT_CHUNK]
+        placeholders = ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(chunk))
+        frappe.db.sql(f"""
+            INSERT INTO `{LINEAGE_TABLE}`
+                (`voucher_detail`, `batch_no`, `voucher_type`, `voucher_no`, `item_code`, `customer`,
+                 `shipping_address`, `qty`, `posting_date`, `modified`)
+            VALUES {placeholders}
+            ON DUPLICATE KEY UPDATE
+                `voucher_type` = VALUES(`voucher_type`),
+                `voucher_no` = VALUES(`voucher_no`),
+                `item_code` = VALUES(`item_code`),
+                `customer` = VALUES(`customer`),
+                `shipping_address` = VALUES(`shipping_address`),
+                `qty` = VALUES(`qty`),
+                `posting_date` = VALUES(`posting_date`),
+                `modified` = VALUES(`modified`)
+        """, [value for row in chunk for value in row])
+
+
+@instrument
+def record_shipment(doc, method=None):
+    """
+    Record which batches went to which customer
+    DocType Event: Delivery Note After Submit, Sales Invoice On Submit
+    """
+    if not _table_exists():
+        return
+    if doc.doctype == "Sales Invoice" and not doc.get("update_stock"):
+        return
+
+    _write(_lineage_rows(doc.doctype, [doc.name]))
+
+
+@instrument
+def remove_shipment(doc, method=None):
+    """
+    DocType Event: Delivery Note / Sales Invoice On Cancel
+    """
+    if not _table_exists():
+        return
+
+    frappe.db.sql(
+        f"DELETE FROM `{LINEAGE_TABLE}` WHERE voucher_no = %s AND voucher_type = %s",
+        (doc.name, doc.doctype)
+    )
+
+
+def backfill(from_date=None, voucher_types=VOUCHER_TYPES):
+    """Record every submitted stock-moving voucher (optionally from a posting date on)"""
+    ensure_lineage_table()
+
+    recorded = 0
+    for voucher_type in voucher_types:
+        conditions = f"docstatus = 1 {_ships_stock(voucher_type)}"
+        values = {"page": BACKFILL_PAGE, "last_name": ""}
+        if from_date:
+            conditions += " AND posting_date >= %(from_date)s"
+            values["from_date"] = from_date
+
+        while True:
+            names = frappe.db.sql_list(f"""
+                SELECT name FROM `tab{voucher_type}`
+                WHERE {conditions} AND name > %(last_name)s
+                ORDER BY name
+                LIMIT %(page)s
+            """, values)
+            if not names:
+                break
+
+            _write(_lineage_rows(voucher_type, names))
+            recorded += len(names)
+            values["last_name"] = names[-1]
+            frappe.db.commit()
+
+    return {"vouchers": recorded}
+
+
+@frappe.whitelist()
+@instrument
+def get_recall_exposure(batches=None, recall_number=None):
+    """
+    Customers holding recalled batches
+
+    Args:
+        batches: list of Batch names, or
+        recall_number: take the batches of that recall's Batch UDI Matches
+
+    Returns:
+        dict with per batch on-hand and shipped quantities, and per customer
+        the net quantity of each batch they still hold (returns to any
+        address deducted), with the shipping addresses and vouchers
+    """
+    frappe.only_for(["System Manager", "Stock Manager", "Sales Manager"])
+
+    if isinstance(batches, str):
+        batches = frappe.parse_json(batches)
+    batches = set(batches or [])
+    if recall_number:
+        batches.update(frappe.get_all(
+            "Recall Match",
+            filters={"recall_number": recall_number, "match_type": "Batch UDI Match"},
+            pluck="erpnext_batch_number"
+        ))
+    batches.discard(None)
+    if not batches:
+        return {"batches": [], "customers": []}
+
+    by_batch = {
+        batch.name: {
+            "batch_no": batch.name,
+            "item_code": batch.item,
+            "on_hand_qty": flt(batch.batch_qty),
+            "shipped_qty": 0,
+            "customers": 0,
+        }
+        for batch in frappe.get_all(
+            "Batch",
+            filters={"name": ["in", list(batches)]},
+            fields=["name", "item", "batch_qty"],
+            order_by="name"
+        )
+    }
+    if not by_batch:
+        return {"batches": [], "customers": []}
+
+    shipments = frappe.db.sql(f"""
+        SELECT bs.batch_no, bs.item_code, bs.customer, c.customer_name, bs.shipping_address,
+            bs.voucher_type, bs.voucher_no, bs.qty, bs.posting_date
+        FROM `{LINEAGE_TABLE}` bs
+        LEFT JOIN `tabCustomer` c ON c.name = bs.customer
+        WHERE bs.batch_no IN %(batches)s AND IFNULL(bs.customer, '') != ''
+        ORDER BY bs.customer, bs.batch_no, bs.posting_date, bs.voucher_no
+    """, {"batches": tuple(by_batch)}, as_dict=True)
+
+    # Net per customer and batch, so a return booked to another address still counts
+    held = {}
+    for row in shipments:
+        entry = held.setdefault((row.customer, row.batch_no), frappe._dict(
+            customer_name=row.customer_name, item_code=row.item_code, qty=0,
+            shipping_addresses=[], vouchers=[], last_shipped=None
+        ))
+        entry.qty += flt(row.qty)
+        voucher = {"voucher_type": row.voucher_type, "voucher_no": row.voucher_no}
+        if voucher not in entry.vouchers:
+            entry.vouchers.append(voucher)
+        if flt(row.qty) > 0:
+            if row.shipping_address and row.shipping_address not in entry.shipping_addresses:
+                entry.shipping_addresses.append(row.shipping_address)
+            entry.last_shipped = max(filter(None, (entry.last_shipped, row.posting_date)), default=None)
+
+    by_customer = {}
+    for (party, batch_no), entry in held.items():
+        if flt(entry.qty, 6) <= 0:
+            continue
+
+        batch = by_batch[batch_no]
+        batch["shipped_qty"] += entry.qty
+        batch["customers"] += 1
+
+        customer = by_customer.setdefault(party, {
+            "customer": party,
+            "customer_name": entry.customer_name,
+            "shipping_addresses": [],
+            "batches": [],
+        })
+        customer["shipping_addresses"].extend(
+            address for address in entry.shipping_addresses if address not in customer["shipping_addresses"]
+        )
+        customer["batches"].append({
+            "batch_no": batch_no,
+            "item_code": batch["item_code"] or entry.item_code,
+            "qty": entry.qty,
+            "last_shipped": entry.last_shipped,
+            "vouchers": entry.vouchers,
+        })
+
+    return {"batches": list(by_batch.values()), "customers": list(by_customer.values())}
@@ -0,0 +1,24 @@
+"""
+Existence checks for the app's raw (non-DocType) tables
+
+Document hooks skip index maintenance until the patch that creates the
+table has run. frappe.db.get_tables() is cached and a worker may have
+cached the list before the patch, so a table that is not known yet is
+always looked up in the database; once found it is remembered for the
+life of the process.
+"""
+import frappe
+
+_existing = set()
+
+
+def table_exists(table):
+    key = (getattr(frappe.local, "site", None), table)
+    if key in _existing:
+        return True
+
+    if table not in frappe.db.get_tables(cached=False):
+        return False
+
+    _existing.add(key)
+    return True
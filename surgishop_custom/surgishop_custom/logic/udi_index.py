@@ -0,0 +1,211 @@
+"""
+UDI to Batch lookup index
+
+Maps every 10-digit window found in a Batch ID to the Batch name so that
+check_recall_inventory no longer needs a `LIKE '%udi%'` scan of tabBatch.
+
+Extracted UDIs are always runs of 10+ digits, so any batch_id containing a
+UDI also contains its first 10 digits. Looking that gram up and confirming
+the full substring on the candidates returns exactly what LIKE returned.
+
+Rebuild from the console with:
+    bench --site <site> execute surgishop_custom.logic.udi_index.rebuild
+"""
+import re
+from collections import defaultdict
+
+import frappe
+
+from surgishop_custom.logic import gs1
+from surgishop_custom.logic.instrumentation import instrument
+from surgishop_custom.logic.tables import table_exists
+
+INDEX_TABLE = "__udi_batch_index"
+BUILT_FLAG = "udi_batch_index_built"
+GRAM_SIZE = 10
+INSERT_CHUNK = 1000
+REBUILD_PAGE = 5000
+
+DIGIT_RUN = re.compile(r"[0-9]{%d,}" % GRAM_SIZE)
+INDEXABLE_UDI = re.compile(r"^[0-9]{%d,}$" % GRAM_SIZE)
+
+
+def ensure_index_table():
+    """Create the index table if it does not exist yet"""
+    frappe.db.sql_ddl(f"""
+        CREATE TABLE IF NOT EXISTS `{INDEX_TABLE}` (
+            `gram` VARCHAR({GRAM_SIZE}) NOT NULL,
+            `batch` VARCHAR(140) NOT NULL,
+            PRIMARY KEY (`gram`, `batch`),
+            KEY `batch` (`batch`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+
+def get_grams(batch_id):
+    """Return every 10-digit window of the digit runs in a batch_id"""
+    grams = set()
+    for run in DIGIT_RUN.findall(str(batch_id or "")):
+        for i in range(len(run) - GRAM_SIZE + 1):
+            grams.add(run[i:i + GRAM_SIZE])
+    return grams
+
+
+def is_built():
+    return bool(frappe.db.get_default(BUILT_FLAG))
+
+
+def _table_exists():
+    return table_exists(INDEX_TABLE)
+
+
+def _insert_rows(rows):
+    """Insert (gram, batch) pairs in multi-row statements"""
+    for i in range(0, len(rows), INSERT_CHUNK):
+        chunk = rows[i:i + INSERT_CHUNK]
+        placeholders = ", ".join(["(%s, %s)"] * len(chunk))
+        values = [value for row in chunk for value in row]
+        frappe.db.sql(
+            f"INSERT IGNORE INTO `{INDEX_TABLE}` (`gram`, `batch`) VALUES {placeholders}",
+            values
+        )
+
+
+def _remove(batch_name):
+    frappe.db.sql(f"DELETE FROM `{INDEX_TABLE}` WHERE `batch` = %s", (batch_name,))
+
+
+def _index(batch_name, batch_id):
+    _insert_rows([(gram, batch_name) for gram in get_grams(batch_id)])
+
+
+@instrument
+def index_batch(doc, method=None):
+    """
+    Keep the index current for a Batch
+    DocType Event: On Update (also fires after insert)
+    """
+    if not _table_exists():
+        return
+
+    _remove(doc.name)
+    _index(doc.name, doc.batch_id)
+
+
+@instrument
+def rename_batch(doc, method=None, old=None, new=None, merge=False):
+    """
+    DocType Event: After Rename
+    """
+    if not _table_exists():
+        return
+
+    _remove(old)
+    _remove(new)
+    _index(new, frappe.db.get_value("Batch", new, "batch_id"))
+
+
+@instrument
+def remove_batch(doc, method=None):
+    """
+    DocType Event: On Trash
+    """
+    if not _table_exists():
+        return
+
+    _remove(doc.name)
+
+
+def rebuild():
+    """Rebuild the whole index from tabBatch"""
+    ensure_index_table()
+    frappe.db.set_default(BUILT_FLAG, 0)
+    frappe.db.sql_ddl(f"TRUNCATE TABLE `{INDEX_TABLE}`")
+
+    indexed = 0
+    last_name = ""
+    while True:
+        batches = frappe.db.sql("""
+            SELECT name, batch_id
+            FROM `tabBatch`
+            WHERE name > %s
+            ORDER BY name
+            LIMIT %s
+        """, (last_name, REBUILD_PAGE), as_dict=True)
+
+        if not batches:
+            break
+
+        rows = []
+        for batch in batches:
+            rows.extend((gram, batch.name) for gram in get_grams(batch.batch_id))
+        _insert_rows(rows)
+
+        indexed += len(batches)
+        last_name = batches[-1].name
+        frappe.db.commit()
+
+    frappe.db.set_default(BUILT_FLAG, 1)
+    frappe.db.commit()
+
+    return {"batches": indexed}
+
+
+def _like_scan(udi):
+    """The original lookup, used when the index cannot answer"""
+    return frappe.db.sql("""
+        SELECT name, item, batch_id
+        FROM `tabBatch`
+        WHERE batch_id LIKE %s
+    """, (f'%{udi}%',), as_dict=True)
+
+
+def find_batches(udis):
+    """
+    Find batches whose batch_id contains each UDI
+
+    A GTIN-14 also matches batch IDs holding the GTIN-12 or GTIN-13 it
+    was padded from.
+
+    Args:
+        udis: iterable of UDI strings
+
+    Returns:
+        dict mapping each UDI to a list of {name, item, batch_id} rows
+    """
+    udis = [udi for udi in dict.fromkeys(udis or []) if udi]
+    result = {udi: [] for udi in udis}
+    if not udis:
+        return result
+
+    use_index = is_built()
+    indexed = {}
+    for udi in udis:
+        search = gs1.unpadded_gtin(udi)
+        if use_index and INDEXABLE_UDI.match(search):
+            indexed[udi] = search
+        else:
+            result[udi] = _like_scan(search)
+
+    if not indexed:
+        return result
+
+    grams = tuple({search[:GRAM_SIZE] for search in indexed.values()})
+    candidates = frappe.db.sql(f"""
+        SELECT idx.gram, b.name, b.item, b.batch_id
+        FROM `{INDEX_TABLE}` idx
+        INNER JOIN `tabBatch` b ON b.name = idx.batch
+        WHERE idx.gram IN %(grams)s
+        ORDER BY b.name
+    """, {"grams": grams}, as_dict=True)
+
+    by_gram = defaultdict(list)
+    for row in candidates:
+        by_gram[row.gram].append(row)
+
+    for udi, search in indexed.items():
+        for row in by_gram[search[:GRAM_SIZE]]:
+            if search in (row.batch_id or "").upper():
+                result[udi].append(frappe._dict(name=row.name, item=row.item, batch_id=row.batch_id))
+
+    return result
@@ -0,0 +1,74 @@
+// Per-handler latency and query metrics
+frappe.pages['hook-metrics'].on_page_load = function(wrapper) {
+    let page = frappe.ui.make_app_page({
+        parent: wrapper,
+        title: __('Hook Metrics'),
+        single_column: true
+    });
+
+    let $body = $('<div class="hook-metrics"></div>').appendTo(page.main);
+
+    let columns = [
+        ['handler', __('Handler')],
+        ['doctype', __('DocType')],
+        ['event', __('Event')],
+        ['samples', __('Samples')],
+        ['p50_ms', __('p50 ms')],
+        ['p90_ms', __('p90 ms')],
+        ['p99_ms', __('p99 ms')],
+        ['max_ms', __('Max ms')],
+        ['avg_queries', __('Queries')],
+        ['avg_db_ms', __('DB ms')],
+        ['avg_redis_calls', __('Redis')],
+        ['errors', __('Errors')]
+    ];
+
+    function render(metrics) {
+        if (!metrics.length) {
+            $body.html(`<p class="text-muted">${__('No samples recorded yet.')}</p>`);
+            return;
+        }
+
+        let head = columns.map(c => `<th>${c[1]}</th>`).join('');
+        let rows = metrics.map(metric => {
+            let cells = columns.map(c => {
+                let value = metric[c[0]];
+                let css = c[0] === 'errors' && value ? ' class="text-danger"' : '';
+                return `<td${css}>${frappe.utils.escape_html(String(value ?? ''))}</td>`;
+            }).join('');
+            return `<tr>${cells}</tr>`;
+        }).join('');
+
+        $body.html(`
+            <table class="table table-bordered table-hover small">
+                <thead><tr>${head}</tr></thead>
+                <tbody>${rows}</tbody>
+            </table>
+        `);
+    }
+
+    function refresh() {
+        frappe.call({
+            method: 'surgishop_custom.logic.instrumentation.get_hook_metrics',
+            callback: function(r) {
+                render(r.message || []);
+            }
+        });
+    }
+
+    page.set_primary_action(__('Refresh'), refresh, 'refresh');
+    page.set_secondary_action(__('Reset'), function() {
+        frappe.confirm(__('Discard all recorded samples?'), function() {
+            frappe.call({
+                method: 'surgishop_custom.logic.instrumentation.reset_hook_metrics',
+                callback: refresh
+            });
+        });
+    });
+
+    refresh();
+    let timer = setInterval(function() {
+        if (frappe.get_route_str() === 'hook-metrics') refresh();
+    }, 30000);
+    $(wrapper).on('remove', () => clearInterval(timer));
+};
@@ -0,0 +1 @@
+# Patches for surgishop_custom
@@ -0,0 +1,19 @@
+"""
+Record when an auto-send claimed a Sales Invoice
+
+Stuck Sending invoices are found by claim time; the scheduled time says
+nothing about how long a backlogged invoice has been in flight.
+"""
+from frappe.custom.doctype.custom_field.custom_field import create_custom_field
+
+
+def execute():
+    create_custom_field("Sales Invoice", {
+        "fieldname": "custom_send_claimed_at",
+        "label": "Send Claimed At",
+        "fieldtype": "Datetime",
+        "insert_after": "custom_scheduled_send_time",
+        "read_only": 1,
+        "no_copy": 1,
+        "print_hide": 1,
+    })
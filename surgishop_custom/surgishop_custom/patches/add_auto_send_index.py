@@ -0,0 +1,21 @@
+"""
+Index the Sales Invoice auto-send columns
+
+The per-minute dispatcher reads due invoices and the next send time by
+status and scheduled time.
+"""
+import frappe
+
+
+def execute():
+    if not (
+        frappe.db.has_column("Sales Invoice", "custom_auto_send_status")
+        and frappe.db.has_column("Sales Invoice", "custom_scheduled_send_time")
+    ):
+        return
+
+    frappe.db.add_index(
+        "Sales Invoice",
+        ["custom_auto_send_status", "custom_scheduled_send_time"],
+        index_name="auto_send_status_time"
+    )
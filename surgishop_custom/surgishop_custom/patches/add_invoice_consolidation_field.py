@@ -0,0 +1,17 @@
+"""
+Let customers be invoiced per period instead of per Delivery Note
+"""
+from frappe.custom.doctype.custom_field.custom_field import create_custom_field
+
+from surgishop_custom.logic.consolidated_invoicing import CONSOLIDATION_FIELD
+
+
+def execute():
+    create_custom_field("Customer", {
+        "fieldname": CONSOLIDATION_FIELD,
+        "label": "Invoice Consolidation",
+        "fieldtype": "Select",
+        "options": "\nDaily\nWeekly\nMonthly",
+        "insert_after": "customer_group",
+        "description": "Invoice all Delivery Notes of the period together instead of one invoice per Delivery Note",
+    })
@@ -0,0 +1,26 @@
+"""
+Record Sales Invoices that update stock in the batch shipment lineage
+
+Renames the Delivery Note specific columns to voucher columns, adds the
+voucher type and backfills the invoices.
+"""
+import frappe
+
+from surgishop_custom.logic import shipment_lineage
+from surgishop_custom.logic.shipment_lineage import LINEAGE_TABLE
+
+
+def execute():
+    shipment_lineage.ensure_lineage_table()
+
+    if frappe.db.sql(f"SHOW COLUMNS FROM `{LINEAGE_TABLE}` LIKE 'dn_detail'"):
+        frappe.db.sql_ddl(f"""
+            ALTER TABLE `{LINEAGE_TABLE}`
+                CHANGE `dn_detail` `voucher_detail` VARCHAR(140) NOT NULL,
+                CHANGE `delivery_note` `voucher_no` VARCHAR(140) NOT NULL,
+                ADD COLUMN `voucher_type` VARCHAR(140) NOT NULL DEFAULT 'Delivery Note' AFTER `batch_no`,
+                DROP KEY `delivery_note`,
+                ADD KEY `voucher_no` (`voucher_no`)
+        """)
+
+    shipment_lineage.backfill(voucher_types=("Sales Invoice",))
@@ -0,0 +1,46 @@
+"""
+Create and fill the fuzzy Item index, and let Recall Match store fuzzy matches
+
+Adds the "Fuzzy Item Match" match type and a match_score field to Recall
+Match, as DocField changes when it is a custom DocType and as a Custom
+Field and Property Setter otherwise.
+"""
+import frappe
+from frappe.custom.doctype.custom_field.custom_field import create_custom_field
+from frappe.custom.doctype.property_setter.property_setter import make_property_setter
+
+from surgishop_custom.logic import fuzzy_index
+
+MATCH_TYPE = "Fuzzy Item Match"
+SCORE_FIELD = {
+    "fieldname": "match_score",
+    "label": "Match Score",
+    "fieldtype": "Float",
+    "precision": "3",
+    "insert_after": "match_type",
+    "read_only": 1,
+}
+
+
+def execute():
+    if frappe.db.exists("DocType", "Recall Match"):
+        doctype = frappe.get_doc("DocType", "Recall Match")
+        match_type = doctype.get("fields", {"fieldname": "match_type"})
+        options = (match_type[0].options or "") if match_type else ""
+        needs_option = match_type and match_type[0].fieldtype == "Select" and MATCH_TYPE not in options.split("\n")
+
+        if doctype.custom:
+            if needs_option:
+                match_type[0].options = f"{options}\n{MATCH_TYPE}"
+            if not doctype.get("fields", {"fieldname": SCORE_FIELD["fieldname"]}):
+                doctype.append("fields", {key: value for key, value in SCORE_FIELD.items() if key != "insert_after"})
+            doctype.save()
+        else:
+            if needs_option:
+                make_property_setter(
+                    "Recall Match", "match_type", "options", f"{options}\n{MATCH_TYPE}", "Text",
+                    validate_fields_for_doctype=False
+                )
+            create_custom_field("Recall Match", SCORE_FIELD)
+
+    fuzzy_index.rebuild()
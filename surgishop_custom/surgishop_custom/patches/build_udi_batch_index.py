@@ -0,0 +1,8 @@
+"""
+Create and fill the UDI to Batch lookup index
+"""
+from surgishop_custom.logic import udi_index
+
+
+def execute():
+    udi_index.rebuild()
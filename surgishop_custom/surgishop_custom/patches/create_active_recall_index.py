@@ -0,0 +1,14 @@
+"""
+Create the active recall index used by the reverse recall check
+
+Fingerprints are cleared so the next feed processes, and indexes, every
+recall once.
+"""
+import frappe
+
+from surgishop_custom.logic import recall_fingerprint, recall_watch
+
+
+def execute():
+    recall_watch.ensure_index_tables()
+    frappe.db.sql_ddl(f"TRUNCATE TABLE `{recall_fingerprint.FINGERPRINT_TABLE}`")
@@ -0,0 +1,9 @@
+"""
+Create and fill the batch shipment lineage table
+"""
+from surgishop_custom.logic import shipment_lineage
+
+
+def execute():
+    shipment_lineage.ensure_lineage_table()
+    shipment_lineage.backfill()
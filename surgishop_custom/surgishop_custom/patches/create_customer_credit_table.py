@@ -0,0 +1,9 @@
+"""
+Create and fill the customer credit snapshot table
+"""
+from surgishop_custom.logic import customer_credit
+
+
+def execute():
+    customer_credit.ensure_credit_table()
+    customer_credit.reconcile_all()
@@ -0,0 +1,8 @@
+"""
+Create the Delivery Note post-submit tracking table
+"""
+from surgishop_custom.logic import delivery_note
+
+
+def execute():
+    delivery_note.ensure_pipeline_table()
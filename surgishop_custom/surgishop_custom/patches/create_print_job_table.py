@@ -0,0 +1,8 @@
+"""
+Create the print job queue table
+"""
+from surgishop_custom.logic import print_queue
+
+
+def execute():
+    print_queue.ensure_print_job_table()
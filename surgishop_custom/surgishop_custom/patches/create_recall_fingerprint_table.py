@@ -0,0 +1,8 @@
+"""
+Create the recall fingerprint store
+"""
+from surgishop_custom.logic import recall_fingerprint
+
+
+def execute():
+    recall_fingerprint.ensure_fingerprint_table()
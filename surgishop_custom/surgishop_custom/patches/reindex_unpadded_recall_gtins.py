@@ -0,0 +1,13 @@
+"""
+Re-index active recall GTINs in their unpadded form
+
+Batch IDs carry GTIN-12/13 without the padding zeros. Fingerprints are
+cleared so the next feed indexes every recall again.
+"""
+import frappe
+
+from surgishop_custom.logic import recall_fingerprint
+
+
+def execute():
+    frappe.db.sql_ddl(f"TRUNCATE TABLE `{recall_fingerprint.FINGERPRINT_TABLE}`")
@@ -0,0 +1,14 @@
+"""
+Unit tests for the pure parts of surgishop_custom
+
+Run from the app directory:
+
+    python -m unittest discover -s surgishop_custom/tests -t .
+
+Outside a bench the offline fake of the benchmarks stands in for frappe.
+"""
+try:
+    import frappe  # noqa: F401
+except ImportError:
+    from surgishop_custom.benchmarks import fake_frappe
+    fake_frappe.install()
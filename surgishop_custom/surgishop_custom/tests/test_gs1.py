@@ -0,0 +1,36 @@
+import unittest
+
+from surgishop_custom.logic import gs1
+
+GTIN = "00884838087453"
+
+
+class TestGS1(unittest.TestCase):
+    def test_gtin_check_digit(self):
+        self.assertTrue(gs1.is_valid_gtin("884838087453"))
+        self.assertTrue(gs1.is_valid_gtin(GTIN))
+        self.assertFalse(gs1.is_valid_gtin("884838087452"))
+        self.assertFalse(gs1.is_valid_gtin("88483808745A"))
+
+    def test_normalize_and_unpad(self):
+        self.assertEqual(gs1.normalize_gtin(" 884838087453 "), GTIN)
+        self.assertIsNone(gs1.normalize_gtin("884838087452"))
+        self.assertEqual(gs1.unpadded_gtin(GTIN), "884838087453")
+        self.assertEqual(gs1.unpadded_gtin("10884838087450"), "10884838087450")
+
+    def test_bracketed_lot_keeps_spaces(self):
+        result = gs1.parse_code_info(f"UDI (01){GTIN}(17)251231(10)LOT 123, (21)SN 9")
+        self.assertEqual(result["gtins"], [GTIN])
+        self.assertEqual(result["lots"], ["LOT 123"])
+        self.assertEqual(result["serials"], ["SN 9"])
+        self.assertEqual(result["expiry_dates"], ["2025-12-31"])
+
+    def test_run_together_elements(self):
+        result = gs1.parse_code_info(f"UDI: 01{GTIN}17251231 10LOT5")
+        self.assertEqual(result["gtins"], [GTIN])
+        self.assertEqual(result["lots"], ["LOT5"])
+        self.assertEqual(result["expiry_dates"], ["2025-12-31"])
+
+    def test_bare_gtin_only_on_udi_lines(self):
+        self.assertEqual(gs1.parse_code_info("GTIN 884838087453")["gtins"], [GTIN])
+        self.assertEqual(gs1.parse_code_info("Phone 884838087453")["gtins"], [])
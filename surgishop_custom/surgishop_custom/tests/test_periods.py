@@ -0,0 +1,24 @@
+import unittest
+from datetime import date
+
+from surgishop_custom.logic import consolidated_invoicing, customer_credit
+
+
+class TestLockStatus(unittest.TestCase):
+    def test_thresholds(self):
+        self.assertEqual(customer_credit.get_lock_status(39), "")
+        self.assertEqual(customer_credit.get_lock_status(40), "Soft Lock")
+        self.assertEqual(customer_credit.get_lock_status(49), "Soft Lock")
+        self.assertEqual(customer_credit.get_lock_status(50), "Hard Lock")
+
+
+class TestPeriodStart(unittest.TestCase):
+    def test_periods(self):
+        # A Thursday
+        day = "2026-10-15"
+        self.assertEqual(consolidated_invoicing.period_start("Monthly", day), date(2026, 10, 1))
+        self.assertEqual(consolidated_invoicing.period_start("Weekly", day), date(2026, 10, 12))
+        self.assertEqual(consolidated_invoicing.period_start("Daily", day), date(2026, 10, 15))
+
+    def test_week_starting_on_monday(self):
+        self.assertEqual(consolidated_invoicing.period_start("Weekly", "2026-10-12"), date(2026, 10, 12))
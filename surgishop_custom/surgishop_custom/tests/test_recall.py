@@ -0,0 +1,39 @@
+import io
+import unittest
+
+from surgishop_custom.logic import recall_ingest, recall_watch
+
+
+class TestGtinWindows(unittest.TestCase):
+    def test_windows_cover_unpadded_gtins(self):
+        windows = recall_watch._gtin_windows("884838087453-L7")
+        self.assertEqual(windows, {"884838087453"})
+
+    def test_windows_of_a_long_run(self):
+        windows = recall_watch._gtin_windows("X0100884838087453")
+        self.assertIn("00884838087453", windows)
+        self.assertIn("0884838087453", windows)
+        self.assertIn("884838087453", windows)
+
+    def test_short_runs_have_no_windows(self):
+        self.assertEqual(recall_watch._gtin_windows("LOT12345678901"), set())
+        self.assertEqual(recall_watch._gtin_windows(None), set())
+
+
+class TestIterRecords(unittest.TestCase):
+    def records(self, text):
+        return list(recall_ingest.iter_records(io.StringIO(text)))
+
+    def test_array(self):
+        self.assertEqual(self.records(' [{"a": 1}, {"a": 2}] '), [{"a": 1}, {"a": 2}])
+
+    def test_results_wrapper(self):
+        text = '{"meta": {"results": {"total": 2}}, "results": [{"a": 1}, {"a": 2}]}'
+        self.assertEqual(self.records(text), [{"a": 1}, {"a": 2}])
+
+    def test_ndjson(self):
+        self.assertEqual(self.records('{"a": 1}\n{"a": 2}\n'), [{"a": 1}, {"a": 2}])
+
+    def test_truncated_array(self):
+        with self.assertRaises(ValueError):
+            self.records('[{"a": 1}, ')